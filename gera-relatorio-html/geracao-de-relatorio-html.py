@@ -1,6 +1,6 @@
 # importa as bibliotecas
-import pandas as pd, base64, os, io
-from IPython.display import display, HTML
+import pandas as pd, base64, os, io, time, sqlite3
+from multiprocessing import Pool
 from PIL import Image
 
 # define o diretório base
@@ -15,54 +15,168 @@ csv_filepath = base_dir + "base-de-dados.csv"
 # define o arquivo html de destino
 html_filepath = base_dir + "relatorio.html"
 
-# lista todos os arquivos de imagens dentro do diretório
-image_files = os.listdir(image_dir)
+# define a largura das miniaturas em pixels (a altura acompanha a proporção original)
+thumbnail_width = 150
 
-# cria um dataframe vazio com as colunas para o código e a codificação da imagem
-image_data = pd.DataFrame(columns=["codigo", "imagem"])
+# define as configurações que mudam a miniatura; se alguma mudar, as miniaturas do cache deixam de valer
+thumbnail_settings = f"largura={thumbnail_width};formato=PNG"
 
-# percorre por cada arquivo de imagem
-for image_file in image_files:
+# define o arquivo do cache de miniaturas, reaproveitadas entre execuções enquanto a imagem não muda
+cache_filepath = base_dir + "miniaturas-cache.sqlite"
+
+# define o tamanho máximo do cache (as miniaturas usadas há mais tempo são descartadas primeiro)
+cache_max_bytes = 500 * 1024 * 1024
+
+# define de quantas em quantas imagens o progresso é mostrado
+progress_every = 500
+
+# define de quantas em quantas miniaturas novas o cache é gravado durante a geração
+cache_batch = 200
+
+
+# gera a miniatura de uma imagem e devolve o caminho, o código, a miniatura codificada em base64 e o erro
+# (a miniatura é None e o erro é a mensagem quando a imagem não pôde ser lida; roda nos processos do pool,
+# por isso fica fora do bloco principal)
+def generate_thumbnail(image_path):
     # obtém o código dividindo o nome do arquivo pelo ponto e extraindo a primeira parte
-    code = image_file.split(".")[0]
-    # cria o caminho completo para o arquivo de imagem usando o diretório e o nome do arquivo
-    image_path = os.path.join(image_dir, image_file)
-    # abre a imagem usando o módulo PIL (Python Imaging Library)
-    image = Image.open(image_path)
-    # redimensiona a imagem para que a largura seja 150 pixels e a altura seja ajustada de acordo para manter a proporção original
-    image_resized = image.resize((150, int(image.size[1] * 150 / image.size[0])))
+    code = os.path.basename(image_path).split(".")[0]
+    # uma imagem com problema não pode derrubar o pool nem as miniaturas já geradas
+    try:
+        return image_path, code, encode_thumbnail(image_path), None
+    except Exception as e:
+        return image_path, code, None, str(e)
+
+
+# abre, reduz e codifica a miniatura de uma imagem em base64
+def encode_thumbnail(image_path):
+    # abre a imagem usando o módulo PIL (Python Imaging Library); só o cabeçalho é lido aqui
+    with Image.open(image_path) as image:
+        # calcula o tamanho final: largura de 150 pixels e altura ajustada para manter a proporção original
+        size = (thumbnail_width, int(image.size[1] * thumbnail_width / image.size[0]))
+        # nos JPEG, pede ao decodificador uma versão já reduzida (1/2, 1/4 ou 1/8) que ainda seja maior que a miniatura,
+        # assim uma foto de 20 MP nem chega a ser decodificada no tamanho cheio
+        image.draft(None, size)
+        # redimensiona; nos outros formatos o reducing_gap reduz primeiro por um fator inteiro (rápido) e só o final é reamostrado
+        image_resized = image.resize(size, reducing_gap = 3.0)
+    # o png não grava alguns modos (ex.: CMYK, comum em JPEG de gráfica), que são convertidos para RGB
+    if image_resized.mode not in ("1", "L", "LA", "I", "P", "RGB", "RGBA"):
+        image_resized = image_resized.convert("RGB")
     # cria um buffer de bytes para armazenar a imagem redimensionada
     image_bytes = io.BytesIO()
     # salva a imagem redimensionada no buffer usando o formato png
     image_resized.save(image_bytes, format = "PNG")
     # codifica os bytes da imagem em uma string base64 para armazenar no dataframe
-    image_str = base64.b64encode(image_bytes.getvalue()).decode("utf-8")
-    # adiciona um novo registro ao dataframe com o código e a imagem codificada
-    image_data = pd.concat([image_data, pd.DataFrame({"codigo": [code], "imagem": [image_str]})], ignore_index = True)
-
-# lê o arquivo csv com informações adicionais
-csv_data = pd.read_csv(csv_filepath, dtype = "str", delimiter = ";")
-
-# cruza os dados das imagens com os dados do arquivo csv usando a coluna de código como chave
-merged_data = pd.merge(csv_data, image_data, on = "codigo")
-
-# gera uma tabela html para exibir os dados
-html = '<table>'
-# define o estilo para as células de cabeçalho e células de dados
-style = 'style="border: 1px solid black;"'
-# define um estilo exclusivo para limitar a largura da célula de descrição
-description_style = 'style="border: 1px solid black; max-width: 600px; overflow: hidden; padding: 5px;"'
-# adiciona uma linha de cabeçalho com os nomes das colunas
-html += '<tr><th {}>Código</th><th {}>Data de Cadastro</th><th {}>Descrição</th><th {}>Imagem</th></tr>'.format(style, style, style, style)
-# percorre por cada linha do dataframe
-for index, row in merged_data.iterrows():
-    # cria uma tag html <img> para exibir a imagem no navegador
-    image_tag = '<img src="data:image/png;base64,{}">'.format(row['imagem'])
-    # adiciona uma nova linha à tabela com os dados da iteração atual
-    html += '<tr><td {}>{}</td><td {}>{}</td><td {}>{}</td><td {}>{}</td></tr>'.format(style, row['codigo'], style, row["data_de_cadastro"], description_style, row["descricao"], style, image_tag)
-# fecha a tabela adicionando a tag de fechamento
-html += '</table>'
-
-# salva o html em um arquivo
-with open(html_filepath, "w") as f:
-    f.write(html)
+    return base64.b64encode(image_bytes.getvalue()).decode("utf-8")
+
+
+# o bloco principal só roda no processo principal (no Windows os processos do pool importam este arquivo de novo)
+if __name__ == "__main__":
+    # lista todos os arquivos de imagens dentro do diretório, já com o caminho completo
+    image_paths = [os.path.join(image_dir, image_file) for image_file in os.listdir(image_dir)]
+
+    # listas com os códigos e as imagens codificadas
+    codes, images = [], []
+
+    # abre o cache de miniaturas (cria o arquivo e a tabela na primeira execução)
+    cache = sqlite3.connect(cache_filepath)
+    cache.execute("CREATE TABLE IF NOT EXISTS miniaturas (caminho TEXT PRIMARY KEY, tamanho INTEGER, modificacao INTEGER, configuracao TEXT, imagem TEXT, usada_em REAL)")
+    # lê a chave de cada miniatura guardada: tamanho e data de modificação do arquivo e configurações da miniatura
+    cached = {path: (file_size, mtime, settings) for path, file_size, mtime, settings in cache.execute("SELECT caminho, tamanho, modificacao, configuracao FROM miniaturas")}
+
+    # separa as imagens que não mudaram desde a última execução das que precisam de uma miniatura nova
+    hits, pending, keys = [], [], {}
+    for image_path in image_paths:
+        # a chave é o tamanho e a data de modificação (em nanossegundos) do arquivo, mais as configurações
+        stat = os.stat(image_path)
+        keys[image_path] = (stat.st_size, stat.st_mtime_ns, thumbnail_settings)
+        if cached.get(image_path) == keys[image_path]:
+            hits.append(image_path)
+        else:
+            pending.append(image_path)
+    # carrega as miniaturas que não mudaram direto do cache, em blocos (o SQLite limita o nº de parâmetros por consulta)
+    for i in range(0, len(hits), 500):
+        block = hits[i:i + 500]
+        for image_path, image_str in cache.execute(f"SELECT caminho, imagem FROM miniaturas WHERE caminho IN ({','.join('?' * len(block))})", block):
+            codes.append(os.path.basename(image_path).split(".")[0])
+            images.append(image_str)
+    print(f"{len(hits)} miniaturas reaproveitadas do cache, {len(pending)} a gerar")
+
+    # marca o início da geração das miniaturas
+    start = time.perf_counter()
+    # nº de miniaturas geradas e de imagens que não puderam ser lidas
+    generated, failed = 0, 0
+    # miniaturas novas ainda não gravadas no cache: (caminho, tamanho, modificação, configuração, imagem, usada em)
+    new_rows = []
+    # cria um pool com um processo por núcleo (só se houver o que gerar) e recebe cada miniatura assim que ela fica pronta, em qualquer ordem
+    if pending:
+        with Pool() as pool:
+            for image_path, code, image_str, error in pool.imap_unordered(generate_thumbnail, pending, chunksize = 8):
+                # avisa e pula a imagem que não pôde ser lida (ela fica fora do relatório e do cache)
+                if error is not None:
+                    failed += 1
+                    print(f"não foi possível gerar a miniatura de {image_path}: {error}")
+                    continue
+                # guarda o código e a imagem codificada
+                codes.append(code)
+                images.append(image_str)
+                generated += 1
+                new_rows.append((image_path, *keys[image_path], image_str, time.time()))
+                # grava as miniaturas novas no cache em blocos, para um erro no meio do caminho não perder as já geradas
+                # (substituindo as de imagens que mudaram)
+                if len(new_rows) >= cache_batch:
+                    with cache:
+                        cache.executemany("INSERT OR REPLACE INTO miniaturas VALUES (?, ?, ?, ?, ?, ?)", new_rows)
+                    new_rows = []
+                # mostra o progresso e a velocidade de tempos em tempos
+                if generated % progress_every == 0:
+                    print(f"{generated} de {len(pending)} imagens ({generated / (time.perf_counter() - start):.1f} imagens/s)")
+    # mostra o total e a velocidade média
+    elapsed = time.perf_counter() - start
+    print(f"{generated} miniaturas geradas em {elapsed:.1f} s ({generated / max(elapsed, 1e-9):.1f} imagens/s), {failed} imagens com erro")
+
+    # atualiza o cache numa única transação
+    with cache:
+        # grava as miniaturas novas que sobraram do último bloco
+        cache.executemany("INSERT OR REPLACE INTO miniaturas VALUES (?, ?, ?, ?, ?, ?)", new_rows)
+        # marca as miniaturas reaproveitadas como usadas agora
+        cache.executemany("UPDATE miniaturas SET usada_em = ? WHERE caminho = ?", [(time.time(), image_path) for image_path in hits])
+        # remove as miniaturas de imagens que não existem mais no diretório
+        gone = [(path,) for path in cached if path not in keys]
+        cache.executemany("DELETE FROM miniaturas WHERE caminho = ?", gone)
+        # acima do tamanho máximo, descarta as miniaturas usadas há mais tempo
+        evicted = cache.execute("DELETE FROM miniaturas WHERE caminho IN (SELECT caminho FROM (SELECT caminho, SUM(LENGTH(imagem)) OVER (ORDER BY usada_em DESC) AS acumulado FROM miniaturas) WHERE acumulado > ?)", (cache_max_bytes,)).rowcount
+    # depois de remover miniaturas, compacta o arquivo para ele voltar a caber no limite também em disco
+    if gone or evicted:
+        cache.execute("VACUUM")
+    cache.close()
+    print(f"cache: {len(gone)} miniaturas de imagens apagadas removidas, {evicted} descartadas pelo limite de tamanho")
+
+    # cria o dataframe com as colunas para o código e a codificação da imagem
+    image_data = pd.DataFrame({"codigo": codes, "imagem": images})
+
+    # lê o arquivo csv com informações adicionais
+    csv_data = pd.read_csv(csv_filepath, dtype = "str", delimiter = ";")
+
+    # cruza os dados das imagens com os dados do arquivo csv usando a coluna de código como chave
+    merged_data = pd.merge(csv_data, image_data, on = "codigo")
+
+    # gera uma tabela html para exibir os dados
+    html = '<table>'
+    # define o estilo para as células de cabeçalho e células de dados
+    style = 'style="border: 1px solid black;"'
+    # define um estilo exclusivo para limitar a largura da célula de descrição
+    description_style = 'style="border: 1px solid black; max-width: 600px; overflow: hidden; padding: 5px;"'
+    # adiciona uma linha de cabeçalho com os nomes das colunas
+    html += '<tr><th {}>Código</th><th {}>Data de Cadastro</th><th {}>Descrição</th><th {}>Imagem</th></tr>'.format(style, style, style, style)
+    # percorre por cada linha do dataframe
+    for index, row in merged_data.iterrows():
+        # cria uma tag html <img> para exibir a imagem no navegador
+        image_tag = '<img src="data:image/png;base64,{}">'.format(row['imagem'])
+        # adiciona uma nova linha à tabela com os dados da iteração atual
+        html += '<tr><td {}>{}</td><td {}>{}</td><td {}>{}</td><td {}>{}</td></tr>'.format(style, row['codigo'], style, row["data_de_cadastro"], description_style, row["descricao"], style, image_tag)
+    # fecha a tabela adicionando a tag de fechamento
+    html += '</table>'
+
+    # salva o html em um arquivo
+    with open(html_filepath, "w") as f:
+        f.write(html)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# bench_lineage.py
+#
+# Suíte de benchmark do build_lineage em SQL sintético.
+# Para cada combinação de parâmetros do gerador mede, separadamente, tempo de
+# parede (melhor de N) e pico de memória (tracemalloc, numa execução à parte)
+# das fases: parse (sqlglot), resolução (lineage_from_ast), build_lineage de
+# ponta a ponta (parse + resolução, com o AST liberado CTE a CTE: é o pico de
+# memória de cada arquivo no lote), serialização do lineage.json e renderização
+# do HTML. Os resultados vão para um JSON que pode ser comparado com o de outra
+# versão (--compare), com a razão dos tempos e dos picos de memória.
+#
+#   python bench_lineage.py
+#   python bench_lineage.py --ctes 50 100 200 400 --width 10 40 --out antes.json
+#   python bench_lineage.py --fan-in 1 4 --star-depth 0 8 --complexity 1 5 --out depois.json --compare antes.json
+
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import cte_lineage_builder as vsql
+
+PHASES = ("parse", "resolution", "build", "json", "html")
+
+
+def synthetic_sql(n_ctes: int, width: int, fan_in: int = 2, star_depth: int = 1, complexity: int = 1):
+    """Script com `n_ctes` CTEs de `width` colunas (C0..Cn), em blocos:
+
+    - uma CTE "calculada" que faz JOIN das `fan_in` CTEs mais recentes (aliases T0, T1, ...),
+      com colunas alternadamente qualificadas e sem qualificador; cada saída combina
+      `complexity` colunas de entrada. A cada 3 calculadas as saídas ficam sem alias
+      (ex.: TRIM(C3)), então a CTE seguinte só resolve Cj pela heurística das folhas;
+    - seguida de `star_depth` CTEs `SELECT *` que só repassam a anterior.
+    """
+    cols = [f"C{j}" for j in range(width)]
+    parts = [f"CTE_0 AS (\n  SELECT {', '.join(cols)}\n  FROM TABLE_0\n)"]
+    computed = 0
+    i = 1
+    while i < n_ctes:
+        computed += 1
+        sources = [f"CTE_{i - 1 - k}" for k in range(max(1, fan_in)) if i - 1 - k >= 0]
+        from_sql = f"FROM {sources[0]} AS T0"
+        for k, src in enumerate(sources[1:], 1):
+            from_sql += f"\n  JOIN {src} AS T{k}\n  ON T0.C0 = T{k}.C0"
+        projections = []
+        for j in range(width):
+            terms = [(f"T{(j + t) % len(sources)}." if (j + t) % 2 else "") + cols[(j + t) % width] for t in range(max(1, complexity))]
+            if computed % 3 == 0:
+                projections.append(f"TRIM({terms[0]})" if len(terms) == 1 else " + ".join(terms))
+            else:
+                projections.append(f"{' + '.join(terms)} AS {cols[j]}" if len(terms) > 1 or "." in terms[0] else terms[0])
+        parts.append(f"CTE_{i} AS (\n  SELECT {', '.join(projections)}\n  {from_sql}\n)")
+        i += 1
+        for _ in range(star_depth):
+            if i >= n_ctes:
+                break
+            parts.append(f"CTE_{i} AS (\n  SELECT *\n  FROM CTE_{i - 1}\n)")
+            i += 1
+    return "WITH " + "\n, ".join(parts) + f"\nSELECT *\nFROM CTE_{n_ctes - 1}"
+
+
+def _measure(fn, repeat):
+    """(melhor tempo em s, pico de memória em bytes, resultado)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+
+def _render_html_cold(data):
+    """render_html sem o layout memorizado nas repetições anteriores (o layout entra na medição)."""
+    vsql._layout_memo.clear()
+    return vsql.render_html(data)
+
+
+def bench_case(params, repeat=3):
+    sql = synthetic_sql(**params)
+    metrics = {}
+    t, peak, ast = _measure(lambda: vsql.parse_one(sql), repeat)
+    metrics["parse"] = {"seconds": t, "peak_bytes": peak}
+    t, peak, data = _measure(lambda: vsql.lineage_from_ast(ast), repeat)
+    metrics["resolution"] = {"seconds": t, "peak_bytes": peak}
+    t, peak, _ = _measure(lambda: vsql.build_lineage(sql), repeat)
+    metrics["build"] = {"seconds": t, "peak_bytes": peak}
+    t, peak, _ = _measure(lambda: json.dumps(data["cte_json"], indent=2, ensure_ascii=False), repeat)
+    metrics["json"] = {"seconds": t, "peak_bytes": peak}
+    t, peak, _ = _measure(lambda: _render_html_cold(data), repeat)
+    metrics["html"] = {"seconds": t, "peak_bytes": peak}
+    return {
+        "params": params,
+        "sql_bytes": len(sql.encode("utf-8")),
+        "columns": sum(len(c) for c in data["columns_by_cte"].values()),
+        "col_links": len(data["col_links"]),
+        "phases": metrics,
+    }
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _case_key(case):
+    return tuple(sorted(case["params"].items()))
+
+
+def print_table(cases, baseline=None):
+    old = {_case_key(c): c for c in (baseline or {}).get("cases", [])}
+    header = f"{'ctes':>5} {'larg':>5} {'fan':>4} {'*':>3} {'expr':>4} {'colunas':>8}"
+    for ph in PHASES:
+        header += f" {ph + ' (s)':>15} {'MB':>13}"
+    print(header)
+    for c in cases:
+        p = c["params"]
+        row = f"{p['n_ctes']:>5} {p['width']:>5} {p['fan_in']:>4} {p['star_depth']:>3} {p['complexity']:>4} {c['columns']:>8}"
+        prev = old.get(_case_key(c))
+        for ph in PHASES:
+            m = c["phases"][ph]
+            cell = f"{m['seconds']:.3f}"
+            mb = f"{m['peak_bytes'] / 2**20:.1f}"
+            old_m = prev["phases"].get(ph) if prev else None  # fase nova: sem comparação
+            if old_m:
+                cell += f" ×{m['seconds'] / max(old_m['seconds'], 1e-9):.2f}"
+                mb += f" ×{m['peak_bytes'] / max(old_m['peak_bytes'], 1):.2f}"
+            row += f" {cell:>15} {mb:>13}"
+        print(row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Suíte de benchmark do build_lineage em SQL sintético.")
+    parser.add_argument("--ctes", type=int, nargs="+", default=[25, 100, 400], help="nº de CTEs")
+    parser.add_argument("--width", type=int, nargs="+", default=[8, 64], help="colunas por CTE")
+    parser.add_argument("--fan-in", type=int, nargs="+", default=[2], help="CTEs unidas por JOIN em cada CTE calculada")
+    parser.add_argument("--star-depth", type=int, nargs="+", default=[1], help="CTEs SELECT * após cada CTE calculada")
+    parser.add_argument("--complexity", type=int, nargs="+", default=[1], help="colunas combinadas por expressão")
+    parser.add_argument("--repeat", type=int, default=3, help="repetições por fase (vale o melhor tempo)")
+    parser.add_argument("--out", default="bench_results.json", help="arquivo JSON com os resultados")
+    parser.add_argument("--compare", default=None, help="JSON de uma execução anterior para comparar os tempos")
+    args = parser.parse_args(argv)
+
+    cases = []
+    for n, w, f, s, c in itertools.product(args.ctes, args.width, args.fan_in, args.star_depth, args.complexity):
+        params = {"n_ctes": n, "width": w, "fan_in": f, "star_depth": s, "complexity": c}
+        cases.append(bench_case(params, args.repeat))
+        print(f"   {params} ok", file=sys.stderr)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sqlglot": getattr(sys.modules.get("sqlglot"), "__version__", None),
+            "repeat": args.repeat,
+        },
+        "cases": cases,
+    }
+    baseline = json.loads(Path(args.compare).read_text(encoding="utf-8")) if args.compare else None
+    print_table(cases, baseline)
+    Path(args.out).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(f"✅ {args.out} gerado.")
+
+
+if __name__ == "__main__":
+    main()
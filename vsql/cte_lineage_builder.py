@@ -0,0 +1,2112 @@
+# -*- coding: utf-8 -*-
+# cte_lineage_builder.py
+#
+# Biblioteca da linhagem de colunas entre CTEs: build_lineage, renderizadores
+# (lineage.json, formato compacto, HTML), lote, reanálise incremental e
+# streaming. Importar o módulo não faz trabalho nenhum: o sqlglot só é
+# carregado no primeiro parse e toda saída em disco passa por chamadas
+# explícitas (write_lineage, write_html, run_batch...). A linha de comando
+# fica em projeto-vsql.py.
+#
+#   from cte_lineage_builder import build_lineage, write_html
+#   data = build_lineage(sql, dialect="snowflake")
+#   write_html(data, "cte_lineage.html")
+
+from __future__ import annotations
+
+import base64
+import glob
+import hashlib
+import json
+import mmap
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+from lineage_cache import DEFAULT_MAX_BYTES, LineageCache, cache_key
+from lineage_catalog import LineageCatalog
+from lineage_compact import write_lineage_compact
+from lineage_layout import layered_layout, layout_key
+from lineage_profile import NULL_PROFILER
+
+
+# =========================
+# Dependência (carregada sob demanda)
+# =========================
+def _sqlglot():
+    try:
+        import sqlglot
+    except ImportError as e:
+        raise ImportError("sqlglot não está instalado: pip install 'sqlglot>=19.0.0'") from e
+    return sqlglot
+
+class _LazyExpressions:
+    """Substituto de `sqlglot.expressions` até o primeiro uso: aí importa o sqlglot e se troca,
+    nos globais do módulo, pelo módulo real (os acessos seguintes não passam mais por aqui)."""
+
+    def __getattr__(self, attr):
+        global exp
+        _sqlglot()
+        from sqlglot import expressions
+        exp = expressions
+        return getattr(expressions, attr)
+
+exp = _LazyExpressions()
+
+def parse_one(sql, read=None):
+    """sqlglot.parse_one, com o sqlglot importado só na primeira chamada."""
+    return _sqlglot().parse_one(sql, read=read)
+
+
+# =========================
+# 1) Utilitários de parsing
+# =========================
+# Instrumentação (--profile): desligada por padrão
+_profiler = NULL_PROFILER
+
+def set_profiler(profiler):
+    """Liga (Profiler) ou desliga (None) a instrumentação; retorna a anterior."""
+    global _profiler
+    previous = _profiler
+    _profiler = profiler or NULL_PROFILER
+    return previous
+
+def table_alias_of(tbl: exp.Table):
+    alias = None
+    a = tbl.args.get("alias")
+    if a and isinstance(a, exp.TableAlias):
+        id_ = a.this
+        if isinstance(id_, exp.Identifier):
+            alias = id_.name
+    return alias
+
+FINAL_SCOPE = "FINAL_QUERY"
+
+def scan_scopes(ast: exp.Expression):
+    """Percorre a árvore uma única vez e monta a tabela de escopos.
+
+    Cada CTE é um escopo; o que está fora de qualquer CTE pertence à query final.
+    Retorna (cte_scopes, final_scope), onde cte_scopes está em pós-ordem (CTEs aninhadas
+    antes da CTE que as contém; irmãs na ordem de definição) e cada escopo é um dict:
+       - name: nome da CTE (ou FINAL_QUERY)
+       - node: nó exp.CTE (None na query final)
+       - select: Select principal do escopo (o mais externo), ou None
+       - sources: [(nome_base, alias)] das tabelas/CTEs referenciadas no escopo, em ordem
+    """
+    final_scope = {"name": FINAL_SCOPE, "node": None, "select": None, "sources": []}
+    cte_scopes = []
+    # pilha de (nó, escopo, saindo?) — DFS em pré-ordem; a CTE é registrada ao sair
+    stack = [(ast, final_scope, False)]
+    while stack:
+        node, scope, leaving = stack.pop()
+        if leaving:
+            cte_scopes.append(scope)
+            continue
+        if isinstance(node, exp.CTE):
+            scope = {"name": node.alias_or_name, "node": node, "select": None, "sources": []}
+            stack.append((node, scope, True))
+        elif isinstance(node, exp.Table):
+            scope["sources"].append((node.name, table_alias_of(node)))
+        elif isinstance(node, exp.Select) and scope["select"] is None:
+            scope["select"] = node
+        children = list(node.iter_expressions())
+        for child in reversed(children):
+            stack.append((child, scope, False))
+    return cte_scopes, final_scope
+
+def predecessors_and_aliases(sources, known_cte_names):
+    """Retorna:
+       - predecessors: CTEs usadas diretamente no FROM/JOIN (dict ordenado por aparição, usado como set)
+       - alias_map: dict alias->cte_name (ou table_name)
+    """
+    predecessors = {}
+    alias_map = {}
+
+    for name, alias in sources:
+        # nome base (CTE ou tabela física)
+        if name in known_cte_names:
+            predecessors[name] = None
+        alias_map[alias or name] = name
+    return predecessors, alias_map
+
+def select_projections(sel: exp.Select):
+    """Lista de expressões do SELECT (exp) na ordem."""
+    # Alguns dialetos podem usar sel.expressions, outros .args['expressions']
+    exps = list(sel.expressions)
+    return exps
+
+def output_name_of(expr: exp.Expression):
+    """Nome 'apresentável' da coluna de saída."""
+    if isinstance(expr, exp.Alias):
+        return expr.alias
+    # Column simples
+    if isinstance(expr, exp.Column):
+        return expr.name
+    # Func/Expr: retornar SQL legível
+    s = expr.sql()
+    # limpar quebras grandes
+    return s.replace("\n", " ").strip()
+
+def columns_referenced(expr: exp.Expression):
+    """Lista de exp.Column referenciadas dentro de uma expressão."""
+    return list(expr.find_all(exp.Column))
+
+def qual_of(col: exp.Column):
+    """Retorna (qualificador, nome_col). qualificador pode ser None."""
+    q = col.table
+    return q, col.name
+
+def expr_fingerprint(expr: exp.Expression):
+    """Texto estável da estrutura de uma expressão (tipos dos nós, nomes dos argumentos e valores),
+    com identificadores sem aspas em minúsculas. Bem mais barato que gerar o SQL da expressão."""
+    parts = []
+    for node in expr.walk():
+        parts.append(node.key)
+        for k, v in node.args.items():
+            if isinstance(v, str):
+                if node.key == "identifier" and not node.args.get("quoted"):
+                    v = v.lower()
+                parts.append(f"{k}={v}")
+            elif isinstance(v, list):
+                parts.append(f"{k}[{len(v)}]")
+            elif v is not None and not isinstance(v, bool):
+                parts.append(k)
+    return "\x1f".join(parts)
+
+def pretty_sql(node: exp.Expression):
+    with _profiler.phase("pretty_sql"):
+        return node.sql(pretty=True)
+
+def pretty_scope_sql(sel: exp.Expression):
+    """SQL do Select de um escopo sem a cláusula WITH (as CTEs já têm o próprio texto)."""
+    key = "with_" if "with_" in sel.arg_types else "with"
+    with_ = sel.args.get(key)
+    if with_ is None:
+        return pretty_sql(sel)
+    sel.set(key, None)
+    try:
+        return pretty_sql(sel)
+    finally:
+        sel.set(key, with_)
+
+def projection_plan(sel: exp.Select):
+    """Resumo das projeções de um Select, suficiente para resolver a linhagem sem o AST:
+    [(expr_hash, out_name, [(qualificador, nome_col), ...])], com out_name None para *.
+    expr_hash é o digest de expr_fingerprint; os nomes são internados (sys.intern)."""
+    with _profiler.phase("projection_plan"):
+        return _projection_plan(sel)
+
+def _projection_plan(sel):
+    plan = []
+    intern = sys.intern
+    for e in select_projections(sel):
+        expr_hash = _digest((expr_fingerprint(e),))
+        if isinstance(e, exp.Star) or isinstance(e, exp.Column) and e.name == "*" :
+            plan.append((expr_hash, None, []))
+            continue
+        # dentro da expressão, capturar colunas referenciadas
+        cols = columns_referenced(e if not isinstance(e, exp.Alias) else e.this)
+        plan.append((expr_hash, intern(output_name_of(e)),
+                     [(q and intern(q), intern(c)) for q, c in map(qual_of, cols)]))
+    return plan
+
+def set_operation_branches(root: exp.Expression):
+    """[(plan, sources)] dos ramos de uma operação de conjunto (UNION/INTERSECT/EXCEPT) no topo de `root`,
+    da esquerda para a direita: o projection_plan de cada ramo e as tabelas [(nome_base, alias)] dele.
+    [] se `root` não é uma operação de conjunto."""
+    # exp.SetOperation só existe nas versões recentes do sqlglot; nas antigas, Intersect e Except
+    # derivam de Union
+    set_operation = getattr(exp, "SetOperation", exp.Union)
+    if not isinstance(root, set_operation):
+        return []
+    branches = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, set_operation):
+            stack.extend((node.right, node.left))
+        elif isinstance(node, exp.Subquery):
+            stack.append(node.this)
+        elif isinstance(node, exp.Select):
+            branches.append((projection_plan(node), [(t.name, table_alias_of(t)) for t in node.find_all(exp.Table)]))
+    return branches
+
+def _digest(parts):
+    h = hashlib.blake2b(digest_size=8)
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+# =========================
+# 2) Construção da linhagem
+# =========================
+class LineageTimeout(BaseException):
+    """A análise passou do prazo rígido do LineageBudget (ver build_lineage).
+    Deriva de BaseException, como KeyboardInterrupt: o alarme pode disparar dentro do sqlglot, e um
+    `except Exception` de lá não pode transformar o cancelamento em erro de parse."""
+
+
+# O prazo do budget é verificado entre CTEs (o que falta é pulado); um parse ou uma CTE que não
+# terminam são cancelados por um alarme após HARD_TIMEOUT_FACTOR × timeout.
+HARD_TIMEOUT_FACTOR = 2
+
+class LineageBudget:
+    """Limites de uma análise (None = sem limite) e o que foi cortado por eles. Um por query.
+
+       - timeout: segundos de parede; ao estourar, as CTEs restantes (e a query final) não são
+         resolvidas e ficam em skipped_ctes
+       - max_leaves: tamanho máximo de um conjunto de folhas (heurística para colunas que chegam
+         por SELECT * / renomeações); conjuntos maiores são cortados
+       - max_fallback_edges: nº máximo de arestas criadas pelos fallbacks (coluna ambígua
+         "conecta a todos" e coluna não resolvida); as excedentes são descartadas
+
+    Quando algum limite corta a linhagem, report() descreve o corte e o resultado é parcial.
+    """
+
+    def __init__(self, timeout=None, max_leaves=None, max_fallback_edges=None):
+        self.timeout = timeout
+        self.max_leaves = max_leaves
+        self.max_fallback_edges = max_fallback_edges
+        self.deadline = None
+        self.fallback_edges = 0
+        self.dropped_fallback_edges = 0
+        self.truncated_leaf_sets = 0
+        self.skipped_ctes = []
+
+    def limits(self):
+        return {"timeout": self.timeout, "max_leaves": self.max_leaves, "max_fallback_edges": self.max_fallback_edges}
+
+    def start(self):
+        if self.timeout is not None:
+            self.deadline = time.perf_counter() + self.timeout
+
+    def expired(self):
+        return self.deadline is not None and time.perf_counter() > self.deadline
+
+    def take_fallback(self, edges):
+        """As arestas de fallback que ainda cabem no limite (as demais são contadas e descartadas)."""
+        if self.max_fallback_edges is None:
+            return edges
+        room = max(0, self.max_fallback_edges - self.fallback_edges)
+        self.fallback_edges += min(room, len(edges))
+        if len(edges) > room:
+            self.dropped_fallback_edges += len(edges) - room
+            return edges[:room]
+        return edges
+
+    def truncate_leaves(self, parts):
+        """União dos conjuntos de folhas, parando em max_leaves."""
+        acc = set()
+        for p in parts:
+            acc |= p
+            if len(acc) > self.max_leaves:
+                self.truncated_leaf_sets += 1
+                return frozenset(sorted(acc)[:self.max_leaves])
+        return frozenset(acc)
+
+    def report(self):
+        """None se nada foi cortado; senão o que foi cortado e os limites usados."""
+        reasons = []
+        if self.skipped_ctes:
+            reasons.append("timeout")
+        if self.truncated_leaf_sets:
+            reasons.append("max_leaves")
+        if self.dropped_fallback_edges:
+            reasons.append("max_fallback_edges")
+        if not reasons:
+            return None
+        return {
+            "reasons": reasons,
+            "skipped_ctes": self.skipped_ctes,
+            "truncated_leaf_sets": self.truncated_leaf_sets,
+            "dropped_fallback_edges": self.dropped_fallback_edges,
+            "limits": self.limits(),
+        }
+
+
+class _HardDeadline:
+    """Alarme (SIGALRM) que levanta LineageTimeout após `seconds`. Só no processo principal de
+    sistemas POSIX (como nos workers do pool); nos demais casos não faz nada."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.armed = False
+
+    def __enter__(self):
+        import signal
+        import threading
+
+        if self.seconds is None or not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+            return self
+
+        def expire(signum, frame):
+            raise LineageTimeout(f"análise cancelada após {self.seconds:g}s")
+
+        self.previous = signal.signal(signal.SIGALRM, expire)
+        signal.setitimer(signal.ITIMER_REAL, self.seconds)
+        self.armed = True
+        return self
+
+    def __exit__(self, *exc):
+        if self.armed:
+            import signal
+
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous)
+        return False
+
+
+class ColumnOutput:
+    """Coluna de saída de um escopo (CTE ou FINAL_QUERY) durante a resolução.
+
+    Guarda só o necessário para a linhagem, sem referência ao AST do sqlglot:
+       - name: nome da coluna (internado)
+       - expr_hash: digest da expressão (ver projection_plan)
+       - immediate_deps: [(cte_or_table, out_col_name_or_base, is_cte_out)]
+       - dep_outputs: [ColumnOutput de origem ou None (tabela física)], na ordem de immediate_deps
+       - leaves: frozenset((cte, col)) | None
+    """
+
+    __slots__ = ("name", "expr_hash", "immediate_deps", "dep_outputs", "leaves")
+
+    def __init__(self, name, expr_hash, immediate_deps, dep_outputs, leaves=None):
+        self.name = name
+        self.expr_hash = expr_hash
+        self.immediate_deps = immediate_deps
+        self.dep_outputs = dep_outputs
+        self.leaves = leaves
+
+
+class LineageResolver:
+    """Estado da resolução de colunas entre CTEs.
+
+    outputs[name] = [ColumnOutput, ...] na ordem das projeções.
+    leaves só é calculado quando a heurística precisa (ver leaves_of) e é compartilhado, sem cópia,
+    entre colunas que apenas repassam outra (SELECT *, renomeações).
+
+    Índices por CTE, para não varrer outputs[name] a cada coluna referenciada:
+    by_name[name] = { out_name: output }  (primeira ocorrência, como list.index)
+    by_leaf[name] = { leaf_col: [out_name, ...] }  (índice invertido das folhas, montado sob demanda)
+    """
+
+    def __init__(self, budget: LineageBudget = None):
+        self.budget = budget
+        self.outputs = {}
+        self.by_name = {}
+        self.by_leaf = {}
+        # Folhas de tabelas físicas: um frozenset por par, reaproveitado
+        self.base_leaves = {}
+
+    def register_outputs(self, name, outs):
+        self.outputs[name] = outs
+        self.by_leaf.pop(name, None)
+        idx = {}
+        for o in outs:
+            idx.setdefault(o.name, o)
+        self.by_name[name] = idx
+
+    def forget(self, name):
+        self.outputs.pop(name, None)
+        self.by_name.pop(name, None)
+        self.by_leaf.pop(name, None)
+
+    def leaf_index(self, src):
+        idx = self.by_leaf.get(src)
+        if idx is None:
+            with _profiler.phase("leaf_index"):
+                idx = {}
+                for o in self.outputs[src]:
+                    for leaf_col in {leaf_col for (_s, leaf_col) in self.leaves_of(o)}:
+                        idx.setdefault(leaf_col, []).append(o.name)
+                self.by_leaf[src] = idx
+        return idx
+
+    # Para expandir SELECT * quando origem é CTE
+    def expand_star_from_cte(self, src_cte):
+        return [o.name for o in self.outputs.get(src_cte, [])]
+
+    # Output de origem de uma dependência, fixado no momento da resolução
+    def dependency_output(self, dep):
+        # dep = (source_name, source_output_name_or_base, is_from_cte_output)
+        s_name, s_col, is_cte_out = dep
+        if is_cte_out and s_name in self.outputs:
+            # encontrar o output na CTE de origem
+            return self.by_name[s_name].get(s_col)
+        return None
+
+    # Computa leaves sob demanda (iterativo: cadeias profundas não estouram a pilha) e memoiza no output
+    def leaves_of(self, out):
+        if out.leaves is not None:
+            return out.leaves
+        with _profiler.phase("leaf_closure"):
+            return self._leaves_of(out)
+
+    def _leaves_of(self, out):
+        stack = [out]
+        while stack:
+            o = stack[-1]
+            if o.leaves is not None:
+                stack.pop()
+                continue
+            pending = [u for u in o.dep_outputs if u is not None and u.leaves is None]
+            if pending:
+                stack.extend(pending)
+                continue
+            parts = []
+            for dep, u in zip(o.immediate_deps, o.dep_outputs):
+                if u is not None:
+                    parts.append(u.leaves)
+                else:
+                    # base/física ou não mapeado a output da CTE → folha é o próprio par
+                    pair = (dep[0], dep[1])
+                    leaf = self.base_leaves.get(pair)
+                    if leaf is None:
+                        leaf = self.base_leaves[pair] = frozenset((pair,))
+                    parts.append(leaf)
+            if not parts:
+                o.leaves = frozenset()
+            elif len(parts) == 1 or all(p is parts[0] for p in parts):
+                o.leaves = parts[0]
+                _profiler.count("leaf_sets_shared")
+            elif self.budget is not None and self.budget.max_leaves is not None:
+                o.leaves = self.budget.truncate_leaves(parts)
+                _profiler.count("leaf_sets_built")
+            else:
+                o.leaves = frozenset().union(*parts)
+                _profiler.count("leaf_sets_built")
+            _profiler.observe("leaf_set_size", len(o.leaves))
+            stack.pop()
+        return out.leaves
+
+    def resolve_column(self, qual, colname, predecessors, alias_map):
+        """Resolve uma coluna referenciada para [(cte_or_table, out_col, is_cte_out)] com heurísticas."""
+        _profiler.count("columns_resolved")
+        if qual:
+            # qualificador pode ser alias → resolver no alias_map
+            candidate_sources = [alias_map.get(qual, qual)]
+        else:
+            # sem qualificador: tentar desambiguar pelo(s) predecessor(es)
+            # (se só há um, assumir; senão, tentar por nome de output existente ou por folhas)
+            candidate_sources = list(predecessors)
+            if not candidate_sources:
+                # sem CTEs no FROM: com uma única tabela física a coluna só pode vir dela
+                tables = list(dict.fromkeys(alias_map.values()))
+                if len(tables) == 1:
+                    return [(tables[0], colname, False)]
+
+        for src in candidate_sources:
+            if src in self.outputs:
+                # src é CTE conhecida → tentar match direto pelo output
+                if colname in self.by_name[src]:
+                    return [(src, colname, True)]
+                # Heurística: procurar por folhas que contenham base colname
+                hits = self.leaf_index(src).get(colname)
+                if hits:
+                    # um único acerto, ou ambíguo: conecta a todos
+                    _profiler.count("heuristic_leaf_match" if len(hits) == 1 else "heuristic_ambiguous")
+                    _profiler.observe("ambiguous_fanout", len(hits))
+                    if len(hits) > 1 and self.budget is not None:
+                        hits = self.budget.take_fallback(hits)
+                    return [(src, h, True) for h in hits]
+            else:
+                # src é tabela física
+                return [(src, colname, False)]
+
+        # fallback: se não conseguiu, conecta a todos predecessores como base
+        if candidate_sources:
+            _profiler.count("fallback_unresolved")
+        edges = [(src, colname, src in self.outputs) for src in candidate_sources]
+        if self.budget is not None:
+            edges = self.budget.take_fallback(edges)
+        return edges
+
+    def derive_outputs(self, plan, predecessors, alias_map, star_requires_outputs):
+        outs = []
+        # Heurística para expandir SELECT * quando única origem é CTE conhecida
+        only_cte_src = list(predecessors)[0] if len(predecessors) == 1 else None
+        if star_requires_outputs and only_cte_src not in self.outputs:
+            only_cte_src = None
+
+        for expr_hash, out_name, cols in plan:
+            # * (Star) → expandir da CTE única; se múltiplas origens ou tabela física, manter como "*"
+            if out_name is None:
+                if only_cte_src is not None:
+                    _profiler.count("star_expansions")
+                    for nm in self.expand_star_from_cte(only_cte_src):
+                        outs.append(ColumnOutput(nm, expr_hash, [(only_cte_src, nm, True)],
+                                                 [self.by_name[only_cte_src][nm]]))
+                else:
+                    outs.append(ColumnOutput("*", expr_hash, [], [], frozenset()))
+                continue
+
+            deps = []
+            for qual, colname in cols:
+                deps.extend(self.resolve_column(qual, colname, predecessors, alias_map))
+
+            outs.append(ColumnOutput(out_name, expr_hash, deps, [self.dependency_output(d) for d in deps]))
+        return outs
+
+    def derive_set_operation(self, branches, known_cte_names):
+        """Outputs de uma query final UNION/INTERSECT/EXCEPT (branches: set_operation_branches).
+
+        Cada ramo é resolvido com as próprias tabelas, e as dependências de cada posição são juntadas
+        às da coluna do 1º ramo, que dá o nome (e o expr_hash cobre todos os ramos). Um ramo com outro
+        nº de colunas ou com * não expandido fica de fora.
+        """
+        outs = None
+        for plan, sources in branches:
+            predecessors, alias_map = predecessors_and_aliases(sources, known_cte_names)
+            branch = self.derive_outputs(plan, predecessors, alias_map, star_requires_outputs=True)
+            if outs is None:
+                outs = branch
+                continue
+            if len(branch) != len(outs) or any(o.name == "*" for o in outs + branch):
+                continue
+            merged = []
+            for o, b in zip(outs, branch):
+                deps, dep_outputs = list(o.immediate_deps), list(o.dep_outputs)
+                for d, d_out in zip(b.immediate_deps, b.dep_outputs):
+                    if d not in deps:
+                        deps.append(d)
+                        dep_outputs.append(d_out)
+                merged.append(ColumnOutput(o.name, _digest((o.expr_hash, b.expr_hash)), deps, dep_outputs))
+            outs = merged
+        return outs
+
+
+def build_lineage(sql: str, dialect=None, prune=False, budget: LineageBudget = None):
+    """Linhagem do script. Com prune=True, só o que chega à query final é resolvido (ver lineage_from_ast).
+
+    Com budget (LineageBudget), os limites valem para esta análise: o resultado cortado por eles
+    ganha "partial" (budget.report()), e um parse ou uma CTE que passam de HARD_TIMEOUT_FACTOR ×
+    timeout são cancelados com LineageTimeout.
+    """
+    hard = None
+    if budget is not None:
+        budget.start()
+        if budget.timeout is not None:
+            hard = budget.timeout * HARD_TIMEOUT_FACTOR
+    with _HardDeadline(hard):
+        with _profiler.phase("parse"):
+            ast = parse_one(sql, read=dialect)  # programa com várias CTEs + query final
+        # o AST é só nosso: cada CTE é liberada assim que processada
+        return lineage_from_ast(ast, prune, release_ast=True, budget=budget)
+
+def live_ctes(roots, preds_by_scope):
+    """CTEs alcançáveis a partir de `roots` seguindo os predecessores (fecho transitivo)."""
+    live = set()
+    stack = list(roots)
+    while stack:
+        name = stack.pop()
+        if name in live:
+            continue
+        live.add(name)
+        stack.extend(preds_by_scope.get(name, ()))
+    return live
+
+def detach_top_level_ctes(ast: exp.Expression):
+    """Esvazia o WITH da raiz e retorna os ids dos nós exp.CTE retirados: daí em diante cada CTE
+    só é referenciada pelo seu escopo (ver scan_scopes)."""
+    key = "with_" if "with_" in ast.arg_types else "with"
+    with_ = ast.args.get(key)
+    if with_ is None:
+        return set()
+    ctes = list(with_.expressions)
+    with_.set("expressions", [])
+    return {id(c) for c in ctes}
+
+def release_subtree(node: exp.Expression):
+    """Desfaz os ponteiros filho→pai da subárvore. Sem esses ciclos, a contagem de referências
+    libera a subárvore assim que o último escopo a solta, sem esperar o coletor de ciclos (que
+    passa raramente pelos objetos antigos, como os do AST)."""
+    for n in node.walk():
+        n.parent = None
+
+def lineage_from_ast(ast: exp.Expression, prune=False, release_ast=False, budget: LineageBudget = None):
+    """Linhagem a partir do AST já parseado.
+
+    Com release_ast=True o AST é desmontado durante a análise: as CTEs de nível superior saem da
+    árvore e cada uma é liberada logo depois de formatada e resumida (projection_plan), então o
+    pico de memória não soma a árvore inteira aos outputs. Use só quando o AST não for mais usado.
+
+    Com budget (LineageBudget), as CTEs que começariam depois do prazo não são resolvidas, e os
+    cortes de folhas e de arestas de fallback ficam em "partial" (ver LineageBudget.report).
+
+    Com prune=True e uma query final, as CTEs que não chegam a ela (direta ou indiretamente) não são
+    formatadas nem resolvidas, e as colunas das CTEs restantes que não alimentam nenhuma coluna da
+    query final são descartadas (prune_dead_columns). O resultado ganha "dead_ctes" (na ordem do
+    script) e "dead_columns" (nº de colunas descartadas).
+    """
+    with _profiler.phase("scan_scopes"):
+        cte_scopes, final_scope = scan_scopes(ast)
+    top_level = detach_top_level_ctes(ast) if release_ast else set()
+    cte_order = [sc["name"] for sc in cte_scopes]
+    scope_map = {sc["name"]: sc for sc in cte_scopes}
+    known_cte_names = set(cte_order)
+    # predecessores/aliases de cada escopo, calculados uma única vez
+    scope_refs = {name: predecessors_and_aliases(sc["sources"], known_cte_names) for name, sc in scope_map.items()}
+    preds_by_scope = {name: preds for name, (preds, _) in scope_refs.items()}
+
+    final_select = final_scope["select"]
+    final_preds, final_aliases = {}, {}
+    if final_select:
+        final_preds, final_aliases = predecessors_and_aliases(final_scope["sources"], known_cte_names)
+
+    # CTEs mortas: nenhuma coluna delas pode chegar à query final
+    dead_ctes = []
+    if prune and final_select:
+        live = live_ctes(final_preds, preds_by_scope)
+        dead_ctes = [name for name in cte_order if name not in live]
+        cte_order = [name for name in cte_order if name in live]
+        _profiler.count("dead_ctes", len(dead_ctes))
+
+    def release(name):
+        scope = scope_map[name]
+        if id(scope["node"]) in top_level:
+            release_subtree(scope["node"])
+        scope["node"] = scope["select"] = None
+
+    if release_ast:
+        for name in dead_ctes:
+            release(name)
+
+    resolver = LineageResolver(budget)
+    # Texto SQL da CTE:
+    cte_sql_text = {}
+
+    # 1) Percorre CTEs em ordem, derivando outputs e dependências imediatas
+    for cte_name in cte_order:
+        # Select mais externo da CTE (se o corpo for um Subquery/UNION, o primeiro Select)
+        sel = scope_map[cte_name]["select"]
+        if sel is None:
+            continue
+        if budget is not None and budget.expired():
+            budget.skipped_ctes.append(cte_name)
+            sel = None
+            if release_ast:
+                release(cte_name)
+            continue
+
+        cte_sql_text[cte_name] = pretty_sql(sel)
+
+        predecessors, alias_map = scope_refs[cte_name]
+        plan = projection_plan(sel)
+        sel = None
+        if release_ast:
+            release(cte_name)
+        with _profiler.phase("resolution"):
+            resolver.register_outputs(cte_name, resolver.derive_outputs(plan, predecessors, alias_map, star_requires_outputs=False))
+
+    # 2) Query final (fora das CTEs): só as tabelas/CTEs referenciadas no próprio escopo final
+    final_skipped = bool(final_select) and budget is not None and budget.expired()
+    if final_skipped:
+        budget.skipped_ctes.append(FINAL_SCOPE)
+    if final_select and not final_skipped:
+        # UNION/INTERSECT/EXCEPT no topo: todos os ramos alimentam as colunas da query final
+        branches = set_operation_branches(ast)
+        cte_sql_text[FINAL_SCOPE] = pretty_scope_sql(ast if branches else final_select)
+        with _profiler.phase("resolution"):
+            if branches:
+                outs = resolver.derive_set_operation(branches, known_cte_names)
+            else:
+                outs = resolver.derive_outputs(projection_plan(final_select), final_preds, final_aliases, star_requires_outputs=True)
+            resolver.register_outputs(FINAL_SCOPE, outs)
+
+    preds_by_scope[FINAL_SCOPE] = final_preds
+    with _profiler.phase("assemble"):
+        data = assemble_lineage(cte_order, preds_by_scope, resolver.outputs, cte_sql_text)
+    if prune and final_select:
+        data = prune_dead_columns(data)
+        data["dead_ctes"] = dead_ctes
+    partial = budget.report() if budget is not None else None
+    if partial:
+        data["partial"] = partial
+    return data
+
+def column_hashes(cte_nodes, outputs):
+    """{cte: [hash por coluna de saída]} — hash estrutural (Merkle) de cada coluna.
+
+    O hash cobre a expressão normalizada (expr_hash) e, na ordem, as dependências
+    imediatas: o hash da coluna de origem, para CTEs, ou "tabela.coluna", para tabelas físicas.
+    Assim uma mudança numa coluna muda o hash de tudo que está abaixo dela, e hashes iguais
+    garantem a mesma linhagem acima. cte_nodes precisa estar em ordem topológica (a do script).
+    """
+    by_col = {}
+    result = {}
+    for name in cte_nodes:
+        hashes = result[name] = []
+        for o in outputs.get(name, ()):
+            parts = [o.expr_hash]
+            for src, src_col, is_cte_out in o.immediate_deps:
+                dep = by_col.get((src, src_col)) if is_cte_out else None
+                parts.append(dep or f"{src}.{src_col}".lower())
+            digest = _digest(parts)
+            by_col.setdefault((name, o.name), digest)
+            hashes.append(digest)
+    return result
+
+def cte_hash(cte_column):
+    """Hash de uma CTE a partir das suas colunas (nome + column_hash, na ordem)."""
+    return _digest(part for c in cte_column for part in (c["column_name"], c.get("column_hash", "")))
+
+def assemble_lineage(cte_order, preds_by_scope, outputs, cte_sql_text):
+    """3) JSON no formato solicitado + dados para o gráfico, a partir dos outputs resolvidos."""
+    final_name = FINAL_SCOPE
+    final_outs = outputs.get(final_name)
+    cte_nodes = list(cte_order) + ([final_name] if final_outs else [])
+    edges_cte = []
+    for tgt in cte_order:
+        for src in preds_by_scope.get(tgt, ()):
+            edges_cte.append((src, tgt))
+    if final_outs:
+        # ligar as CTEs usadas na query final
+        for src in preds_by_scope.get(final_name, ()):
+            edges_cte.append((src, final_name))
+
+    # "CTE.COL" e {"cte_name", "column_name"} montados uma única vez por coluna e compartilhados
+    # entre todas as ligações/dependências que apontam para ela (tratar como somente leitura)
+    keys = {}
+    dep_dicts = {}
+
+    def key_of(cte, col):
+        k = keys.get((cte, col))
+        if k is None:
+            k = keys[(cte, col)] = f"{cte}.{col}"
+        return k
+
+    def dep_dict(cte, col):
+        d = dep_dicts.get((cte, col))
+        if d is None:
+            d = dep_dicts[(cte, col)] = {"cte_name": cte, "column_name": col}
+        return d
+
+    # colLinks: pares (src_cte, src_col_out) -> (tgt_cte, tgt_col_out) quando imediatos
+    col_links = []
+    for tgt_cte in cte_nodes:
+        if tgt_cte not in outputs: continue
+        for o in outputs[tgt_cte]:
+            to = key_of(tgt_cte, o.name)
+            for src, src_col, is_cte_out in o.immediate_deps:
+                if is_cte_out:
+                    col_links.append({"from": key_of(src, src_col), "to": to})
+
+    # JSON principal (por CTE), com os hashes estruturais de cada CTE e coluna (ver lineage_diff.py)
+    with _profiler.phase("hashes"):
+        hashes = column_hashes(cte_nodes, outputs)
+    cte_json = []
+    for name in cte_nodes:
+        if name not in outputs: continue
+        columns = [
+            {
+                "column_name": o.name,
+                "column_hash": h,
+                "dependencies": [
+                    dep_dict(s, c)
+                    for (s, c, is_out) in o.immediate_deps if is_out
+                ] + [
+                    # bases (tabela física): mantemos, mas sem aprofundar
+                    dep_dict(s, c)
+                    for (s, c, is_out) in o.immediate_deps if not is_out
+                ]
+            }
+            for o, h in zip(outputs[name], hashes[name])
+        ]
+        cte_json.append({
+            "cte_name": name,
+            "cte_query": cte_sql_text.get(name, ""),
+            "cte_hash": cte_hash(columns),
+            "cte_column": columns,
+        })
+
+    return {
+        "cte_nodes": cte_nodes,
+        "edges_cte": edges_cte,
+        "columns_by_cte": {name: [o.name for o in outputs.get(name, [])] for name in cte_nodes},
+        "col_links": col_links,
+        "cte_json": cte_json
+    }
+
+def build_lineage_cached(sql: str, dialect=None, cache: LineageCache = None, prune=False,
+                         budget: LineageBudget = None):
+    """build_lineage com cache persistente: SQL inalterado não é parseado de novo.
+    Resultados parciais (cortados pelo budget) não vão para o cache; um resultado completo vale
+    para qualquer budget, então a chave não depende dos limites."""
+    if cache is None:
+        return build_lineage(sql, dialect, prune, budget)
+    key = cache_key(sql, dialect, "prune") if prune else cache_key(sql, dialect)
+    data = cache.get(key)
+    if data is None:
+        data = build_lineage(sql, dialect, prune, budget)
+        if "partial" not in data:
+            cache.put(key, data)
+    return data
+
+class ColumnReachability:
+    """Alcance transitivo entre colunas de CTEs (a partir de col_links), pré-calculado em bitsets.
+
+    Cada coluna recebe um id na ordem de cte_nodes/columns_by_cte (offsets[i] + linha). up[id] e
+    down[id] são inteiros Python usados como bitsets: todas as colunas de que ela depende e todas
+    as que dependem dela. Os conjuntos são montados uma vez, em ordem topológica (cada coluna faz
+    OU dos conjuntos dos vizinhos), e as consultas não percorrem o grafo.
+    """
+
+    def __init__(self, data):
+        self.columns = []   # id -> (cte, coluna)
+        self.offsets = []   # índice da CTE em cte_nodes -> primeiro id
+        self.ids = {}       # (cte, coluna) -> id (primeira ocorrência, como no visualizador)
+        for name in data["cte_nodes"]:
+            self.offsets.append(len(self.columns))
+            for col in data["columns_by_cte"].get(name, []):
+                self.ids.setdefault((name, col), len(self.columns))
+                self.columns.append((name, col))
+        self.offsets.append(len(self.columns))
+        n = len(self.columns)
+        parents = [[] for _ in range(n)]
+        children = [[] for _ in range(n)]
+        for link in data["col_links"]:
+            s_cte, _, s_col = link["from"].partition(".")
+            t_cte, _, t_col = link["to"].partition(".")
+            s = self.ids.get((s_cte, s_col))
+            t = self.ids.get((t_cte, t_col))
+            if s is not None and t is not None and s != t:
+                parents[t].append(s)
+                children[s].append(t)
+        order = self._topological(parents, children)
+        with _profiler.phase("reachability"):
+            self.up = [0] * n
+            for i in order:
+                bits = 0
+                for p in parents[i]:
+                    bits |= self.up[p] | (1 << p)
+                self.up[i] = bits
+            self.down = [0] * n
+            for i in reversed(order):
+                bits = 0
+                for c in children[i]:
+                    bits |= self.down[c] | (1 << c)
+                self.down[i] = bits
+
+    @staticmethod
+    def _topological(parents, children):
+        """Ordem topológica das colunas (Kahn); colunas em ciclo entram no fim, na ordem dos ids."""
+        indeg = [len(p) for p in parents]
+        order = [i for i, d in enumerate(indeg) if d == 0]
+        pos = 0
+        while pos < len(order):
+            for c in children[order[pos]]:
+                indeg[c] -= 1
+                if indeg[c] == 0:
+                    order.append(c)
+            pos += 1
+        if len(order) < len(parents):
+            seen = set(order)
+            order.extend(i for i in range(len(parents)) if i not in seen)
+        return order
+
+    def _expand(self, bits):
+        out = []
+        while bits:
+            low = bits & -bits
+            out.append(self.columns[low.bit_length() - 1])
+            bits ^= low
+        return out
+
+    def upstream(self, cte, col):
+        """[(cte, coluna)] de que a coluna depende, direta ou indiretamente (ordem dos ids)."""
+        return self._expand(self.up[self.ids[(cte, col)]])
+
+    def downstream(self, cte, col):
+        """[(cte, coluna)] que dependem da coluna, direta ou indiretamente (ordem dos ids)."""
+        return self._expand(self.down[self.ids[(cte, col)]])
+
+def column_reachability(data):
+    """ColumnReachability do resultado de build_lineage (upstream/downstream sem percorrer o grafo)."""
+    return ColumnReachability(data)
+
+def _restrict(data, keep_ctes, keep_row):
+    """Cópia de `data` só com as CTEs de keep_ctes e, nelas, as colunas (cte, linha) aceitas por keep_row."""
+    cte_nodes = [name for name in data["cte_nodes"] if name in keep_ctes]
+    columns_by_cte = {}
+    kept = set()
+    for name in cte_nodes:
+        cols = [col for i, col in enumerate(data["columns_by_cte"].get(name, [])) if keep_row(name, i)]
+        columns_by_cte[name] = cols
+        kept.update((name, col) for col in cols)
+    cte_json = []
+    for entry in data["cte_json"]:
+        name = entry["cte_name"]
+        if name in keep_ctes:
+            cols = [c for i, c in enumerate(entry["cte_column"]) if keep_row(name, i)]
+            cte_json.append(dict(entry, cte_column=cols, cte_hash=cte_hash(cols)))
+    return {
+        "cte_nodes": cte_nodes,
+        "edges_cte": [(s, t) for s, t in data["edges_cte"] if s in keep_ctes and t in keep_ctes],
+        "columns_by_cte": columns_by_cte,
+        "col_links": [link for link in data["col_links"]
+                      if tuple(link["from"].partition(".")[::2]) in kept and tuple(link["to"].partition(".")[::2]) in kept],
+        "cte_json": cte_json,
+    }
+
+def prune_dead_columns(data):
+    """Descarta as colunas que não alimentam nenhuma coluna da query final (adiciona "dead_columns").
+
+    Vivas são as colunas de FINAL_QUERY e tudo que está acima delas (ColumnReachability.up). Um "*"
+    não expandido (várias origens) não diz quais colunas usa, então todas as colunas das CTEs de
+    origem do escopo com "*" ficam vivas. As CTEs continuam no grafo mesmo sem colunas vivas
+    (ex.: usadas só em JOIN/WHERE).
+    """
+    if FINAL_SCOPE not in data["cte_nodes"]:
+        return dict(data, dead_columns=0)
+    reach = ColumnReachability(data)
+    index = {name: i for i, name in enumerate(data["cte_nodes"])}
+    preds = {}
+    for s, t in data["edges_cte"]:
+        preds.setdefault(t, []).append(s)
+
+    def ids_of(name):
+        i = index[name]
+        return range(reach.offsets[i], reach.offsets[i + 1])
+
+    seeds = list(ids_of(FINAL_SCOPE))
+    for name in data["cte_nodes"]:
+        if "*" in data["columns_by_cte"].get(name, []):
+            for src in preds.get(name, ()):
+                seeds.extend(ids_of(src))
+    live = 0
+    for k in seeds:
+        live |= (1 << k) | reach.up[k]
+    pruned = _restrict(data, set(data["cte_nodes"]),
+                       lambda name, row: live >> (reach.offsets[index[name]] + row) & 1)
+    pruned["dead_columns"] = len(reach.columns) - bin(live).count("1")
+    return pruned
+
+def focus_subgraph(data, targets, hops=1):
+    """Vizinhança de até `hops` saltos (acima e abaixo) das CTEs ou colunas escolhidas, para renderizar
+    só o trecho de interesse de uma linhagem grande.
+
+    targets: nomes de CTE ("CTE_JOIN") e/ou colunas ("CTE_JOIN.COL5"), sem diferença de maiúsculas.
+    Uma CTE alvo traz as CTEs vizinhas pelo grafo de CTEs, com todas as colunas; uma coluna alvo traz
+    só as colunas vizinhas pelas ligações coluna→coluna (e as CTEs delas). ValueError se um alvo não existe.
+    """
+    by_upper = {name.upper(): name for name in data["cte_nodes"]}
+    cte_seeds, col_seeds = set(), set()
+    for target in targets:
+        name = by_upper.get(target.upper())
+        if name is not None:
+            cte_seeds.add(name)
+            continue
+        cte, _, col = target.partition(".")
+        name = by_upper.get(cte.upper())
+        cols = {c.upper(): c for c in data["columns_by_cte"].get(name, [])}
+        if name is None or col.upper() not in cols:
+            raise ValueError(f"CTE ou coluna não encontrada: {target}")
+        col_seeds.add((name, cols[col.upper()]))
+
+    def neighbourhood(seeds, pairs):
+        adj = {}
+        for a, b in pairs:
+            adj.setdefault(a, []).append(b)
+            adj.setdefault(b, []).append(a)
+        seen = set(seeds)
+        frontier = list(seeds)
+        for _ in range(hops):
+            frontier = [m for n in frontier for m in adj.get(n, ()) if m not in seen]
+            seen.update(frontier)
+        return seen
+
+    full_ctes = neighbourhood(cte_seeds, data["edges_cte"])
+    cols = neighbourhood(col_seeds, ((tuple(link["from"].partition(".")[::2]), tuple(link["to"].partition(".")[::2]))
+                                     for link in data["col_links"]))
+    keep_ctes = full_ctes | {cte for cte, _ in cols}
+    return _restrict(data, keep_ctes,
+                     lambda name, row: name in full_ctes or (name, data["columns_by_cte"][name][row]) in cols)
+
+
+# =========================
+# 3) Saídas (JSON + HTML)
+# =========================
+def write_lineage_json(data, path="lineage.json"):
+    """Salva o JSON principal (por CTE) em `path`."""
+    with _profiler.phase("json"):
+        text = json.dumps(data["cte_json"], indent=2, ensure_ascii=False)
+    with _profiler.phase("write"):
+        Path(path).write_text(text, encoding="utf-8")
+
+# formatos de saída da linhagem (--format): sufixo do arquivo gerado
+LINEAGE_FORMATS = ("json", "cjson", "cjson.gz")
+
+def write_lineage(data, path):
+    """Grava a linhagem no formato indicado pelo sufixo: .cjson / .cjson.gz (compacto, ver
+    lineage_compact.py) ou lineage.json."""
+    if str(path).endswith((".cjson", ".cjson.gz")):
+        with _profiler.phase("json"):
+            write_lineage_compact(data["cte_json"], path)
+    else:
+        write_lineage_json(data, path)
+
+# Acima deste nº de colunas o visualizador é gravado em pedaços (ver write_html)
+HTML_CHUNK_MIN_COLUMNS = 2000
+
+def _bits_b64(bits):
+    """Bitset → "byte_inicial:base64" (só a janela entre o primeiro e o último bit ligado)."""
+    if not bits:
+        return ""
+    lo = ((bits & -bits).bit_length() - 1) // 8
+    bits >>= lo * 8
+    return f"{lo}:{base64.b64encode(bits.to_bytes((bits.bit_length() + 7) // 8, 'little')).decode('ascii')}"
+
+def viewer_chunks(data, reach=None):
+    """Dados do visualizador por CTE, carregados só quando a CTE é expandida.
+
+    {cte: {"columns": [...], "in": [[i_origem, linha_origem, linha]], "out": [[linha, i_destino, linha_destino]],
+           "up": [bitset por linha], "down": [bitset por linha]}}
+    As ligações já vêm separadas e indexadas: CTEs pelo índice em cte_nodes e colunas pela linha
+    (posição em columns), para o redesenho não precisar quebrar "CTE.COL" nem procurar colunas.
+    Com reach (ColumnReachability), cada coluna leva os bitsets de tudo que está acima e abaixo
+    dela (ids de coluna; ver _bits_b64), e o clique numa coluna destaca o caminho sem busca no grafo.
+    """
+    index = {name: i for i, name in enumerate(data["cte_nodes"])}
+    rows = {}
+    for name in data["cte_nodes"]:
+        r = rows[name] = {}
+        for i, col in enumerate(data["columns_by_cte"].get(name, [])):
+            r.setdefault(col, i)
+    chunks = {name: {"columns": data["columns_by_cte"].get(name, []), "in": [], "out": []} for name in data["cte_nodes"]}
+    if reach is not None:
+        for i, name in enumerate(data["cte_nodes"]):
+            ids = range(reach.offsets[i], reach.offsets[i + 1])
+            chunks[name]["up"] = [_bits_b64(reach.up[k]) for k in ids]
+            chunks[name]["down"] = [_bits_b64(reach.down[k]) for k in ids]
+    for link in data["col_links"]:
+        # nomes de CTE não têm ponto; o nome da coluna pode ter (ex.: SUM(A.COL2))
+        s_cte, _, s_col = link["from"].partition(".")
+        t_cte, _, t_col = link["to"].partition(".")
+        s_row = rows.get(s_cte, {}).get(s_col)
+        t_row = rows.get(t_cte, {}).get(t_col)
+        if s_row is None or t_row is None:
+            continue
+        chunks[t_cte]["in"].append([index[s_cte], s_row, t_row])
+        chunks[s_cte]["out"].append([s_row, index[t_cte], t_row])
+    return chunks
+
+def viewer_bundles(data):
+    """Ligações coluna→coluna agregadas por par de CTEs: [[i_origem, i_destino, nº de ligações]]
+    (índices em cte_nodes). Com zoom baixo o visualizador desenha um feixe por par em vez de uma
+    curva por ligação; vai no HTML mesmo com os pedaços, já que tem no máximo uma entrada por aresta."""
+    index = {name: i for i, name in enumerate(data["cte_nodes"])}
+    counts = {}
+    for link in data["col_links"]:
+        s = index.get(link["from"].partition(".")[0])
+        t = index.get(link["to"].partition(".")[0])
+        if s is not None and t is not None:
+            counts[s, t] = counts.get((s, t), 0) + 1
+    return [[s, t, n] for (s, t), n in counts.items()]
+
+# layouts já calculados nesta execução (ex.: --watch com o grafo de CTEs inalterado)
+_layout_memo = {}
+
+def viewer_layout(data, cache=None):
+    """[[x, y], ...] na ordem de cte_nodes (ver lineage_layout.py). O resultado depende só do grafo
+    de CTEs e do nº de colunas, então é reaproveitado da memória ou do LineageCache entre execuções."""
+    columns = {name: len(cols) for name, cols in data["columns_by_cte"].items()}
+    key = layout_key(data["cte_nodes"], data["edges_cte"], columns)
+    positions = _layout_memo.get(key)
+    if positions is None and cache is not None:
+        positions = cache.get(key)
+    if positions is None:
+        with _profiler.phase("layout"):
+            pos = layered_layout(data["cte_nodes"], data["edges_cte"], columns)
+            positions = [[round(pos[n][0], 1), round(pos[n][1], 1)] for n in data["cte_nodes"]]
+        if cache is not None:
+            cache.put(key, positions)
+    if len(_layout_memo) >= 32:
+        _layout_memo.pop(next(iter(_layout_memo)))
+    _layout_memo[key] = positions
+    return positions
+
+def _script_json(obj):
+    """JSON seguro para ir dentro de <script> (sem fechar a tag antes da hora)."""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+
+def render_html(data, chunk_dir=None, version="", layout_cache=None):
+    """HTML interativo (CTE como caixas; colunas desenhadas dentro; ligações coluna→coluna ao expandir).
+    Sem chunk_dir os dados de todas as CTEs vão embutidos; com chunk_dir o HTML leva só o grafo de
+    CTEs e cada CTE é lida de <chunk_dir>/<índice>.js ao ser expandida (ver write_viewer_chunks).
+    As posições das CTEs vêm prontas (viewer_layout); layout_cache é um LineageCache opcional."""
+    positions = viewer_layout(data, layout_cache)
+    with _profiler.phase("html_json"):
+        # id da 1ª coluna de cada CTE (ids dos bitsets de ColumnReachability)
+        offsets = [0]
+        for name in data["cte_nodes"]:
+            offsets.append(offsets[-1] + len(data["columns_by_cte"].get(name, [])))
+        view = {"cte_nodes": data["cte_nodes"], "edges_cte": data["edges_cte"], "positions": positions,
+                "col_offsets": offsets, "bundles": viewer_bundles(data)}
+        if chunk_dir is None:
+            view["chunks"] = viewer_chunks(data, column_reachability(data))
+        else:
+            view["chunk_dir"] = chunk_dir
+            view["version"] = version
+        data_json = _script_json(view)
+    with _profiler.phase("html"):
+        return _html_page(data_json)
+
+def write_viewer_chunks(data, chunk_dir):
+    """Grava um <índice>.js por CTE (no formato JSONP, que funciona também abrindo o HTML por file://).
+    Retorna um hash do conteúdo, usado no HTML para não reaproveitar pedaços antigos do cache do navegador."""
+    chunk_dir = Path(chunk_dir)
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+    h = hashlib.sha1()
+    chunks = viewer_chunks(data, column_reachability(data))
+    for i, name in enumerate(data["cte_nodes"]):
+        text = f"__cteLineageChunk({i},{_script_json(chunks[name])});\n"
+        h.update(text.encode("utf-8"))
+        (chunk_dir / f"{i}.js").write_text(text, encoding="utf-8")
+    # pedaços de CTEs que não existem mais (ex.: no --watch)
+    for f in chunk_dir.glob("*.js"):
+        if f.stem.isdigit() and int(f.stem) >= len(data["cte_nodes"]):
+            f.unlink()
+    return h.hexdigest()[:12]
+
+def _html_page(data_json):
+    html = f"""<!doctype html>
+<html><head><meta charset="utf-8"/>
+<title>CTE Lineage Viewer</title>
+<style>
+  html,body {{ height:100%; margin:0; font-family: Inter, Arial, sans-serif; }}
+  #wrap {{ position:relative; height:100vh; }}
+  #cy {{ position:absolute; inset:0; }}
+  #overlay {{ position:absolute; inset:0; pointer-events:none; }}
+  #legend {{ position:absolute; right:12px; top:12px; background:#fff; border:1px solid #ddd; padding:8px 10px; border-radius:8px; font-size:12px; }}
+  .badge {{ display:inline-block; padding:2px 6px; border-radius:6px; margin-left:6px; font-size:11px; }}
+</style>
+</head>
+<body>
+<div id="wrap">
+  <div id="cy"></div>
+  <canvas id="overlay"></canvas>
+  <div id="legend">
+    Clique numa CTE para expandir/colapsar e numa coluna para ver todo o caminho dela.<br/>
+    Afastado, as ligações viram feixes por par de CTEs (espessura e número = nº de ligações).<br/>
+    <span class="badge" style="background:#0074D9;color:#fff;">CTE</span>
+    <span class="badge" style="background:#2ECC40;color:#fff;">Coluna</span>
+    <span class="badge" style="background:#F4A259;color:#fff;">Feixe</span>
+  </div>
+</div>
+
+<script src="https://cdnjs.cloudflare.com/ajax/libs/cytoscape/3.26.0/cytoscape.min.js"></script>
+<script>
+const DATA = {data_json};
+
+// nós CTE, já posicionados pelo gerador (layout em camadas calculado em Python)
+const elements = [];
+DATA.cte_nodes.forEach((id, i) => {{
+  const [x, y] = DATA.positions[i];
+  elements.push({{ data: {{ id, label: id, type: 'cte' }}, position: {{ x, y }} }});
+}});
+// arestas CTE→CTE
+for (const [s,t] of DATA.edges_cte) {{
+  elements.push({{ data: {{ id: s+"->"+t, source: s, target: t, type: 'cte_edge' }} }});
+}}
+
+const cy = cytoscape({{
+  container: document.getElementById('cy'),
+  elements,
+  style: [
+    {{ selector: 'node[type="cte"]', style: {{
+      'label': 'data(label)',
+      'background-color': '#0074D9',
+      'color': '#fff',
+      'shape': 'round-rectangle',
+      'text-valign': 'top',
+      'text-halign': 'center',
+      'width': 240,
+      'height': 64,
+      'padding': '12px',
+      'font-size': 12
+    }} }},
+    {{ selector: 'node.onpath', style: {{
+      'border-width': 4,
+      'border-color': '#FF4136'
+    }} }},
+    {{ selector: 'edge[type="cte_edge"]', style: {{
+      'curve-style': 'taxi',
+      'taxi-direction': 'auto',
+      'line-color': '#B0B0B0',
+      'target-arrow-color': '#B0B0B0',
+      'target-arrow-shape': 'triangle',
+      'width': 1.8,
+      'opacity': 1.0
+    }} }}
+  ],
+  layout: {{ name: 'preset', padding: 40 }},
+  wheelSensitivity: 0.2
+}});
+
+// Estado de expansão (ids das CTEs expandidas)
+const expanded = new Set();
+
+// Coluna selecionada e o caminho completo dela (ids de coluna = DATA.col_offsets[i] + linha).
+// Os conjuntos vêm prontos do gerador (bitsets "byte_inicial:base64" em chunk.up/chunk.down):
+// o clique só decodifica, sem percorrer o grafo.
+let selection = null;  // {{ id, up: Set, down: Set }}
+function decodeBits(s){{
+  const out = [];
+  if (!s) return out;
+  const k = s.indexOf(':');
+  const lo = +s.slice(0, k);
+  const bin = atob(s.slice(k + 1));
+  for (let i = 0; i < bin.length; i++){{
+    let b = bin.charCodeAt(i);
+    while (b){{
+      const t = b & -b;
+      out.push((lo + i)*8 + 31 - Math.clz32(t));
+      b ^= t;
+    }}
+  }}
+  return out;
+}}
+function colId(cteIdx, row){{ return DATA.col_offsets[cteIdx] + row; }}
+// índice da CTE dona de um id de coluna (busca binária nos offsets)
+function cteOfCol(id){{
+  let lo = 0, hi = DATA.cte_nodes.length - 1;
+  while (lo < hi){{
+    const mid = (lo + hi + 1) >> 1;
+    if (DATA.col_offsets[mid] <= id) lo = mid; else hi = mid - 1;
+  }}
+  return lo;
+}}
+function selectColumn(cte, row){{
+  const id = colId(cteIndex.get(cte), row);
+  cy.nodes('.onpath').removeClass('onpath');
+  if (selection && selection.id === id){{ selection = null; return; }}
+  const chunk = chunks[cte];
+  selection = {{ id, up: new Set(decodeBits(chunk.up[row])), down: new Set(decodeBits(chunk.down[row])) }};
+  // CTEs (mesmo colapsadas) por onde o caminho passa
+  const ctes = new Set([cteIndex.get(cte)]);
+  for (const c of selection.up) ctes.add(cteOfCol(c));
+  for (const c of selection.down) ctes.add(cteOfCol(c));
+  for (const i of ctes) cy.getElementById(DATA.cte_nodes[i]).addClass('onpath');
+}}
+function onPath(id){{
+  return selection && (id === selection.id || selection.up.has(id) || selection.down.has(id));
+}}
+
+// Dados por CTE (colunas e ligações): embutidos em DATA.chunks ou lidos de DATA.chunk_dir
+// ao expandir a CTE. Os pedaços são scripts JSONP (funcionam também por file://).
+const chunks = DATA.chunks || Object.create(null);
+const pending = Object.create(null);
+const cteIndex = new Map(DATA.cte_nodes.map((id, i) => [id, i]));
+window.__cteLineageChunk = (i, chunk) => {{
+  const id = DATA.cte_nodes[i];
+  chunks[id] = chunk;
+  (pending[id] || []).forEach(done => done());
+  delete pending[id];
+}};
+function loadChunk(id, done){{
+  if (chunks[id]) return done();
+  if (pending[id]) {{ pending[id].push(done); return; }}
+  pending[id] = [done];
+  const s = document.createElement('script');
+  s.src = DATA.chunk_dir + '/' + cteIndex.get(id) + '.js?v=' + DATA.version;
+  s.onerror = () => {{ delete pending[id]; console.error('Falha ao carregar ' + s.src); }};
+  document.head.appendChild(s);
+}}
+
+// Canvas overlay
+const canvas = document.getElementById('overlay');
+const ctx = canvas.getContext('2d');
+function resizeCanvas(){{
+  const bb = cy.container().getBoundingClientRect();
+  canvas.width = Math.max(1, bb.width);
+  canvas.height = Math.max(1, bb.height);
+}}
+resizeCanvas();
+window.addEventListener('resize', ()=>{{ resizeCanvas(); scheduleDraw(); }});
+
+// Geometria das "tabelas"
+const ROW_H = 18;
+const HEADER_H = 22;
+const PADDING = 10;
+const COL_MARGIN_X = 6;
+
+// coordenadas auxiliares em pixel (rendered), calculadas uma vez por quadro
+const boxes = new Map();
+function nodeBox(id){{
+  let box = boxes.get(id);
+  if (box) return box;
+  const n = cy.getElementById(id);
+  const pos = n.renderedPosition();
+  const w = n.renderedWidth();
+  const h = n.renderedHeight();
+  box = {{
+    left: pos.x - w/2,
+    right: pos.x + w/2,
+    top: pos.y - h/2,
+    bottom: pos.y + h/2,
+    width: w,
+    height: h
+  }};
+  boxes.set(id, box);
+  return box;
+}}
+
+// centro vertical da linha `row` de uma tabela expandida
+function rowY(box, row){{
+  return box.top + HEADER_H + PADDING + row*ROW_H + ROW_H/2;
+}}
+
+function drawTable(id, view){{
+  const cols = chunks[id].columns;
+  // base node box
+  const box = nodeBox(id);
+  // altura expandida
+  const tableH = HEADER_H + cols.length * ROW_H + PADDING*2;
+  const expandTop = box.top; // “cresce” para baixo
+  const expandLeft = box.left;
+  const width = box.width;
+  if (box.right < 0 || box.left > view.width || expandTop > view.height || expandTop + tableH < 0) return;
+
+  // fundo
+  ctx.fillStyle = 'rgba(255,255,255,0.06)';
+  ctx.fillRect(expandLeft, expandTop, width, tableH);
+
+  // borda
+  ctx.strokeStyle = '#004a89';
+  ctx.lineWidth = 1;
+  ctx.strokeRect(expandLeft+0.5, expandTop+0.5, width-1, tableH-1);
+
+  // header
+  ctx.fillStyle = 'rgba(255,255,255,0.12)';
+  ctx.fillRect(expandLeft, expandTop, width, HEADER_H);
+  ctx.fillStyle = '#FFFFFF';
+  ctx.font = '12px Arial';
+  ctx.textBaseline = 'middle';
+  ctx.fillText(id, expandLeft + 8, expandTop + HEADER_H/2);
+
+  // linhas de colunas (só as visíveis na tela)
+  ctx.font = '11px Arial';
+  ctx.textBaseline = 'middle';
+  const first = Math.max(0, Math.floor((0 - rowY(box, 0)) / ROW_H));
+  const last = Math.min(cols.length, Math.ceil((view.height - rowY(box, 0)) / ROW_H) + 1);
+  const cteIdx = cteIndex.get(id);
+  for (let i = first; i < last; i++){{
+    const y = rowY(box, i);
+    // célula (com seleção: vermelha a coluna, laranja o que está acima e roxa o que está abaixo)
+    const cid = colId(cteIdx, i);
+    ctx.fillStyle = !selection ? '#2ECC40'
+      : cid === selection.id ? '#FF4136'
+      : selection.up.has(cid) ? '#FF851B'
+      : selection.down.has(cid) ? '#B10DC9' : '#2ECC40';
+    ctx.fillRect(expandLeft + COL_MARGIN_X, y-11, width - COL_MARGIN_X*2, 16);
+    ctx.fillStyle = '#FFFFFF';
+    const label = String(cols[i]).slice(0, 80);
+    ctx.fillText(label, expandLeft + COL_MARGIN_X + 6, y);
+  }}
+}}
+
+// Nível de detalhe: abaixo deste zoom, as ligações de cada par de CTEs viram um único feixe
+// (DATA.bundles, agregado no gerador), menos as da CTE da coluna selecionada, que continuam
+// uma a uma. Assim o desenho depende do que está visível, não do total de ligações.
+const DETAIL_ZOOM = 0.75;
+const bundlesIn = DATA.cte_nodes.map(() => []);
+const bundlesOut = DATA.cte_nodes.map(() => []);
+for (const b of DATA.bundles){{ bundlesOut[b[0]].push(b); bundlesIn[b[1]].push(b); }}
+
+// ponto de ancoragem de um feixe numa CTE: meio da tabela expandida ou da caixa
+function anchorY(id){{
+  const box = nodeBox(id);
+  if (!expanded.has(id)) return box.top + box.height/2;
+  return box.top + (HEADER_H + chunks[id].columns.length * ROW_H + PADDING*2)/2;
+}}
+
+// Ligações coluna→coluna: só as das CTEs expandidas, já com índices de CTE e de linha.
+// Os segmentos são agrupados por cor (e os feixes por espessura), um path por grupo.
+function drawLinks(view){{
+  const both = [];  // coluna → coluna (as duas CTEs expandidas)
+  const half = [];  // coluna ↔ caixa de uma CTE colapsada
+  const path = [];  // ligações no caminho da coluna selecionada
+  const bundles = new Map();  // espessura → segmentos dos feixes
+  const labels = [];          // [x, y, nº de ligações] no meio de cada feixe
+  function visible(x1, y1, x2, y2){{
+    // fora da tela: as duas pontas do mesmo lado
+    return !((x1 < 0 && x2 < 0) || (x1 > view.width && x2 > view.width) ||
+             (y1 < 0 && y2 < 0) || (y1 > view.height && y2 > view.height));
+  }}
+  function add(seg, x1, y1, x2, y2){{
+    if (visible(x1, y1, x2, y2)) seg.push(x1, y1, x2, y2);
+  }}
+  function addBundle(s, t, n){{
+    const sId = DATA.cte_nodes[s], tId = DATA.cte_nodes[t];
+    const x1 = nodeBox(sId).right - 4, y1 = anchorY(sId), x2 = nodeBox(tId).left + 4, y2 = anchorY(tId);
+    if (!visible(x1, y1, x2, y2)) return;
+    const w = Math.min(8, 1 + Math.floor(Math.log2(n)));
+    if (!bundles.has(w)) bundles.set(w, []);
+    bundles.get(w).push(x1, y1, x2, y2);
+    if (n > 1) labels.push((x1 + x2)/2, (y1 + y2)/2, n);
+  }}
+  const detail = cy.zoom() >= DETAIL_ZOOM;
+  const focus = selection ? cteOfCol(selection.id) : -1;
+  for (const id of expanded){{
+    const box = nodeBox(id);
+    const chunk = chunks[id];
+    const idx = cteIndex.get(id);
+    if (!detail && idx !== focus){{
+      // feixes: entradas de qualquer origem e saídas para CTEs colapsadas
+      // (a CTE em foco desenha as suas ligações uma a uma)
+      for (const [s, t, n] of bundlesIn[idx]) if (s !== focus) addBundle(s, t, n);
+      for (const [s, t, n] of bundlesOut[idx]){{
+        if (t !== focus && !expanded.has(DATA.cte_nodes[t])) addBundle(s, t, n);
+      }}
+      continue;
+    }}
+    // entradas: coluna→coluna (origem expandida) ou caixa→coluna
+    for (const [s, sRow, row] of chunk.in){{
+      const sId = DATA.cte_nodes[s];
+      const sBox = nodeBox(sId);
+      const hot = selection && onPath(colId(s, sRow)) && onPath(colId(idx, row));
+      if (expanded.has(sId)) add(hot ? path : both, sBox.right - 4, rowY(sBox, sRow), box.left + 4, rowY(box, row));
+      else add(hot ? path : half, sBox.right - 4, sBox.top + sBox.height/2, box.left + 4, rowY(box, row));
+    }}
+    // saídas: coluna → caixa destino (colapsada) ou, em foco com zoom baixo, → coluna da
+    // destino expandida (que então desenha só feixes); no detalhe, com as duas expandidas,
+    // a ligação já saiu nas entradas do destino
+    for (const [row, d, dRow] of chunk.out){{
+      const dId = DATA.cte_nodes[d];
+      if (expanded.has(dId) && detail) continue;
+      const dBox = nodeBox(dId);
+      const hot = selection && onPath(colId(idx, row)) && onPath(colId(d, dRow));
+      if (expanded.has(dId)) add(hot ? path : both, box.right - 4, rowY(box, row), dBox.left + 4, rowY(dBox, dRow));
+      else add(hot ? path : half, box.right - 4, rowY(box, row), dBox.left + 4, dBox.top + dBox.height/2);
+    }}
+  }}
+  // ambas colapsadas → deixamos somente CTE→CTE padrão (já desenhado pelo Cytoscape)
+  for (const [w, seg] of bundles){{
+    ctx.lineWidth = w;
+    strokeCurves(seg, 'rgba(244,162,89,0.85)');
+  }}
+  if (labels.length){{
+    ctx.font = '10px Arial';
+    ctx.textBaseline = 'middle';
+    ctx.fillStyle = '#8A4B08';
+    for (let i = 0; i < labels.length; i += 3) ctx.fillText(String(labels[i+2]), labels[i] + 3, labels[i+1] - 6);
+  }}
+  ctx.lineWidth = 1.5;
+  strokeCurves(half, '#B5E48C');
+  strokeCurves(both, '#FFD166');
+  ctx.lineWidth = 3;
+  strokeCurves(path, '#FF4136');
+}}
+
+// curvas suaves entre pares de âncoras [x1, y1, x2, y2, ...]
+function strokeCurves(seg, color){{
+  if (!seg.length) return;
+  ctx.strokeStyle = color;
+  ctx.beginPath();
+  for (let i = 0; i < seg.length; i += 4){{
+    const x1 = seg[i], y1 = seg[i+1], x2 = seg[i+2], y2 = seg[i+3];
+    const midx = (x1 + x2)/2;
+    ctx.moveTo(x1, y1);
+    ctx.bezierCurveTo(midx, y1, midx, y2, x2, y2);
+  }}
+  ctx.stroke();
+}}
+
+function drawOverlay(){{
+  const bb = cy.container().getBoundingClientRect();
+  const view = {{ width: bb.width, height: bb.height }};
+  boxes.clear();
+  ctx.clearRect(0,0,bb.width,bb.height);
+
+  // desenha tabelas expandidas
+  for (const id of expanded) drawTable(id, view);
+
+  // desenha links coluna→coluna
+  drawLinks(view);
+}}
+
+// No máximo um redesenho por quadro, por mais eventos que cheguem nele
+let frameRequested = false;
+function scheduleDraw(){{
+  if (frameRequested) return;
+  frameRequested = true;
+  requestAnimationFrame(() => {{ frameRequested = false; drawOverlay(); }});
+}}
+
+// cte→cte: esmaece as arestas entre duas CTEs expandidas (só muda ao expandir/colapsar)
+function updateEdgeOpacity(id){{
+  cy.getElementById(id).connectedEdges('[type="cte_edge"]').forEach(e => {{
+    const both = expanded.has(e.source().id()) && expanded.has(e.target().id());
+    e.style('opacity', both ? 0.18 : 1.0);
+  }});
+}}
+
+// Redesenhar quando a cena muda
+["render","pan","zoom","dragfree","position"].forEach(ev => cy.on(ev, scheduleDraw));
+cy.on('resize', ()=>{{ resizeCanvas(); scheduleDraw(); }});
+
+// coluna de uma tabela expandida sob o ponto (em pixels), ou null
+function columnAt(p){{
+  for (const id of expanded){{
+    const box = nodeBox(id);
+    const cols = chunks[id].columns;
+    const row = Math.floor((p.y - (box.top + HEADER_H + PADDING)) / ROW_H);
+    if (p.x >= box.left && p.x <= box.right && row >= 0 && row < cols.length) return {{ id, row }};
+  }}
+  return null;
+}}
+
+// Clique: numa coluna, destaca o caminho dela; numa CTE, expande/colapsa; no fundo, limpa a seleção
+cy.on('tap', evt => {{
+  boxes.clear();
+  const hit = columnAt(evt.renderedPosition);
+  if (hit){{
+    selectColumn(hit.id, hit.row);
+    scheduleDraw();
+    return;
+  }}
+  if (evt.target === cy || !evt.target.isNode || !evt.target.isNode()){{
+    if (selection){{ selection = null; cy.nodes('.onpath').removeClass('onpath'); scheduleDraw(); }}
+    return;
+  }}
+  const id = evt.target.id();
+  if (expanded.has(id)){{
+    expanded.delete(id);
+    updateEdgeOpacity(id);
+    scheduleDraw();
+    return;
+  }}
+  loadChunk(id, () => {{ expanded.add(id); updateEdgeOpacity(id); scheduleDraw(); }});
+}});
+
+// Primeira pintura
+scheduleDraw();
+</script>
+</body></html>
+"""
+    return html
+
+def write_html(data, path="cte_lineage.html", chunked=None, layout_cache=None):
+    """Grava o visualizador. chunked=None decide pelo tamanho (HTML_CHUNK_MIN_COLUMNS); com chunked,
+    os dados de cada CTE vão para <nome>_chunks/ ao lado do HTML e o primeiro desenho depende só do
+    nº de CTEs, não do total de colunas."""
+    path = Path(path)
+    if chunked is None:
+        chunked = sum(len(c) for c in data["columns_by_cte"].values()) >= HTML_CHUNK_MIN_COLUMNS
+    if chunked:
+        chunk_dir = path.parent / (path.stem + "_chunks")
+        with _profiler.phase("html_chunks"):
+            version = write_viewer_chunks(data, chunk_dir)
+        html = render_html(data, chunk_dir.name, version, layout_cache)
+    else:
+        html = render_html(data, layout_cache=layout_cache)
+    with _profiler.phase("write"):
+        Path(path).write_text(html, encoding="utf-8")
+
+
+# =========================
+# 4) Execução em lote
+# =========================
+def expand_inputs(patterns):
+    """Arquivos, diretórios (busca *.sql recursiva) ou globs → lista ordenada e sem repetição."""
+    files = set()
+    for p in patterns:
+        path = Path(p)
+        if path.is_dir():
+            files.update(f for f in path.rglob("*.sql") if f.is_file())
+        elif path.is_file():
+            files.add(path)
+        else:
+            files.update(Path(f) for f in glob.glob(p, recursive=True) if Path(f).is_file())
+    return sorted(f.resolve() for f in files)
+
+def output_path_for(src: Path, base: Path, out_dir: Path, suffix: str):
+    """Espelha a estrutura de diretórios da entrada em `out_dir` (evita colisão de nomes iguais)."""
+    rel = src.relative_to(base) if src != base else Path(src.name)
+    return out_dir / rel.parent / (rel.stem + suffix)
+
+# um LineageCache (conexão SQLite) por processo do pool, reaproveitado entre arquivos
+_worker_caches = {}
+
+def _worker_cache(cache_dir, max_bytes):
+    if cache_dir is None:
+        return None
+    cache = _worker_caches.get(cache_dir)
+    if cache is None:
+        cache = _worker_caches[cache_dir] = LineageCache(cache_dir, max_bytes)
+    return cache
+
+# idem para o catálogo de linhagem entre scripts (--catalog)
+_worker_catalogs = {}
+
+def _worker_catalog(catalog_path):
+    if catalog_path is None:
+        return None
+    catalog = _worker_catalogs.get(catalog_path)
+    if catalog is None:
+        catalog = _worker_catalogs[catalog_path] = LineageCatalog(catalog_path)
+    return catalog
+
+def analyze_file(src, json_out, html_out=None, dialect=None, cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES,
+                 catalog_path=None, prune=False, focus=None, hops=1, limits=None):
+    """Worker do pool: analisa um arquivo .sql e grava sua linhagem. Nunca levanta exceção.
+    Com catalog_path, atualiza também a linhagem do arquivo no catálogo (só se o conteúdo mudou).
+    prune descarta as CTEs/colunas mortas (ver lineage_from_ast); focus/hops restringem o HTML à
+    vizinhança dos alvos (ver focus_subgraph); um arquivo sem algum dos alvos ganha o HTML completo e
+    um "notice" no resultado, em vez de falhar. limits são os argumentos do LineageBudget do arquivo:
+    uma linhagem cortada é gravada com "partial" no resultado, e uma análise cancelada pelo prazo
+    rígido termina com status "timeout"."""
+    t0 = time.perf_counter()
+    result = {"file": str(src), "output": str(json_out), "status": "ok"}
+    try:
+        sql = Path(src).read_text(encoding="utf-8")
+        cache = _worker_cache(cache_dir, cache_max_bytes)
+        hits = cache.hits if cache else 0
+        budget = LineageBudget(**limits) if limits else None
+        data = build_lineage_cached(sql, dialect, cache, prune, budget)
+        if cache:
+            result["cache"] = "hit" if cache.hits > hits else "miss"
+        Path(json_out).parent.mkdir(parents=True, exist_ok=True)
+        write_lineage(data, json_out)
+        if html_out:
+            view = data
+            if focus:
+                try:
+                    view = focus_subgraph(data, focus, hops)
+                except ValueError as e:
+                    # alvo do --focus que não existe neste arquivo: grava o visualizador completo
+                    result["notice"] = f"--focus ignorado ({e})"
+            write_html(view, html_out, layout_cache=cache)
+        catalog = _worker_catalog(catalog_path)
+        if catalog:
+            # linhagem podada ou parcial: outro hash, para o arquivo ser reingerido quando for
+            # analisado completo (o catálogo só regrava um script quando o hash muda)
+            content_hash = (cache_key(sql, dialect, "prune") if prune else cache_key(sql, dialect)) \
+                + (":partial" if "partial" in data else "")
+            changed = catalog.upsert_script(src, data["cte_json"], content_hash, data["col_links"])
+            result["catalog"] = "updated" if changed else "unchanged"
+        result["ctes"] = len(data["cte_nodes"])
+        result["columns"] = sum(len(c) for c in data["columns_by_cte"].values())
+        if prune:
+            result["dead_ctes"] = data.get("dead_ctes", [])
+            result["dead_columns"] = data.get("dead_columns", 0)
+        if "partial" in data:
+            result["partial"] = data["partial"]
+    except LineageTimeout as e:
+        result["status"] = "timeout"
+        result["error"] = str(e)
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - t0, 4)
+    return result
+
+def _latency_summary(seconds):
+    """Percentis do tempo por arquivo (s): a cauda mostra se os limites seguram o lote."""
+    if not seconds:
+        return None
+    ordered = sorted(seconds)
+
+    def pct(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99), "max": ordered[-1]}
+
+def run_batch(files, out_dir, workers=None, html=False, dialect=None, cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES,
+              in_process=False, catalog_path=None, fmt="json", prune=False, focus=None, hops=1, limits=None):
+    """Distribui os arquivos num ProcessPoolExecutor (1 processo por núcleo) e grava summary.json.
+    Com in_process=True analisa em série no próprio processo (usado pelo --profile).
+    Com catalog_path, ingere a linhagem de cada arquivo no catálogo e remove dele os arquivos apagados.
+    fmt é o formato dos arquivos de linhagem (ver LINEAGE_FORMATS); prune, focus, hops e limits
+    (LineageBudget de cada arquivo) vão para analyze_file. O resumo traz os limites, os cortes e
+    os percentis do tempo por arquivo."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    workers = 1 if in_process else workers or os.cpu_count() or 1
+    base = Path(os.path.commonpath(files)) if files else out_dir
+    if base.is_file():
+        base = base.parent
+    jobs = [
+        (
+            src,
+            output_path_for(src, base, out_dir, ".lineage." + fmt),
+            output_path_for(src, base, out_dir, ".html") if html else None,
+            dialect,
+            cache_dir,
+            cache_max_bytes,
+            catalog_path,
+            prune,
+            focus,
+            hops,
+            limits,
+        )
+        for src in files
+    ]
+
+    t0 = time.perf_counter()
+    results = []
+    pool = None
+    if in_process:
+        completed = (analyze_file(*job) for job in jobs)
+    else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        pool = ProcessPoolExecutor(max_workers=workers)
+        completed = (fut.result() for fut in as_completed([pool.submit(analyze_file, *job) for job in jobs]))
+    try:
+        for i, res in enumerate(completed, 1):
+            results.append(res)
+            if res["status"] != "ok":
+                print(f"❌ {res['file']}: {res['error']}")
+            elif "notice" in res:
+                print(f"⚠️ {res['file']}: {res['notice']}")
+            if i % 100 == 0 or i == len(jobs):
+                elapsed = time.perf_counter() - t0
+                print(f"   {i}/{len(jobs)} arquivos ({i / elapsed:.1f} arquivos/s)")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    elapsed = time.perf_counter() - t0
+
+    results.sort(key=lambda r: r["file"])
+    ok = sum(1 for r in results if r["status"] == "ok")
+    summary = {
+        "files": len(results),
+        "ok": ok,
+        "errors": len(results) - ok,
+        "cache_hits": sum(1 for r in results if r.get("cache") == "hit"),
+        "catalog_updates": sum(1 for r in results if r.get("catalog") == "updated"),
+        "dead_ctes": sum(len(r.get("dead_ctes", ())) for r in results),
+        "notices": sum(1 for r in results if "notice" in r),
+        "limits": limits,
+        "partial": sum(1 for r in results if "partial" in r),
+        "timeouts": sum(1 for r in results if r["status"] == "timeout"),
+        "truncated_leaf_sets": sum(r["partial"]["truncated_leaf_sets"] for r in results if "partial" in r),
+        "dropped_fallback_edges": sum(r["partial"]["dropped_fallback_edges"] for r in results if "partial" in r),
+        "latency": _latency_summary([r["seconds"] for r in results]),
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "files_per_second": round(len(results) / elapsed, 2) if elapsed > 0 else None,
+        "results": results,
+    }
+    (out_dir / "summary.json").write_text(json.dumps(summary, indent=2, ensure_ascii=False), encoding="utf-8")
+    return summary
+
+
+# =========================
+# 5) Reanálise incremental (modo --watch)
+# =========================
+# Tokens que alteram a estrutura (parênteses e vírgulas fora de strings/comentários):
+# basta eles para localizar as CTEs no texto sem parsear o script inteiro
+_SPLIT_TOKEN_RE = re.compile(r"""
+      '(?:[^']|'')*'          # string
+    | "(?:[^"]|"")*"          # identificador entre aspas
+    | `[^`]*`                 # identificador (MySQL/BigQuery)
+    | \[[^\]]*\]              # identificador (T-SQL)
+    | --[^\n]*                # comentário de linha
+    | /\*.*?\*/               # comentário de bloco
+    | [(),]
+    """, re.S | re.X)
+_WITH_RE = re.compile(r"\s*(?:(?:--[^\n]*|/\*.*?\*/)\s*)*WITH\b(?!\s+RECURSIVE\b)", re.I | re.S)
+_CTE_HEADER_RE = re.compile(r"""\s*("(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]|[\w$#@]+)\s+AS\s*""", re.I)
+
+def _unquote_identifier(tok: str):
+    if tok[:1] == '"' and tok[-1:] == '"':
+        return tok[1:-1].replace('""', '"')
+    if tok[:1] in "`[" and tok[-1:] in "`]":
+        return tok[1:-1]
+    return tok
+
+def split_ctes(sql: str):
+    """Divide `WITH a AS (...), b AS (...) SELECT ...` em ([(nome, corpo)], query_final) só pelo texto.
+    Retorna None quando o script não tem essa forma simples (sem WITH, RECURSIVE, lista de colunas...)."""
+    m = _WITH_RE.match(sql)
+    if not m:
+        return None
+    ctes = []
+    pos = m.end()
+    depth = 0
+    header = []        # texto de nível 0 desde a última vírgula (nome AS)
+    after_cte = False  # acabou de fechar uma CTE: espera vírgula ou a query final
+    name = body_start = None
+    for tok in _SPLIT_TOKEN_RE.finditer(sql, pos):
+        t = tok.group()
+        if depth == 0:
+            gap = sql[pos:tok.start()]
+            if after_cte and (gap.strip() or t not in ",)" and not t.startswith(("--", "/*"))):
+                final_start = tok.start() if not gap.strip() else pos + len(gap) - len(gap.lstrip())
+                return ctes, sql[final_start:]
+            header.append(gap)
+        pos = tok.end()
+        if t == "(":
+            if depth == 0:
+                hm = _CTE_HEADER_RE.fullmatch("".join(header))
+                if hm is None:
+                    return None
+                name = _unquote_identifier(hm.group(1))
+                body_start = tok.end()
+            depth += 1
+        elif t == ")":
+            depth -= 1
+            if depth < 0:
+                return None
+            if depth == 0:
+                ctes.append((name, sql[body_start:tok.start()]))
+                after_cte = True
+        elif depth == 0:
+            if t == ",":
+                if not after_cte:
+                    return None
+                after_cte = False
+                header = []
+            elif not t.startswith(("--", "/*")):
+                header.append(t)
+    if depth or not after_cte:
+        return None
+    return ctes, sql[pos:]
+
+
+class IncrementalLineage:
+    """Linhagem de um script que é reanalisado a cada edição.
+
+    Guarda, por CTE, o hash do corpo, as fontes, o plano das projeções e o texto formatado.
+    Em update(), só as CTEs cujo corpo mudou são parseadas; elas e suas dependentes (pelas
+    arestas CTE→CTE) são resolvidas de novo, o resto reaproveita os outputs anteriores.
+    Scripts fora da forma simples (ver split_ctes), CTEs aninhadas ou referências a CTEs
+    definidas depois caem na análise completa.
+    """
+
+    def __init__(self, dialect=None):
+        self.dialect = dialect
+        self._reset()
+
+    def _reset(self):
+        self.resolver = LineageResolver()
+        self.scopes = {}   # nome -> {"hash", "sources", "plan", "sql"}
+        self.order = []
+        self.refs = {}     # nome -> (predecessors, alias_map)
+        self.data = None
+        self.last_recomputed = []
+
+    def _parse_scope(self, name, body, digest):
+        ast = parse_one(body, read=self.dialect)
+        nested, scope = scan_scopes(ast)
+        if nested:
+            return None
+        sel = scope["select"]
+        entry = {"hash": digest, "sources": scope["sources"], "plan": None, "sql": None, "branches": []}
+        if sel is not None:
+            entry["plan"] = projection_plan(sel)
+            if name == FINAL_SCOPE:
+                # como em lineage_from_ast: numa operação de conjunto, todos os ramos contam
+                entry["branches"] = set_operation_branches(ast)
+                entry["sql"] = pretty_scope_sql(ast if entry["branches"] else sel)
+            else:
+                entry["sql"] = pretty_sql(sel)
+        return entry
+
+    def _full_rebuild(self, sql):
+        self._reset()
+        self.data = build_lineage(sql, self.dialect)
+        self.last_recomputed = list(self.data["cte_nodes"])
+        return self.data
+
+    def update(self, sql: str):
+        split = split_ctes(sql)
+        if split is None:
+            return self._full_rebuild(sql)
+        ctes, final_text = split
+        order = [name for name, _ in ctes]
+        if len(set(order)) != len(order) or FINAL_SCOPE in order:
+            return self._full_rebuild(sql)
+        segments = ctes + ([(FINAL_SCOPE, final_text)] if final_text.strip() else [])
+
+        # 1) parse só dos corpos alterados (nada do estado muda até aqui: um erro de sintaxe preserva o anterior)
+        scopes = {}
+        changed = set()
+        for name, body in segments:
+            digest = hashlib.sha1(body.encode("utf-8")).hexdigest()
+            old = self.scopes.get(name)
+            if old is not None and old["hash"] == digest:
+                scopes[name] = old
+                continue
+            entry = self._parse_scope(name, body, digest)
+            if entry is None:
+                return self._full_rebuild(sql)
+            scopes[name] = entry
+            changed.add(name)
+
+        known_cte_names = set(order)
+        position = {name: k for k, name in enumerate(order)}
+        refs = {}
+        for name, entry in scopes.items():
+            if name in changed or order != self.order or name not in self.refs:
+                refs[name] = predecessors_and_aliases(entry["sources"], known_cte_names)
+            else:
+                refs[name] = self.refs[name]
+            if name != FINAL_SCOPE and any(position[p] >= position[name] for p in refs[name][0]):
+                return self._full_rebuild(sql)
+
+        # 2) CTEs a recalcular: as alteradas (ou todas, se CTEs entraram/saíram/mudaram de ordem) e suas dependentes
+        dirty = set(scopes) if order != self.order else set(changed)
+        dependents = {}
+        for tgt, (preds, _) in refs.items():
+            for src in preds:
+                dependents.setdefault(src, []).append(tgt)
+        stack = list(dirty)
+        while stack:
+            for tgt in dependents.get(stack.pop(), ()):
+                if tgt not in dirty:
+                    dirty.add(tgt)
+                    stack.append(tgt)
+
+        # 3) resolve em ordem, reaproveitando os outputs das CTEs intactas
+        for name in set(self.scopes) - set(scopes):
+            self.resolver.forget(name)
+        recomputed = []
+        for name in order + ([FINAL_SCOPE] if FINAL_SCOPE in scopes else []):
+            if name not in dirty:
+                continue
+            entry = scopes[name]
+            if entry["plan"] is None:
+                self.resolver.forget(name)
+                continue
+            predecessors, alias_map = refs[name]
+            if entry["branches"]:
+                outs = self.resolver.derive_set_operation(entry["branches"], known_cte_names)
+            else:
+                outs = self.resolver.derive_outputs(entry["plan"], predecessors, alias_map, star_requires_outputs=(name == FINAL_SCOPE))
+            self.resolver.register_outputs(name, outs)
+            recomputed.append(name)
+
+        self.scopes, self.order, self.refs = scopes, order, refs
+        self.last_recomputed = recomputed
+        cte_sql_text = {name: entry["sql"] for name, entry in scopes.items() if entry["sql"] is not None}
+        preds_by_scope = {name: preds for name, (preds, _) in refs.items()}
+        self.data = assemble_lineage(order, preds_by_scope, self.resolver.outputs, cte_sql_text)
+        return self.data
+
+
+def watch(path, out_dir=".", dialect=None, interval=0.2):
+    """Observa `path` e regrava lineage.json / cte_lineage.html a cada alteração salva."""
+    path = Path(path)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    engine = IncrementalLineage(dialect)
+    last_sig = None
+    print(f"👀 observando {path} (Ctrl+C para sair)")
+    try:
+        while True:
+            try:
+                st = path.stat()
+                sig = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                sig = None
+            if sig is not None and sig != last_sig:
+                last_sig = sig
+                t0 = time.perf_counter()
+                try:
+                    data = engine.update(path.read_text(encoding="utf-8"))
+                except Exception as e:
+                    print(f"❌ {type(e).__name__}: {e}")
+                else:
+                    write_lineage_json(data, out_dir / "lineage.json")
+                    write_html(data, out_dir / "cte_lineage.html")
+                    ms = (time.perf_counter() - t0) * 1000
+                    print(f"✅ {len(engine.last_recomputed)}/{len(data['cte_nodes'])} CTEs recalculadas, "
+                          f"lineage.json e cte_lineage.html atualizados em {ms:.0f} ms")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+# =========================
+# 6) Ingestão em streaming (vários statements → NDJSON)
+# =========================
+# Tokens que podem conter ";" sem encerrar o statement (string, identificador entre aspas/crases,
+# comentário de linha e de bloco) e o próprio ";"
+_STATEMENT_TOKEN_RE = re.compile(rb"""'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|--[^\n]*|/\*.*?\*/|;""", re.S)
+_RELEASE_EVERY = 16 * 1024 * 1024
+_SQL_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+
+def iter_statements(path):
+    """Gera (offset_em_bytes, linha, sql) de cada statement do arquivo, separados por ";".
+
+    O arquivo é mapeado em memória (mmap) e varrido incrementalmente: só o statement
+    corrente é copiado/decodificado, e as páginas já processadas são devolvidas ao SO
+    (onde há madvise), então a memória fica limitada ao maior statement.
+    """
+    release = getattr(mmap, "MADV_DONTNEED", None)
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # arquivo vazio
+            return
+        with mm:
+            start = 0
+            line = 1
+            released = 0
+
+            def emit(end):
+                chunk = mm[start:end]
+                body = chunk.lstrip()
+                first_line = line + chunk[:len(chunk) - len(body)].count(b"\n")
+                text = body.rstrip().decode("utf-8", errors="replace")
+                if _SQL_COMMENT_RE.sub("", text).strip():
+                    return (start + len(chunk) - len(body), first_line, text), chunk.count(b"\n")
+                return None, chunk.count(b"\n")
+
+            for m in _STATEMENT_TOKEN_RE.finditer(mm):
+                if m.end() - m.start() != 1:  # string/comentário: o ";" é o único token de 1 byte
+                    continue
+                stmt, newlines = emit(m.start())
+                if stmt is not None:
+                    yield stmt
+                line += newlines
+                start = m.end()
+                if release is not None and start - released >= _RELEASE_EVERY:
+                    upto = start - start % mmap.PAGESIZE
+                    mm.madvise(release, released, upto - released)
+                    released = upto
+            stmt, _ = emit(len(mm))
+            if stmt is not None:
+                yield stmt
+
+def iter_lineage(statements, dialect=None, prune=False, limits=None):
+    """Analisa cada statement assim que ele chega; gera um registro de linhagem por statement.
+    limits: argumentos do LineageBudget de cada statement (ver analyze_file)."""
+    for i, (offset, line, sql) in enumerate(statements):
+        t0 = time.perf_counter()
+        record = {"statement": i, "offset": offset, "line": line, "status": "ok"}
+        try:
+            data = build_lineage(sql, dialect, prune, LineageBudget(**limits) if limits else None)
+            record["cte_nodes"] = data["cte_nodes"]
+            record["edges_cte"] = data["edges_cte"]
+            record["cte_json"] = data["cte_json"]
+            if prune:
+                record["dead_ctes"] = data.get("dead_ctes", [])
+            if "partial" in data:
+                record["partial"] = data["partial"]
+        except LineageTimeout as e:
+            record["status"] = "timeout"
+            record["error"] = str(e)
+        except Exception as e:
+            record["status"] = "error"
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["seconds"] = round(time.perf_counter() - t0, 4)
+        yield record
+
+def stream_to_ndjson(path, out, dialect=None, prune=False, limits=None):
+    """Escreve um registro NDJSON por statement em `out` (arquivo texto), com flush a cada linha."""
+    t0 = time.perf_counter()
+    n = errors = partial = 0
+    for record in iter_lineage(iter_statements(path), dialect, prune, limits):
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        n += 1
+        errors += record["status"] != "ok"
+        partial += "partial" in record
+    elapsed = time.perf_counter() - t0
+    return {"statements": n, "errors": errors, "partial": partial, "seconds": round(elapsed, 3),
+            "statements_per_second": round(n / elapsed, 2) if elapsed > 0 else None}
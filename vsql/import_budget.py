@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# import_budget.py
+#
+# Mede o custo de `import cte_lineage_builder` num interpretador novo e falha
+# (código de saída 1) se passar do orçamento ou se o import carregar módulos
+# que devem ficar para depois (sqlglot, IPython). Use antes de mexer nos imports
+# da biblioteca, ou num job de CI:
+#
+#   python import_budget.py
+#   python import_budget.py --budget-ms 30 --repeat 7 --top 15
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+MODULE = "cte_lineage_builder"
+# não podem ser carregados só por importar a biblioteca
+LAZY_MODULES = ("sqlglot", "IPython", "concurrent.futures.process", "cProfile")
+
+_PROBE = f"""
+import sys, time
+t0 = time.perf_counter()
+import {MODULE}
+elapsed = time.perf_counter() - t0
+print(elapsed)
+print(",".join(m for m in {LAZY_MODULES!r} if m in sys.modules))
+"""
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(repeat=5):
+    """(melhor tempo de import em s, módulos adiados que foram carregados, [(cumulativo_us, módulo)] do -X importtime)."""
+    cwd = Path(__file__).resolve().parent
+    # mede o caso normal, com bytecode em __pycache__ (a 1ª execução o grava)
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+    subprocess.run([sys.executable, "-c", f"import {MODULE}"], cwd=cwd, env=env, check=True)
+    best = float("inf")
+    loaded = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _PROBE], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+        lines = out.stdout.splitlines()
+        best = min(best, float(lines[0]))
+        loaded = [m for m in (lines[1] if len(lines) > 1 else "").split(",") if m]
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {MODULE}"], cwd=cwd, env=env,
+                         capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if m:
+            rows.append((int(m.group(2)), m.group(4)))
+    return best, loaded, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=f"Orçamento de tempo de `import {MODULE}`.")
+    parser.add_argument("--budget-ms", type=float, default=50.0, help="tempo máximo de import (melhor de --repeat)")
+    parser.add_argument("--repeat", type=int, default=5, help="interpretadores novos medidos")
+    parser.add_argument("--top", type=int, default=10, help="módulos mais caros listados (-X importtime)")
+    args = parser.parse_args(argv)
+
+    best, loaded, rows = measure(args.repeat)
+    print(f"{'módulo':<40} {'cumulativo (ms)':>16}")
+    for us, name in sorted(rows, reverse=True)[: args.top]:
+        print(f"{name:<40} {us / 1000:>16.1f}")
+    print(f"\nimport {MODULE}: {best * 1000:.1f} ms (orçamento {args.budget_ms:.0f} ms)")
+    ok = True
+    if loaded:
+        print(f"❌ módulos que deveriam ser carregados sob demanda: {', '.join(loaded)}")
+        ok = False
+    if best * 1000 > args.budget_ms:
+        print("❌ acima do orçamento.")
+        ok = False
+    if ok:
+        print("✅ dentro do orçamento.")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# lineage_cache.py
+#
+# Cache persistente (em disco) da linhagem calculada por build_lineage.
+# A chave é o hash do SQL normalizado + versão do sqlglot + dialeto, então um
+# script que não mudou desde a última execução não precisa ser parseado de novo.
+# As entradas ficam num único arquivo SQLite (seguro para vários processos do
+# pool) com limite de tamanho e descarte LRU.
+
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+
+# Aumente quando o formato do resultado de build_lineage mudar: invalida o cache antigo.
+CACHE_FORMAT = 5
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def normalize_sql(sql: str):
+    """Normalização conservadora: quebras de linha, espaços no fim das linhas e bordas."""
+    return "\n".join(line.rstrip() for line in sql.strip().splitlines())
+
+def sqlglot_version():
+    try:
+        import sqlglot
+        return getattr(sqlglot, "__version__", "unknown")
+    except Exception:
+        return "missing"
+
+def cache_key(sql: str, dialect=None, *extra):
+    h = hashlib.sha256()
+    for part in (str(CACHE_FORMAT), sqlglot_version(), dialect or "", *map(str, extra)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    h.update(normalize_sql(sql).encode("utf-8"))
+    return h.hexdigest()
+
+
+class LineageCache:
+    """Cache chave→linhagem com limite de bytes e descarte do menos usado recentemente."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(self.directory / "lineage_cache.sqlite", timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " data BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)")
+
+    def get(self, key):
+        row = self._db.execute("SELECT data FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self._db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key, data):
+        blob = zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        if len(blob) > self.max_bytes:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries (key, data, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, blob, len(blob), time.time()),
+        )
+        self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # libera até 90% do limite para não despejar a cada inserção
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            victims.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self._db.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+    def size_bytes(self):
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self._db.close()
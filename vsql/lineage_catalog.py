@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+# lineage_catalog.py
+#
+# Catálogo persistente (SQLite) da linhagem de vários scripts.
+# Para cada coluna de saída (CTE ou FINAL_QUERY) de cada script guarda as
+# colunas de tabelas físicas de que ela depende transitivamente, indexadas por
+# tabela.coluna: "quem depende de TABLE_B.COL5?" vira uma busca no índice.
+# A ingestão é incremental por script: um script cujo conteúdo não mudou é
+# ignorado e um script alterado tem só as suas linhas substituídas.
+# As ligações coluna→coluna diretas de cada script também ficam guardadas
+# (tabela edges), para as análises do grafo combinado em lineage_matrix.py.
+#
+#   python lineage_catalog.py catalogo.sqlite impact TABLE_B.COL5
+#   python lineage_catalog.py catalogo.sqlite sources scripts/a.sql FINAL_QUERY COL1
+#   python lineage_catalog.py catalogo.sqlite stats
+#   python lineage_catalog.py catalogo.sqlite prune
+
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scripts (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    content_hash TEXT NOT NULL,
+    ingested_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    id INTEGER PRIMARY KEY,
+    script_id INTEGER NOT NULL REFERENCES scripts(id) ON DELETE CASCADE,
+    cte TEXT NOT NULL,
+    col TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_by_script ON outputs(script_id, cte, col);
+CREATE TABLE IF NOT EXISTS sources (
+    output_id INTEGER NOT NULL REFERENCES outputs(id) ON DELETE CASCADE,
+    tbl TEXT NOT NULL COLLATE NOCASE,
+    col TEXT NOT NULL COLLATE NOCASE
+);
+CREATE INDEX IF NOT EXISTS sources_by_column ON sources(tbl, col);
+CREATE INDEX IF NOT EXISTS sources_by_output ON sources(output_id);
+CREATE TABLE IF NOT EXISTS edges (
+    script_id INTEGER NOT NULL REFERENCES scripts(id) ON DELETE CASCADE,
+    src_cte TEXT NOT NULL,
+    src_col TEXT NOT NULL,
+    physical INTEGER NOT NULL,
+    dst_cte TEXT NOT NULL,
+    dst_col TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS edges_by_script ON edges(script_id);
+"""
+# PRAGMA user_version do catálogo; 2 = com a tabela edges
+_SCHEMA_VERSION = 2
+
+
+def dependency_kinds(cte_json, col_links=None):
+    """{(cte, coluna): [((cte_ou_tabela, coluna), é_cte)]} com as dependências de cada saída.
+
+    col_links (data["col_links"] do build_lineage) traz as dependências que o builder resolveu
+    para colunas de CTE; as demais são tabelas físicas, mesmo que a tabela tenha o nome de uma
+    CTE (ex.: raw.b lida antes de uma CTE b). Sem col_links, vale o nome: é CTE se for uma CTE do script.
+    """
+    if col_links is not None:
+        links = {(link["from"], link["to"]) for link in col_links}
+        is_cte = lambda cte, col, d: (f"{d['cte_name']}.{d['column_name']}", f"{cte}.{col}") in links
+    else:
+        cte_names = {cte["cte_name"] for cte in cte_json}
+        is_cte = lambda cte, col, d: d["cte_name"] in cte_names
+    deps = {}
+    for cte in cte_json:
+        for c in cte["cte_column"]:
+            deps.setdefault((cte["cte_name"], c["column_name"]), []).extend(
+                ((d["cte_name"], d["column_name"]), is_cte(cte["cte_name"], c["column_name"], d))
+                for d in c["dependencies"]
+            )
+    return deps
+
+
+def physical_sources(cte_json, col_links=None):
+    """{(cte, coluna): {(tabela, coluna)}} — fecho transitivo até as tabelas físicas.
+
+    O que é CTE e o que é tabela física vem de dependency_kinds. Dependências para uma coluna
+    de CTE inexistente são ignoradas, e um ciclo (só possível com a heurística por nome) é
+    cortado na aresta de volta, que não contribui com origens.
+    """
+    return _physical_closure(dependency_kinds(cte_json, col_links))
+
+
+def _physical_closure(deps):
+    """physical_sources a partir do resultado de dependency_kinds."""
+    memo = {}
+    visiting = set()
+    for key in deps:
+        # DFS iterativo em três estados (novo / em visita / pronto): cadeias profundas não
+        # estouram a pilha e uma aresta de volta para um nó em visita é terminal
+        stack = [key]
+        while stack:
+            node = stack[-1]
+            if node in memo:
+                stack.pop()
+                continue
+            if node not in visiting:
+                visiting.add(node)
+                stack.extend(d for d, is_cte in deps[node] if is_cte and d in deps and d not in memo and d not in visiting)
+                continue
+            leaves = set()
+            for d, is_cte in deps[node]:
+                if not is_cte:
+                    leaves.add(d)
+                elif d in memo:
+                    leaves |= memo[d]
+            memo[node] = leaves
+            visiting.discard(node)
+            stack.pop()
+    return memo
+
+
+def _script_key(script_path):
+    """Caminho do script como fica no catálogo: absoluto e resolvido (o lote grava assim)."""
+    return str(Path(script_path).resolve())
+
+
+class LineageCatalog:
+    """Catálogo de linhagem entre scripts, indexado por tabela.coluna física."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(_SCHEMA)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+            # catálogo antigo, sem as ligações: todos os scripts são regravados na próxima ingestão
+            self._db.execute("UPDATE scripts SET content_hash = ''")
+            self._db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+    def script_hash(self, script_path):
+        row = self._db.execute("SELECT content_hash FROM scripts WHERE path = ?", (_script_key(script_path),)).fetchone()
+        return row[0] if row else None
+
+    def upsert_script(self, script_path, cte_json, content_hash, col_links=None):
+        """Substitui a linhagem de um script. Retorna False se o conteúdo não mudou.
+
+        col_links (data["col_links"]) distingue as dependências de CTE das de tabelas físicas
+        (ver dependency_kinds)."""
+        script_path = _script_key(script_path)
+        if self.script_hash(script_path) == content_hash:
+            return False
+        deps = dependency_kinds(cte_json, col_links)
+        sources = _physical_closure(deps)
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM scripts WHERE path = ?", (script_path,))
+            script_id = db.execute(
+                "INSERT INTO scripts (path, content_hash, ingested_at) VALUES (?, ?, ?)",
+                (script_path, content_hash, time.time()),
+            ).lastrowid
+            for (cte, col), leaves in sources.items():
+                output_id = db.execute(
+                    "INSERT INTO outputs (script_id, cte, col) VALUES (?, ?, ?)", (script_id, cte, col)
+                ).lastrowid
+                db.executemany(
+                    "INSERT INTO sources (output_id, tbl, col) VALUES (?, ?, ?)",
+                    [(output_id, tbl, c) for tbl, c in sorted(leaves)],
+                )
+            db.executemany(
+                "INSERT INTO edges (script_id, src_cte, src_col, physical, dst_cte, dst_col) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (script_id, src_cte, src_col, not is_cte, cte, col)
+                    for (cte, col), dep_list in deps.items() for (src_cte, src_col), is_cte in dep_list
+                ],
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return True
+
+    def remove_script(self, script_path):
+        self._db.execute("DELETE FROM scripts WHERE path = ?", (_script_key(script_path),))
+
+    def prune_missing(self):
+        """Remove do catálogo os scripts cujo arquivo não existe mais."""
+        gone = [p for (p,) in self._db.execute("SELECT path FROM scripts").fetchall() if not Path(p).is_file()]
+        for p in gone:
+            self.remove_script(p)
+        return gone
+
+    def impacted_by(self, table, column, final_only=False):
+        """[(script, cte, coluna)] de todas as saídas que dependem de table.column."""
+        sql = (
+            "SELECT s.path, o.cte, o.col FROM sources src"
+            " JOIN outputs o ON o.id = src.output_id"
+            " JOIN scripts s ON s.id = o.script_id"
+            " WHERE src.tbl = ? AND src.col = ?"
+        )
+        if final_only:
+            sql += " AND o.cte = 'FINAL_QUERY'"
+        return self._db.execute(sql + " ORDER BY s.path, o.cte, o.col", (table, column)).fetchall()
+
+    def sources_of(self, script_path, cte, column):
+        """[(tabela, coluna)] físicas de que uma saída depende."""
+        return self._db.execute(
+            "SELECT src.tbl, src.col FROM sources src"
+            " JOIN outputs o ON o.id = src.output_id"
+            " JOIN scripts s ON s.id = o.script_id"
+            " WHERE s.path = ? AND o.cte = ? AND o.col = ?"
+            " ORDER BY src.tbl, src.col",
+            (_script_key(script_path), cte, column),
+        ).fetchall()
+
+    def column_edges(self):
+        """Ligações diretas de todos os scripts: (script, cte_origem, col_origem, física, cte_destino, col_destino).
+
+        Com física verdadeira, a origem é uma coluna de tabela física (cte_origem é a tabela).
+        """
+        return self._db.execute(
+            "SELECT s.path, e.src_cte, e.src_col, e.physical, e.dst_cte, e.dst_col"
+            " FROM edges e JOIN scripts s ON s.id = e.script_id"
+        )
+
+    def stats(self):
+        q = lambda sql: self._db.execute(sql).fetchone()[0]
+        return {
+            "scripts": q("SELECT COUNT(*) FROM scripts"),
+            "outputs": q("SELECT COUNT(*) FROM outputs"),
+            "sources": q("SELECT COUNT(*) FROM sources"),
+            "edges": q("SELECT COUNT(*) FROM edges"),
+            "physical_columns": q("SELECT COUNT(*) FROM (SELECT DISTINCT tbl, col FROM sources)"),
+        }
+
+    def close(self):
+        self._db.close()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Consultas ao catálogo de linhagem entre scripts.")
+    parser.add_argument("catalog", help="arquivo SQLite do catálogo (gerado com projeto-vsql.py --catalog)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_imp = sub.add_parser("impact", help="saídas que dependem de TABELA.COLUNA")
+    p_imp.add_argument("column", help="TABELA.COLUNA (o último ponto separa a coluna)")
+    p_imp.add_argument("--final-only", action="store_true", help="só colunas da query final")
+    p_src = sub.add_parser("sources", help="colunas físicas de que uma saída depende")
+    p_src.add_argument("script")
+    p_src.add_argument("cte")
+    p_src.add_argument("column")
+    sub.add_parser("stats", help="tamanho do catálogo")
+    sub.add_parser("prune", help="remove scripts cujo arquivo foi apagado")
+    args = parser.parse_args(argv)
+
+    catalog = LineageCatalog(args.catalog)
+    t0 = time.perf_counter()
+    if args.cmd == "impact":
+        table, _, column = args.column.rpartition(".")
+        if not table:
+            parser.error("use TABELA.COLUNA")
+        rows = catalog.impacted_by(table, column, final_only=args.final_only)
+        for path, cte, col in rows:
+            print(f"{path}\t{cte}.{col}")
+    elif args.cmd == "sources":
+        rows = catalog.sources_of(args.script, args.cte, args.column)
+        for tbl, col in rows:
+            print(f"{tbl}.{col}")
+    elif args.cmd == "prune":
+        rows = catalog.prune_missing()
+        for path in rows:
+            print(f"removido: {path}")
+    else:
+        rows = [catalog.stats()]
+        for k, v in rows[0].items():
+            print(f"{k}: {v}")
+    print(f"({len(rows)} linhas em {(time.perf_counter() - t0) * 1000:.1f} ms)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
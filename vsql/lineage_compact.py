@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# lineage_compact.py
+#
+# Formato compacto do lineage.json, gravado e lido em streaming.
+# Em vez de repetir o nome da CTE e da coluna em cada dependência, os nomes
+# entram uma única vez numa tabela de strings e as dependências viram índices
+# inteiros. O arquivo tem um registro JSON por linha:
+#
+#   {"format": "vsql-lineage-compact", "version": 2}   cabeçalho
+#   ["s", "NOME", ...]                                   novos nomes (índices seguem a ordem de chegada)
+#   ["c", cte, "query", "hash", [col, "hash", cte, col, cte, col, ...], ...]
+#                                                        uma CTE; cada coluna é [nome, hash, pares (cte, coluna) das dependências]
+#
+# Os hashes são os estruturais (cte_hash / column_hash) do lineage.json. A versão 1,
+# sem hashes, continua sendo lida.
+#
+# A tabela de strings cresce junto com o arquivo, então o writer não precisa do
+# documento inteiro em memória e o leitor reconstrói uma CTE por vez. Com sufixo
+# .gz o arquivo é comprimido com gzip.
+
+import gzip
+import json
+from pathlib import Path
+
+FORMAT = "vsql-lineage-compact"
+VERSION = 2
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+def _open(path, mode):
+    path = Path(path)
+    if path.suffix == ".gz":
+        # nível 6: quase o tamanho do 9 com metade do tempo
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6)
+    return open(path, mode, encoding="utf-8")
+
+
+def write_lineage_compact(cte_json, path):
+    """Grava `cte_json` (iterável de CTEs no formato do lineage.json) no formato compacto."""
+    index = {}
+
+    def intern(name, new):
+        i = index.get(name)
+        if i is None:
+            i = index[name] = len(index)
+            new.append(name)
+        return i
+
+    with _open(path, "w") as out:
+        out.write(_dumps({"format": FORMAT, "version": VERSION}) + "\n")
+        for cte in cte_json:
+            new = []
+            record = ["c", intern(cte["cte_name"], new), cte.get("cte_query", ""), cte.get("cte_hash", "")]
+            for c in cte["cte_column"]:
+                col = [intern(c["column_name"], new), c.get("column_hash", "")]
+                for d in c["dependencies"]:
+                    col.append(intern(d["cte_name"], new))
+                    col.append(intern(d["column_name"], new))
+                record.append(col)
+            if new:
+                out.write(_dumps(["s", *new]) + "\n")
+            out.write(_dumps(record) + "\n")
+
+
+def iter_lineage_compact(path):
+    """Lê um arquivo compacto e gera as CTEs, uma a uma, no formato do lineage.json."""
+    strings = []
+    with _open(path, "r") as f:
+        header = json.loads(f.readline() or "null")
+        if not isinstance(header, dict) or header.get("format") != FORMAT:
+            raise ValueError(f"{path}: não é um arquivo {FORMAT}")
+        version = header.get("version")
+        if version not in (1, VERSION):
+            raise ValueError(f"{path}: versão {version} não suportada")
+        hashed = version >= 2
+        first = 2 if hashed else 1  # posição da 1ª dependência em cada coluna
+        for line in f:
+            rec = json.loads(line)
+            if rec[0] == "s":
+                strings.extend(rec[1:])
+                continue
+            columns = []
+            for col in rec[4:] if hashed else rec[3:]:
+                c = {"column_name": strings[col[0]]}
+                if hashed:
+                    c["column_hash"] = col[1]
+                c["dependencies"] = [
+                    {"cte_name": strings[col[k]], "column_name": strings[col[k + 1]]}
+                    for k in range(first, len(col), 2)
+                ]
+                columns.append(c)
+            cte = {"cte_name": strings[rec[1]], "cte_query": rec[2]}
+            if hashed:
+                cte["cte_hash"] = rec[3]
+            cte["cte_column"] = columns
+            yield cte
+
+
+def read_lineage_compact(path):
+    """Lista completa de CTEs (mesmo conteúdo do lineage.json)."""
+    return list(iter_lineage_compact(path))
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# lineage_diff.py
+#
+# Diferença de linhagem entre duas versões de um script, pelos hashes
+# estruturais (cte_hash / column_hash) gravados junto com a linhagem.
+# O hash de uma coluna cobre a expressão e os hashes das colunas de que ela
+# depende; o de uma CTE, as suas colunas. CTEs com o mesmo hash são puladas sem
+# olhar as colunas, e só as CTEs alteradas são comparadas coluna a coluna.
+# Cada lado pode ser o .sql (analisado, ou lido do cache com --cache-dir) ou uma
+# linhagem já gerada (lineage.json, .cjson, .cjson.gz), que não é parseada de novo.
+#
+#   python lineage_diff.py antes.sql depois.sql
+#   python lineage_diff.py baseline/lineage.json modelo.sql --cache-dir .vsql_cache
+#   python lineage_diff.py antes.lineage.cjson.gz depois.lineage.cjson.gz --json
+
+import json
+import sys
+import time
+from pathlib import Path
+
+# motivo da mudança de uma coluna → texto do relatório
+REASONS = {
+    "dependencies": "dependências alteradas",
+    "upstream": "origem alterada",
+    "expression": "expressão alterada",
+}
+
+
+def load_lineage(path, dialect=None, cache_dir=None):
+    """Lista de CTEs (formato do lineage.json) com hashes: .sql é analisado (ou lido do cache),
+    .json / .cjson / .cjson.gz são só lidos."""
+    path = Path(path)
+    if path.suffix == ".sql":
+        from cte_lineage_builder import build_lineage_cached
+        from lineage_cache import LineageCache
+
+        cache = LineageCache(cache_dir) if cache_dir else None
+        try:
+            cte_json = build_lineage_cached(path.read_text(encoding="utf-8"), dialect, cache)["cte_json"]
+        finally:
+            if cache is not None:
+                cache.close()
+    elif path.name.endswith((".cjson", ".cjson.gz")):
+        from lineage_compact import read_lineage_compact
+
+        cte_json = read_lineage_compact(path)
+    else:
+        cte_json = json.loads(path.read_text(encoding="utf-8"))
+    if any("cte_hash" not in cte for cte in cte_json):
+        raise ValueError(f"{path}: linhagem sem hashes estruturais (gerada por uma versão antiga; gere de novo)")
+    return cte_json
+
+
+def _deps(column):
+    return [(d["cte_name"], d["column_name"]) for d in column["dependencies"]]
+
+
+def diff_lineage(old, new):
+    """Compara duas listas de CTEs (formato do lineage.json) pelos hashes.
+
+    Retorna {"added": [...], "removed": [...], "changed": [...], "ctes_compared": n, "ctes_unchanged": n},
+    com itens {"cte": ..., "column": ...} (e "reason" nos alterados: REASONS). Em "changed", "upstream"
+    quer dizer que a coluna em si não mudou, mas alguma coluna de que ela depende mudou ou sumiu.
+    """
+    old_by_name = {cte["cte_name"]: cte for cte in old}
+    new_names = {cte["cte_name"] for cte in new}
+    added, removed, changed = [], [], []
+    touched = set()  # colunas alteradas ou removidas das CTEs já comparadas
+    compared = unchanged = 0
+    # new está em ordem topológica: as origens de uma coluna já foram comparadas quando ela chega
+    for cte in new:
+        name = cte["cte_name"]
+        before = old_by_name.get(name)
+        if before is None:
+            added.extend({"cte": name, "column": c["column_name"]} for c in cte["cte_column"])
+            continue
+        if before["cte_hash"] == cte["cte_hash"]:
+            unchanged += 1
+            continue
+        compared += 1
+        old_cols = {}
+        for c in before["cte_column"]:
+            old_cols.setdefault(c["column_name"], c)
+        seen = set()
+        for c in cte["cte_column"]:
+            col = c["column_name"]
+            if col in seen:
+                continue
+            seen.add(col)
+            prev = old_cols.get(col)
+            if prev is None:
+                added.append({"cte": name, "column": col})
+            elif prev["column_hash"] != c["column_hash"]:
+                deps = _deps(c)
+                if deps != _deps(prev):
+                    reason = "dependencies"
+                elif any(d in touched for d in deps):
+                    reason = "upstream"
+                else:
+                    reason = "expression"
+                changed.append({"cte": name, "column": col, "reason": reason})
+                touched.add((name, col))
+        for col in old_cols:
+            if col not in seen:
+                removed.append({"cte": name, "column": col})
+                touched.add((name, col))
+    for cte in old:
+        if cte["cte_name"] not in new_names:
+            removed.extend({"cte": cte["cte_name"], "column": c["column_name"]} for c in cte["cte_column"])
+    return {
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "ctes_compared": compared,
+        "ctes_unchanged": unchanged,
+    }
+
+
+def format_diff(diff):
+    """Relatório em texto: uma linha por coluna (+ adicionada, - removida, ~ alterada) e um resumo."""
+    lines = [f"+ {d['cte']}.{d['column']}" for d in diff["added"]]
+    lines += [f"- {d['cte']}.{d['column']}" for d in diff["removed"]]
+    lines += [f"~ {d['cte']}.{d['column']} ({REASONS[d['reason']]})" for d in diff["changed"]]
+    if lines:
+        lines.append(f"{len(diff['added'])} adicionadas, {len(diff['removed'])} removidas, "
+                     f"{len(diff['changed'])} alteradas ({diff['ctes_compared']} CTEs comparadas coluna a coluna, "
+                     f"{diff['ctes_unchanged']} iguais).")
+    else:
+        lines.append(f"✅ sem diferenças de linhagem ({diff['ctes_unchanged']} CTEs iguais).")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Diferença de linhagem de colunas entre duas versões de um script.")
+    parser.add_argument("old", help="versão antiga: .sql, lineage.json, .cjson ou .cjson.gz")
+    parser.add_argument("new", help="versão nova: .sql, lineage.json, .cjson ou .cjson.gz")
+    parser.add_argument("--dialect", default=None, help="dialeto do sqlglot para os .sql")
+    parser.add_argument("--cache-dir", default=None, help="cache persistente de linhagem (o mesmo de projeto-vsql.py)")
+    parser.add_argument("--json", action="store_true", help="imprime o resultado em JSON")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    try:
+        old = load_lineage(args.old, args.dialect, args.cache_dir)
+        new = load_lineage(args.new, args.dialect, args.cache_dir)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    t1 = time.perf_counter()
+    diff = diff_lineage(old, new)
+    t2 = time.perf_counter()
+    if args.json:
+        print(json.dumps(diff, indent=2, ensure_ascii=False))
+    else:
+        print(format_diff(diff))
+    print(f"(leitura {(t1 - t0) * 1000:.1f} ms, comparação {(t2 - t1) * 1000:.1f} ms)", file=sys.stderr)
+    return 1 if diff["added"] or diff["removed"] or diff["changed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# lineage_layout.py
+#
+# Layout em camadas (estilo Sugiyama) do grafo de CTEs, calculado em Python e
+# entregue pronto ao visualizador (layout "preset" do Cytoscape), para a página
+# não rodar o breadthfirst no navegador.
+#
+#   1. camadas: caminho mais longo a partir das fontes (uma camada por coluna, esquerda→direita);
+#   2. arestas que pulam camadas ganham nós fictícios, um por camada intermediária;
+#   3. redução de cruzamentos: varreduras alternadas pelo baricentro dos vizinhos,
+#      guardando a ordem com menos cruzamentos;
+#   4. coordenadas: x pela camada; y empilhando os nós da camada com o espaço da
+#      tabela expandida de cada CTE (nº de colunas) e alinhando cada nó, quando
+#      cabe, à média dos seus predecessores.
+
+import hashlib
+import json
+from bisect import bisect_right, insort
+
+# Aumente quando o algoritmo mudar: invalida layouts guardados em cache.
+LAYOUT_VERSION = 1
+
+# Geometria do visualizador (ver _html_page em cte_lineage_builder.py)
+NODE_W = 240
+NODE_H = 64
+HEADER_H = 22
+ROW_H = 18
+PADDING = 10
+LAYER_GAP = 160         # espaço horizontal entre camadas
+NODE_GAP = 28           # espaço vertical entre nós da mesma camada
+MAX_RESERVED_ROWS = 40  # tabelas enormes reservam no máximo esta altura (o resto pode sobrepor)
+SWEEPS = 12
+
+
+def layout_key(nodes, edges, columns):
+    """Hash do que determina o layout: nós, arestas e nº de colunas de cada nó."""
+    h = hashlib.sha256(f"layout{LAYOUT_VERSION}".encode("utf-8"))
+    h.update(json.dumps([list(nodes), [list(e) for e in edges], [columns.get(n, 0) for n in nodes]],
+                        ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _graph(nodes, edges):
+    """(succ, preds) sem laços, arestas repetidas ou nós desconhecidos."""
+    succ = {n: [] for n in nodes}
+    preds = {n: [] for n in nodes}
+    for s, t in dict.fromkeys(map(tuple, edges)):
+        if s in succ and t in succ and s != t:
+            succ[s].append(t)
+            preds[t].append(s)
+    return succ, preds
+
+
+def _topological(nodes, succ):
+    """Ordem topológica (Kahn); num ciclo, o primeiro nó pendente de `nodes` é liberado."""
+    indeg = dict.fromkeys(nodes, 0)
+    for n in nodes:
+        for t in succ[n]:
+            indeg[t] += 1
+    ready = [n for n in nodes if indeg[n] == 0]
+    seen = set()
+    out = []
+    pos = 0
+    while len(out) < len(nodes):
+        if pos == len(ready):
+            ready.append(next(n for n in nodes if n not in seen))
+        n = ready[pos]
+        pos += 1
+        if n in seen:
+            continue
+        seen.add(n)
+        out.append(n)
+        for t in succ[n]:
+            indeg[t] -= 1
+            if indeg[t] == 0 and t not in seen:
+                ready.append(t)
+    return out
+
+
+def assign_layers(nodes, succ, preds):
+    """{nó: camada} pelo caminho mais longo desde as fontes. Arestas que fecham ciclo são ignoradas."""
+    order = _topological(nodes, succ)
+    rank = {n: i for i, n in enumerate(order)}
+    layer = {}
+    for n in order:
+        layer[n] = max((layer[p] + 1 for p in preds[n] if rank[p] < rank[n]), default=0)
+    return layer
+
+
+def _crossings(upper, lower, down):
+    """Cruzamentos entre duas camadas vizinhas (inversões na ordem das pontas de baixo)."""
+    pos = {n: i for i, n in enumerate(lower)}
+    ends = sorted((i, pos[t]) for i, n in enumerate(upper) for t in down[n])
+    count = 0
+    seen = []
+    for _, p in ends:
+        count += len(seen) - bisect_right(seen, p)
+        insort(seen, p)
+    return count
+
+
+def order_layers(layers, down, up):
+    """Reduz cruzamentos com o método do baricentro; retorna a melhor ordem encontrada."""
+
+    def total(ls):
+        return sum(_crossings(ls[i], ls[i + 1], down) for i in range(len(ls) - 1))
+
+    best = [list(l) for l in layers]
+    best_count = total(best)
+    current = [list(l) for l in layers]
+    for sweep in range(SWEEPS):
+        if best_count == 0:
+            break
+        downward = sweep % 2 == 0
+        rng = range(1, len(current)) if downward else range(len(current) - 2, -1, -1)
+        for i in rng:
+            ref = current[i - 1] if downward else current[i + 1]
+            neigh = up if downward else down
+            pos = {n: k for k, n in enumerate(ref)}
+            keyed = []
+            for k, n in enumerate(current[i]):
+                ps = [pos[m] for m in neigh[n] if m in pos]
+                # sem vizinhos: mantém a posição atual
+                keyed.append((sum(ps) / len(ps) if ps else k, k, n))
+            keyed.sort()
+            current[i] = [n for _, _, n in keyed]
+        count = total(current)
+        if count < best_count:
+            best, best_count = [list(l) for l in current], count
+    return best, best_count
+
+
+def reserved_height(n_columns):
+    """Altura ocupada por uma CTE: a caixa ou a tabela expandida (limitada a MAX_RESERVED_ROWS)."""
+    rows = min(n_columns, MAX_RESERVED_ROWS)
+    return max(NODE_H, HEADER_H + rows * ROW_H + PADDING * 2)
+
+
+def layered_layout(nodes, edges, columns=None):
+    """{nó: (x, y)} (centro do nó, em unidades do Cytoscape) para o grafo de CTEs.
+
+    columns: {nó: nº de colunas}, usado para reservar o espaço da tabela expandida.
+    """
+    nodes = list(nodes)
+    columns = columns or {}
+    if not nodes:
+        return {}
+    succ, preds = _graph(nodes, edges)
+    layer = assign_layers(nodes, succ, preds)
+
+    # nós fictícios para arestas longas: cada aresta vira uma cadeia entre camadas vizinhas
+    down = {n: [] for n in nodes}
+    up = {n: [] for n in nodes}
+    n_layers = max(layer.values()) + 1
+    layers = [[] for _ in range(n_layers)]
+    for n in nodes:
+        layers[layer[n]].append(n)
+    for s in nodes:
+        for t in succ[s]:
+            if layer[t] <= layer[s]:
+                continue  # aresta de ciclo: fora do layout
+            prev = s
+            for k in range(layer[s] + 1, layer[t]):
+                d = ("dummy", s, t, k)
+                down[d], up[d] = [], []
+                layers[k].append(d)
+                down[prev].append(d)
+                up[d].append(prev)
+                prev = d
+            down[prev].append(t)
+            up[t].append(prev)
+
+    layers, _ = order_layers(layers, down, up)
+
+    # coordenadas: camadas da esquerda para a direita; na camada, empilha de cima para baixo
+    pos = {}
+    for i, ls in enumerate(layers):
+        x = i * (NODE_W + LAYER_GAP)
+        y = 0.0  # topo livre da camada
+        for n in ls:
+            if isinstance(n, tuple):
+                continue  # fictícios só contam na ordem
+            ps = [pos[p][1] for p in preds[n] if p in pos]
+            top = y
+            if ps:
+                # alinha à média dos predecessores, sem subir sobre o nó anterior
+                top = max(y, sum(ps) / len(ps) - NODE_H / 2)
+            pos[n] = (x, top + NODE_H / 2)
+            y = top + reserved_height(columns.get(n, 0)) + NODE_GAP
+    return pos
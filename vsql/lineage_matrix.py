@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+# lineage_matrix.py
+#
+# Análise de impacto no grafo de colunas de todo o catálogo (lineage_catalog.py)
+# com matrizes esparsas (NumPy/SciPy). As ligações diretas de todos os scripts
+# viram uma única matriz de adjacência CSR. Os nós são as colunas físicas
+# (tabela.coluna, sem diferenciar maiúsculas, compartilhadas entre scripts) e as
+# colunas de saída de cada script. A alcançabilidade é calculada nível a nível
+# com operações vetorizadas, em vez de uma caminhada coluna a coluna: um conjunto
+# de origens avança um nível por fatia de linhas da matriz, e as contagens de
+# dependentes de um lote de origens saem de uma passada pelos níveis topológicos,
+# com um produto de matrizes esparsas por nível.
+#
+#   python lineage_matrix.py downstream catalogo.sqlite TABLE_B.COL5 TABLE_A.COL1
+#   python lineage_matrix.py top catalogo.sqlite -n 20 --final-only
+#   python lineage_matrix.py bench --columns 200000 --edges 1000000
+
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+
+from cte_lineage_builder import FINAL_SCOPE
+
+
+class ColumnGraph:
+    """Grafo de colunas como matriz esparsa: adj[i, j] = 1 se a coluna j lê diretamente a coluna i.
+
+    Os nós 0..n_physical-1 são as colunas físicas. `labels` traz o nome de cada nó
+    ("TABELA.COL" ou "script<TAB>CTE.COL") e `final` marca as colunas da query final.
+    """
+
+    def __init__(self, labels, n_physical, src, dst, final):
+        n = len(labels)
+        self.labels = labels
+        self.n_physical = n_physical
+        self.final = np.asarray(final, dtype=bool)
+        src = np.asarray(src, dtype=np.int64)
+        adj = sparse.csr_matrix((np.ones(src.size, dtype=np.int32), (src, np.asarray(dst, dtype=np.int64))),
+                                shape=(n, n))
+        adj.data[:] = 1  # ligações repetidas foram somadas
+        self.adj = adj
+        self._physical_index = {label.lower(): i for i, label in enumerate(labels[:n_physical])}
+        self._levels = None  # topological_levels(); False = grafo com ciclo
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """Grafo combinado de todos os scripts de um LineageCatalog."""
+        physical, outputs = {}, {}
+        physical_labels, output_labels, final = [], [], []
+        src, src_physical, dst = [], [], []
+
+        def output_id(path, cte, col):
+            key = (path, cte, col)
+            i = outputs.get(key)
+            if i is None:
+                i = outputs[key] = len(output_labels)
+                output_labels.append(f"{path}\t{cte}.{col}")
+                final.append(cte == FINAL_SCOPE)
+            return i
+
+        for path, src_cte, src_col, is_physical, dst_cte, dst_col in catalog.column_edges():
+            if is_physical:
+                key = (src_cte.lower(), src_col.lower())
+                s = physical.get(key)
+                if s is None:
+                    s = physical[key] = len(physical_labels)
+                    physical_labels.append(f"{src_cte}.{src_col}")
+            else:
+                s = output_id(path, src_cte, src_col)
+            src.append(s)
+            src_physical.append(is_physical)
+            dst.append(output_id(path, dst_cte, dst_col))
+        # as colunas físicas vêm primeiro: os ids das saídas são deslocados de n_physical
+        n_physical = len(physical_labels)
+        src = np.asarray(src, dtype=np.int64) + np.where(np.asarray(src_physical, dtype=bool), 0, n_physical)
+        dst = np.asarray(dst, dtype=np.int64) + n_physical
+        return cls(physical_labels + output_labels, n_physical, src, dst, [False] * n_physical + final)
+
+    def source_index(self, names):
+        """Índices dos nós de uma lista de colunas físicas "TABELA.COLUNA" (sem diferenciar maiúsculas)."""
+        missing = [name for name in names if name.lower() not in self._physical_index]
+        if missing:
+            raise ValueError(f"colunas físicas não encontradas no catálogo: {', '.join(missing)}")
+        return np.array([self._physical_index[name.lower()] for name in names], dtype=np.int64)
+
+    def downstream(self, sources):
+        """Índices (ordenados) das colunas que dependem, direta ou indiretamente, de alguma de `sources`.
+
+        Busca em largura por níveis: o nível seguinte é a união das linhas do nível atual na matriz.
+        """
+        adj = self.adj
+        reached = np.zeros(adj.shape[0], dtype=bool)
+        frontier = np.unique(adj[np.asarray(sources, dtype=np.int64)].indices)
+        while frontier.size:
+            frontier = frontier[~reached[frontier]]
+            reached[frontier] = True
+            frontier = np.unique(adj[frontier].indices)
+        return np.flatnonzero(reached)
+
+    def topological_levels(self):
+        """Nós por nível topológico (Kahn vetorizado: um nível por fatia de linhas), ou None se houver ciclo."""
+        if self._levels is None:
+            adj = self.adj
+            n = adj.shape[0]
+            indegree = adj.getnnz(axis=0).astype(np.int64)
+            levels = []
+            frontier = np.flatnonzero(indegree == 0)
+            while frontier.size:
+                levels.append(frontier)
+                children = adj[frontier].indices
+                indegree -= np.bincount(children, minlength=n)
+                children = np.unique(children)
+                frontier = children[indegree[children] == 0]
+            self._levels = levels if sum(level.size for level in levels) == n else False
+        return self._levels or None
+
+    def downstream_counts(self, sources, batch_size=4096):
+        """(nº de colunas dependentes, nº delas na query final) de cada nó de `sources`, como arrays.
+
+        Num grafo acíclico (o normal: a linhagem só aponta para CTEs anteriores e tabelas físicas),
+        percorre os níveis topológicos uma vez por lote de `batch_size` origens. A linha de cada nó
+        numa matriz esparsa nós × origens é o OU das linhas dos pais (um produto de matrizes por
+        nível), e a contagem de uma origem é o nº de linhas que a contêm. Com ciclo, cai na busca
+        em largura por lotes (_counts_by_search).
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        levels = self.topological_levels()
+        if levels is None:
+            return self._counts_by_search(sources, batch_size)
+        n = self.adj.shape[0]
+        position = np.empty(n, dtype=np.int64)
+        position[np.concatenate(levels)] = np.arange(n)
+        # pais de cada nível, com as colunas já na ordem topológica (os pais vêm sempre antes)
+        parents = self.adj.T.tocsr()
+        blocks, done = [], 0
+        for level in levels:
+            rows = parents[level]
+            blocks.append(sparse.csr_matrix((rows.data, position[rows.indices], rows.indptr), shape=(level.size, done)))
+            done += level.size
+        final_rows = self.final[np.concatenate(levels)].astype(np.int64)
+
+        total = np.zeros(sources.size, dtype=np.int64)
+        final = np.zeros(sources.size, dtype=np.int64)
+        column = np.full(n, -1, dtype=np.int64)
+        for start in range(0, sources.size, batch_size):
+            batch, inverse = np.unique(sources[start:start + batch_size], return_inverse=True)
+            column[batch] = np.arange(batch.size)
+            # as linhas já calculadas ficam num único acumulador CSR, preenchido nível a nível; refazer
+            # a matriz a cada nível (vstack) custaria quadrático na profundidade do grafo
+            reached = _RowAccumulator(n, batch.size)
+            for level, block in zip(levels, blocks):
+                rows = block @ reached.matrix()
+                own = np.flatnonzero(column[level] >= 0)
+                if own.size:
+                    # cada origem alcança a si mesma (descontada no fim)
+                    rows = rows + sparse.csr_matrix(
+                        (np.ones(own.size, dtype=np.int32), (own, column[level[own]])), shape=rows.shape)
+                reached.append(rows)
+            reached = reached.matrix()
+            column[batch] = -1
+            stop = start + inverse.size
+            total[start:stop] = (reached.getnnz(axis=0) - 1)[inverse]
+            final[start:stop] = (reached.T @ final_rows)[inverse] - self.final[batch][inverse]
+        return total, final
+
+    def _counts_by_search(self, sources, batch_size):
+        """Como downstream_counts, por busca em largura: cada lote é uma matriz esparsa, uma linha por
+        origem, que avança um nível por produto com a matriz de adjacência, sem repetir colunas."""
+        adj = self.adj
+        total = np.zeros(sources.size, dtype=np.int64)
+        final = np.zeros(sources.size, dtype=np.int64)
+        final_vec = self.final.astype(np.int64)
+        for start in range(0, sources.size, batch_size):
+            frontier = adj[sources[start:start + batch_size]]
+            reached = frontier
+            while frontier.nnz:
+                frontier = frontier @ adj
+                frontier.data[:] = 1
+                frontier = frontier - frontier.multiply(reached)
+                frontier.eliminate_zeros()
+                reached = reached + frontier
+            stop = start + reached.shape[0]
+            total[start:stop] = reached.getnnz(axis=1)
+            final[start:stop] = reached @ final_vec
+        return total, final
+
+    def top_sources(self, n=20, final_only=False, batch_size=4096):
+        """[(coluna física, nº de dependentes, nº na query final)] das n colunas físicas com mais dependentes.
+
+        Com final_only, a ordem é pelo nº de dependentes na query final.
+        """
+        total, final = self.downstream_counts(np.arange(self.n_physical), batch_size)
+        order = np.argsort(-(final if final_only else total), kind="stable")[:n]
+        return [(self.labels[i], int(total[i]), int(final[i])) for i in order]
+
+
+class _RowAccumulator:
+    """Matriz CSR (0/1) que cresce por blocos de linhas no fim, sem recopiar as linhas anteriores.
+
+    Os vetores indices/data dobram de tamanho quando enchem (custo amortizado linear) e matrix()
+    devolve uma visão das linhas já acrescentadas, sem cópia.
+    """
+
+    def __init__(self, max_rows, n_cols):
+        self.n_cols = n_cols
+        self.rows = 0
+        self.indptr = np.zeros(max_rows + 1, dtype=np.int32)
+        self.indices = np.empty(1024, dtype=np.int32)
+        self.data = np.ones(1024, dtype=np.int32)
+
+    def append(self, block):
+        """Acrescenta as linhas de `block` (CSR com n_cols colunas), marcando como 1 as posições não nulas."""
+        nnz = int(self.indptr[self.rows])
+        end = nnz + block.nnz
+        if end > self.indices.size:
+            self.indices = np.resize(self.indices, max(end, 2 * self.indices.size))
+            self.data = np.ones(self.indices.size, dtype=np.int32)
+        self.indices[nnz:end] = block.indices
+        count = block.shape[0]
+        self.indptr[self.rows + 1:self.rows + count + 1] = block.indptr[1:] + nnz
+        self.rows += count
+
+    def matrix(self):
+        nnz = int(self.indptr[self.rows])
+        return sparse.csr_matrix((self.data[:nnz], self.indices[:nnz], self.indptr[:self.rows + 1]),
+                                 shape=(self.rows, self.n_cols), copy=False)
+
+
+# =====================================================
+# Referência: caminhada coluna a coluna (dicionários)
+# =====================================================
+def children_lists(graph):
+    """{nó: [nós que o leem]}: o grafo na forma usada pela caminhada coluna a coluna."""
+    indptr = graph.adj.indptr
+    indices = graph.adj.indices.tolist()
+    return {i: indices[indptr[i]:indptr[i + 1]] for i in range(graph.adj.shape[0]) if indptr[i + 1] > indptr[i]}
+
+
+def walk_downstream(children, sources):
+    """Conjunto dos nós que dependem de algum de `sources`, por DFS em Python."""
+    seen = set()
+    stack = [c for s in sources for c in children.get(s, ())]
+    while stack:
+        node = stack.pop()
+        if node not in seen:
+            seen.add(node)
+            stack.extend(children.get(node, ()))
+    return seen
+
+
+# =====================================================
+# Benchmark
+# =====================================================
+def synthetic_graph(columns=200_000, edges=1_000_000, scripts=500, physical=20_000, width=20, seed=0):
+    """Grafo sintético no formato do catálogo, com ~`columns` nós e ~`edges` ligações.
+
+    Cada um dos `scripts` scripts tem camadas de `width` colunas. As colunas da 1ª camada leem
+    colunas físicas sorteadas entre `physical` (compartilhadas entre scripts), as das demais leem
+    colunas sorteadas da camada anterior, e a última camada é a query final.
+    """
+    rng = np.random.default_rng(seed)
+    layers = max(1, (columns - physical) // scripts // width)
+    per_script = layers * width
+    n_out = per_script * scripts
+    degree = max(1, round(edges / n_out))
+    node = np.repeat(np.arange(n_out), degree)
+    local = node % per_script
+    layer = local // width
+    previous = node - local + (layer - 1) * width + rng.integers(0, width, node.size)
+    src = np.where(layer == 0, rng.integers(0, physical, node.size), physical + previous)
+    labels = [f"TABLE_{i // 50}.COL{i % 50}" for i in range(physical)]
+    labels += [f"script_{i // per_script}.sql\tCTE_{i % per_script // width}.C{i % width}" for i in range(n_out)]
+    final = np.zeros(physical + n_out, dtype=bool)
+    final[physical:] = np.arange(n_out) % per_script >= per_script - width
+    return ColumnGraph(labels, physical, src, physical + node, final)
+
+
+def bench(columns, edges, scripts, physical, seeds, walk_sample, batch_size, deep_scripts=15, seed=0):
+    """Mede a matriz esparsa contra a caminhada em dicionários nas duas consultas; retorna {fase: segundos}.
+
+    Com deep_scripts, repete o top-N num grafo do mesmo tamanho com só `deep_scripts` scripts, ou
+    seja, cadeias de CTEs bem mais profundas (centenas de níveis topológicos).
+    """
+    rng = np.random.default_rng(seed + 1)
+    timings = {}
+    t0 = time.perf_counter()
+    graph = synthetic_graph(columns, edges, scripts, physical, seed=seed)
+    timings["montagem da matriz"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    children = children_lists(graph)
+    timings["montagem dos dicionários"] = time.perf_counter() - t0
+    print(f"grafo: {graph.adj.shape[0]} colunas ({graph.n_physical} físicas), {graph.adj.nnz} ligações")
+
+    # "todas as colunas abaixo deste conjunto de origens"
+    sources = rng.choice(graph.n_physical, min(seeds, graph.n_physical), replace=False)
+    t0 = time.perf_counter()
+    walked = walk_downstream(children, sources.tolist())
+    timings["conjunto: caminhada"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    reached = graph.downstream(sources)
+    timings["conjunto: matriz"] = time.perf_counter() - t0
+    if set(reached.tolist()) != walked:
+        raise AssertionError("downstream difere da caminhada")
+
+    # "top-N origens com mais dependentes": contagem de todas as colunas físicas
+    t0 = time.perf_counter()
+    total, _ = graph.downstream_counts(np.arange(graph.n_physical), batch_size)
+    timings["top-N: matriz"] = time.perf_counter() - t0
+    sample = rng.choice(graph.n_physical, min(walk_sample, graph.n_physical), replace=False)
+    t0 = time.perf_counter()
+    counts = [len(walk_downstream(children, [s])) for s in sample.tolist()]
+    elapsed = time.perf_counter() - t0
+    if counts != total[sample].tolist():
+        raise AssertionError("contagens diferem da caminhada")
+    # a caminhada de todas as origens é estimada pela amostra
+    timings["top-N: caminhada"] = elapsed * graph.n_physical / sample.size
+    queries = ["conjunto", "top-N"]
+
+    # a mesma contagem com cadeias profundas: o custo por nível não pode crescer com a profundidade
+    if deep_scripts:
+        deep = synthetic_graph(columns, edges, deep_scripts, physical, seed=seed)
+        depth = len(deep.topological_levels())
+        children = children_lists(deep)
+        t0 = time.perf_counter()
+        total, _ = deep.downstream_counts(np.arange(deep.n_physical), batch_size)
+        timings["profundo: matriz"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        counts = [len(walk_downstream(children, [s])) for s in sample.tolist()]
+        timings["profundo: caminhada"] = (time.perf_counter() - t0) * deep.n_physical / sample.size
+        if counts != total[sample].tolist():
+            raise AssertionError("contagens diferem da caminhada no grafo profundo")
+        queries.append("profundo")
+
+    print(f"conjunto de {sources.size} origens: {reached.size} colunas dependentes")
+    print(f"top-N: caminhada medida em {sample.size} de {graph.n_physical} origens e extrapolada")
+    if deep_scripts:
+        print(f"profundo: top-N em {deep_scripts} scripts, {depth} níveis topológicos")
+    print(f"{'fase':<28} {'tempo (s)':>10}")
+    for name, seconds in timings.items():
+        print(f"{name:<28} {seconds:>10.3f}")
+    for query in queries:
+        ratio = timings[f"{query}: caminhada"] / max(timings[f"{query}: matriz"], 1e-9)
+        print(f"{query}: matriz {ratio:.1f}× mais rápida que a caminhada")
+    return timings
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Impacto no grafo de colunas de todo o catálogo, com matrizes esparsas.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_down = sub.add_parser("downstream", help="colunas que dependem de um conjunto de colunas físicas")
+    p_down.add_argument("catalog", help="arquivo SQLite do catálogo (projeto-vsql.py --catalog)")
+    p_down.add_argument("columns", nargs="+", help="TABELA.COLUNA")
+    p_down.add_argument("--final-only", action="store_true", help="só colunas da query final")
+    p_top = sub.add_parser("top", help="colunas físicas com mais colunas dependentes")
+    p_top.add_argument("catalog", help="arquivo SQLite do catálogo (projeto-vsql.py --catalog)")
+    p_top.add_argument("-n", type=int, default=20, help="quantas colunas listar")
+    p_top.add_argument("--final-only", action="store_true", help="ordena pelos dependentes na query final")
+    p_top.add_argument("--batch-size", type=int, default=4096, help="origens por passada nos níveis")
+    p_bench = sub.add_parser("bench", help="compara com a caminhada coluna a coluna num grafo sintético")
+    p_bench.add_argument("--columns", type=int, default=200_000, help="nº aproximado de colunas")
+    p_bench.add_argument("--edges", type=int, default=1_000_000, help="nº aproximado de ligações")
+    p_bench.add_argument("--scripts", type=int, default=500, help="scripts do catálogo sintético")
+    p_bench.add_argument("--physical", type=int, default=20_000, help="colunas físicas compartilhadas")
+    p_bench.add_argument("--seeds", type=int, default=100, help="origens da consulta de conjunto")
+    p_bench.add_argument("--walk-sample", type=int, default=2000, help="origens medidas na caminhada do top-N")
+    p_bench.add_argument("--batch-size", type=int, default=4096, help="origens por passada nos níveis")
+    p_bench.add_argument("--deep-scripts", type=int, default=15,
+                         help="scripts do grafo profundo (top-N com cadeias longas; 0 desliga)")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "bench":
+        bench(args.columns, args.edges, args.scripts, args.physical, args.seeds, args.walk_sample, args.batch_size,
+              args.deep_scripts)
+        return
+
+    from lineage_catalog import LineageCatalog
+
+    catalog = LineageCatalog(args.catalog)
+    t0 = time.perf_counter()
+    try:
+        graph = ColumnGraph.from_catalog(catalog)
+    finally:
+        catalog.close()
+    t1 = time.perf_counter()
+    if args.cmd == "downstream":
+        try:
+            sources = graph.source_index(args.columns)
+        except ValueError as e:
+            parser.error(str(e))
+        rows = [graph.labels[i] for i in graph.downstream(sources) if graph.final[i] or not args.final_only]
+        for label in rows:
+            print(label)
+    else:
+        rows = graph.top_sources(args.n, final_only=args.final_only, batch_size=args.batch_size)
+        for label, total, final in rows:
+            print(f"{label}\t{total}\t{final}")
+    print(f"({len(rows)} linhas; grafo de {graph.adj.shape[0]} colunas e {graph.adj.nnz} ligações carregado em "
+          f"{(t1 - t0) * 1000:.1f} ms, consulta {(time.perf_counter() - t1) * 1000:.1f} ms)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# lineage_profile.py
+#
+# Instrumentação do build_lineage: cronômetros por fase, contadores e
+# distribuições (ex.: tamanho dos conjuntos de folhas), com captura opcional
+# do cProfile. Desligada, a instrumentação é um objeto nulo de custo mínimo.
+
+import json
+import time
+from pathlib import Path
+
+
+class _Phase:
+    __slots__ = ("prof", "name", "start", "child")
+
+    def __init__(self, prof, name):
+        self.prof = prof
+        self.name = name
+
+    def __enter__(self):
+        self.child = 0.0
+        self.prof._stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stack = self.prof._stack
+        stack.pop()
+        if stack:
+            stack[-1].child += elapsed
+        st = self.prof.phases.get(self.name)
+        if st is None:
+            st = self.prof.phases[self.name] = [0, 0.0, 0.0]
+        st[0] += 1
+        st[1] += elapsed
+        st[2] += elapsed - self.child
+        return False
+
+
+class Profiler:
+    """Acumula, por fase, nº de chamadas, tempo total (inclusivo) e próprio (sem as fases internas)."""
+
+    enabled = True
+
+    def __init__(self, cprofile=False):
+        self.phases = {}    # nome -> [chamadas, total_s, proprio_s]
+        self.counters = {}  # nome -> int
+        self.sizes = {}     # nome -> [n, soma, máximo]
+        self._stack = []
+        self._cprofile = None
+        if cprofile:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        st = self.sizes.get(name)
+        if st is None:
+            self.sizes[name] = [1, value, value]
+        else:
+            st[0] += 1
+            st[1] += value
+            if value > st[2]:
+                st[2] = value
+
+    def start_cprofile(self):
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+    def stop_cprofile(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+    def report(self, top=25):
+        rep = {
+            "phases": {
+                name: {"calls": c, "total_seconds": round(total, 6), "self_seconds": round(own, 6)}
+                for name, (c, total, own) in sorted(self.phases.items(), key=lambda kv: -kv[1][2])
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "sizes": {
+                name: {"n": n, "mean": round(s / n, 2) if n else 0, "max": mx}
+                for name, (n, s, mx) in sorted(self.sizes.items())
+            },
+        }
+        if self._cprofile is not None:
+            import io
+            import pstats
+            buf = io.StringIO()
+            pstats.Stats(self._cprofile, stream=buf).sort_stats("cumulative").print_stats(top)
+            rep["cprofile_top"] = buf.getvalue()
+        return rep
+
+    def write(self, path, top=25):
+        """Grava o relatório em JSON e, com cProfile ligado, o dump binário em <path>.prof (pstats)."""
+        path = Path(path)
+        path.write_text(json.dumps(self.report(top), indent=2, ensure_ascii=False), encoding="utf-8")
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(str(path.with_suffix(".prof")))
+
+    def format_table(self):
+        lines = [f"{'fase':<22} {'chamadas':>9} {'total (s)':>10} {'próprio (s)':>12}"]
+        for name, (c, total, own) in sorted(self.phases.items(), key=lambda kv: -kv[1][2]):
+            lines.append(f"{name:<22} {c:>9} {total:>10.4f} {own:>12.4f}")
+        if self.counters:
+            lines.append("")
+            lines.append(f"{'contador':<32} {'valor':>10}")
+            for name, v in sorted(self.counters.items()):
+                lines.append(f"{name:<32} {v:>10}")
+        if self.sizes:
+            lines.append("")
+            lines.append(f"{'distribuição':<32} {'n':>8} {'média':>10} {'máx':>8}")
+            for name, (n, s, mx) in sorted(self.sizes.items()):
+                lines.append(f"{name:<32} {n:>8} {s / n:>10.2f} {mx:>8}")
+        return "\n".join(lines)
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullProfiler:
+    """Profiler desligado: mesma interface, sem custo além da chamada."""
+
+    enabled = False
+    _phase = _NullPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, n=1):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+# lineage_service.py
+#
+# Serviço HTTP local (asyncio) em volta do build_lineage, para o plugin da IDE
+# e os bots de CI não pagarem a partida do interpretador e do sqlglot a cada
+# análise. O sqlglot fica carregado ("quente") nos processos do pool;
+# requisições idênticas simultâneas são agrupadas numa única análise e os
+# resultados recentes saem de um LRU em memória.
+#
+#   POST /lineage   corpo JSON {"sql": "...", "dialect": null, "full": false}
+#                   (ou o SQL puro, com ?dialect=...); resposta: o lineage.json
+#                   (ou, com full, todo o resultado do build_lineage)
+#   GET  /health    status e uptime
+#   GET  /metrics   contadores, LRU e percentis de latência
+#
+#   python lineage_service.py serve --port 8765 -j 4
+#   python lineage_service.py serve --unix /tmp/vsql.sock
+#   python lineage_service.py analyze modelo.sql --port 8765
+#   python lineage_service.py load modelo.sql --requests 500 --concurrency 16 --port 8765
+
+import asyncio
+import http.client
+import json
+import os
+import socket
+import sys
+import time
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs, urlsplit
+
+from lineage_cache import cache_key
+
+MAX_BODY_BYTES = 64 * 1024 * 1024
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+
+# =========================
+# 1) Pool de análise
+# =========================
+def _warm_worker():
+    """Inicializador do pool: importa a biblioteca e o sqlglot antes da primeira requisição."""
+    import cte_lineage_builder
+    cte_lineage_builder.build_lineage("WITH A AS (SELECT 1 AS X) SELECT X FROM A")
+
+def _analyze(sql, dialect, full):
+    """Roda no pool: (status HTTP, corpo JSON já serializado). A resposta volta pronta em bytes,
+    sem precisar serializar de novo no processo do servidor."""
+    import cte_lineage_builder
+    try:
+        data = cte_lineage_builder.build_lineage(sql, dialect)
+    except Exception as e:
+        return 422, json.dumps({"error": f"{type(e).__name__}: {e}"}, ensure_ascii=False).encode("utf-8")
+    return 200, json.dumps(data if full else data["cte_json"], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class _LRU:
+    """Resultados recentes (chave → (status, corpo)), limitado em entradas e em bytes."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+        return item
+
+    def put(self, key, item):
+        if len(item[1]) > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old[1])
+        self._items[key] = item
+        self.bytes += len(item[1])
+        while len(self._items) > self.max_entries or self.bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.bytes -= len(evicted[1])
+
+    def __len__(self):
+        return len(self._items)
+
+
+class LineageService:
+    """Estado do serviço: pool quente, análises em andamento (agrupamento) e LRU."""
+
+    def __init__(self, workers=None, cache_entries=512, cache_max_bytes=256 * 1024 * 1024):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        self.cache = _LRU(cache_entries, cache_max_bytes)
+        self.inflight = {}  # chave → asyncio.Future da análise em andamento
+        self.started = time.time()
+        self.latencies = deque(maxlen=4096)  # segundos das últimas requisições /lineage
+        self.counters = dict.fromkeys(("requests", "analyses", "cache_hits", "coalesced", "errors"), 0)
+
+    def start(self):
+        from concurrent.futures import ProcessPoolExecutor
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        # sobe todos os processos já (e aquece o sqlglot neles) em vez de na 1ª requisição
+        for f in [self.pool.submit(time.sleep, 0) for _ in range(self.workers)]:
+            f.result()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def lineage(self, sql, dialect=None, full=False):
+        """(status, corpo JSON) de uma análise, passando pelo LRU e pelo agrupamento."""
+        self.counters["requests"] += 1
+        key = cache_key(sql, dialect, "full" if full else "cte_json")
+        hit = self.cache.get(key)
+        if hit is not None:
+            self.counters["cache_hits"] += 1
+            return hit
+        fut = self.inflight.get(key)
+        if fut is not None:
+            # mesma análise já em andamento: espera o mesmo resultado
+            self.counters["coalesced"] += 1
+            return await asyncio.shield(fut)
+        loop = asyncio.get_running_loop()
+        fut = self.inflight[key] = loop.create_future()
+        try:
+            self.counters["analyses"] += 1
+            result = await loop.run_in_executor(self.pool, _analyze, sql, dialect, full)
+            if result[0] == 200:
+                self.cache.put(key, result)
+            else:
+                self.counters["errors"] += 1
+            fut.set_result(result)
+            return result
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # evita o aviso "exception was never retrieved" sem esperas
+            raise
+        finally:
+            del self.inflight[key]
+
+    def metrics(self):
+        lat = sorted(self.latencies)
+
+        def pct(p):
+            return round(lat[min(len(lat) - 1, int(p / 100 * len(lat)))] * 1000, 3) if lat else None
+
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "workers": self.workers,
+            "inflight": len(self.inflight),
+            **self.counters,
+            "cache_entries": len(self.cache),
+            "cache_bytes": self.cache.bytes,
+            "latency_ms": {"samples": len(lat), "p50": pct(50), "p90": pct(90), "p99": pct(99),
+                           "max": round(lat[-1] * 1000, 3) if lat else None},
+        }
+
+
+# =========================
+# 2) HTTP mínimo (HTTP/1.1 com keep-alive)
+# =========================
+async def _read_request(reader):
+    """(método, caminho, query, cabeçalhos, corpo) ou None se a conexão fechou."""
+    line = await reader.readline()
+    if not line:
+        return None
+    method, target, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        h = await reader.readline()
+        if h in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = h.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_BYTES:
+        raise ValueError(413)
+    body = await reader.readexactly(length) if length else b""
+    url = urlsplit(target)
+    return method.upper(), url.path, parse_qs(url.query), headers, body
+
+def _response(status, body, keep_alive):
+    head = (f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+def _json(obj):
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+async def _dispatch(service, method, path, query, headers, body):
+    if path == "/health":
+        return 200, _json({"status": "ok", "uptime_seconds": round(time.time() - service.started, 1)})
+    if path == "/metrics":
+        return 200, _json(service.metrics())
+    if path != "/lineage":
+        return 404, _json({"error": f"rota desconhecida: {path}"})
+    if method != "POST":
+        return 405, _json({"error": "use POST"})
+    dialect = (query.get("dialect") or [None])[0]
+    full = (query.get("full") or ["0"])[0] in ("1", "true")
+    if headers.get("content-type", "").startswith("application/json"):
+        try:
+            req = json.loads(body)
+            sql = req["sql"]
+        except (ValueError, KeyError, TypeError):
+            return 400, _json({"error": 'corpo JSON deve ter "sql"'})
+        dialect = req.get("dialect", dialect)
+        full = bool(req.get("full", full))
+    else:
+        try:
+            sql = body.decode("utf-8")
+        except UnicodeDecodeError as e:
+            return 400, _json({"error": f"o SQL deve vir em UTF-8 ({e})"})
+    t0 = time.perf_counter()
+    status, payload = await service.lineage(sql, dialect, full)
+    service.latencies.append(time.perf_counter() - t0)
+    return status, payload
+
+async def _handle(service, reader, writer):
+    try:
+        while True:
+            try:
+                req = await _read_request(reader)
+            except ValueError as e:
+                status = e.args[0] if e.args and e.args[0] in _REASONS else 400
+                writer.write(_response(status, _json({"error": _REASONS[status]}), False))
+                break
+            if req is None:
+                break
+            method, path, query, headers, body = req
+            keep_alive = headers.get("connection", "").lower() != "close"
+            try:
+                status, payload = await _dispatch(service, method, path, query, headers, body)
+            except Exception as e:
+                status, payload = 500, _json({"error": f"{type(e).__name__}: {e}"})
+            writer.write(_response(status, payload, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(host="127.0.0.1", port=8765, unix=None, workers=None, cache_entries=512, ready=None):
+    """Sobe o serviço e atende até ser cancelado. Com port=0 o sistema escolhe uma porta livre;
+    `ready`, se dado, é chamado com a porta (ou o caminho do socket) quando as conexões já são aceitas."""
+    service = LineageService(workers=workers, cache_entries=cache_entries)
+    service.start()
+    handler = lambda r, w: _handle(service, r, w)
+    if unix:
+        server = await asyncio.start_unix_server(handler, path=unix)
+        bound = where = unix
+    else:
+        server = await asyncio.start_server(handler, host, port)
+        bound = server.sockets[0].getsockname()[1]
+        where = f"http://{host}:{bound}"
+    print(f"✅ serviço de linhagem em {where} ({service.workers} processos)", flush=True)
+    if ready is not None:
+        ready(bound)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+# =========================
+# 3) Cliente local (para testes e scripts)
+# =========================
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=300):
+        super().__init__("localhost", timeout=timeout)
+        self._unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._unix_path)
+
+
+class LineageClient:
+    """Cliente síncrono do serviço (uma conexão keep-alive)."""
+
+    def __init__(self, host="127.0.0.1", port=8765, unix=None, timeout=300):
+        self._conn = _UnixHTTPConnection(unix, timeout) if unix else http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        self._conn.request(method, path, body=body, headers=headers)
+        resp = self._conn.getresponse()
+        return resp.status, json.loads(resp.read())
+
+    def lineage(self, sql, dialect=None, full=False):
+        """(status, resposta JSON) de POST /lineage."""
+        return self._request("POST", "/lineage", _json({"sql": sql, "dialect": dialect, "full": full}))
+
+    def metrics(self):
+        return self._request("GET", "/metrics")[1]
+
+    def health(self):
+        return self._request("GET", "/health")[1]
+
+    def close(self):
+        self._conn.close()
+
+
+def load_test(sql, requests=200, concurrency=8, distinct=1, dialect=None, **conn):
+    """Dispara `requests` análises com `concurrency` clientes em paralelo; `distinct` variantes do SQL
+    (comentário no fim) para misturar acertos do LRU, agrupamentos e análises novas."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def run(worker):
+        client = LineageClient(**conn)
+        lat = []
+        try:
+            for i in range(worker, requests, concurrency):
+                t0 = time.perf_counter()
+                status, _ = client.lineage(f"{sql}\n-- v{i % distinct}", dialect)
+                lat.append(time.perf_counter() - t0)
+                if status != 200:
+                    raise RuntimeError(f"status {status}")
+        finally:
+            client.close()
+        return lat
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as ex:
+        lat = sorted(x for part in ex.map(run, range(concurrency)) for x in part)
+    elapsed = time.perf_counter() - t0
+    return {
+        "requests": len(lat),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(lat) / elapsed, 1),
+        "p50_ms": round(lat[len(lat) // 2] * 1000, 2),
+        "p99_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1000, 2),
+    }
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serviço local de linhagem de CTEs (e cliente de teste).")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for name, help_ in (("serve", "sobe o serviço"), ("analyze", "analisa um arquivo via serviço"),
+                        ("metrics", "mostra /metrics"), ("load", "teste de carga com clientes paralelos")):
+        p = sub.add_parser(name, help=help_)
+        p.add_argument("--host", default="127.0.0.1")
+        p.add_argument("--port", type=int, default=8765)
+        p.add_argument("--unix", default=None, help="socket Unix em vez de TCP")
+        if name == "serve":
+            p.add_argument("-j", "--workers", type=int, default=None, help="processos no pool (padrão: nº de núcleos)")
+            p.add_argument("--cache-entries", type=int, default=512, help="resultados mantidos no LRU")
+        if name in ("analyze", "load"):
+            p.add_argument("file", help="arquivo .sql")
+            p.add_argument("--dialect", default=None)
+        if name == "load":
+            p.add_argument("--requests", type=int, default=200)
+            p.add_argument("--concurrency", type=int, default=8)
+            p.add_argument("--distinct", type=int, default=1, help="variantes distintas do SQL")
+    args = parser.parse_args(argv)
+    conn = {"host": args.host, "port": args.port, "unix": args.unix}
+
+    if args.cmd == "serve":
+        try:
+            asyncio.run(serve(args.host, args.port, args.unix, args.workers, args.cache_entries))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if args.cmd == "metrics":
+        client = LineageClient(**conn)
+        print(json.dumps(client.metrics(), indent=2, ensure_ascii=False))
+        client.close()
+        return 0
+    sql = open(args.file, encoding="utf-8").read()
+    if args.cmd == "analyze":
+        client = LineageClient(**conn)
+        status, result = client.lineage(sql, args.dialect)
+        client.close()
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        return 0 if status == 200 else 1
+    stats = load_test(sql, args.requests, args.concurrency, args.distinct, args.dialect, **conn)
+    print(json.dumps(stats, indent=2))
+    client = LineageClient(**conn)
+    print(json.dumps(client.metrics()["latency_ms"], indent=2))
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,36 @@
 # -*- coding: utf-8 -*-
-# cte_lineage_builder.py
-
-# 1) Dependência
-# Colab: ok. Local: garanta internet na 1ª execução ou já tenha sqlglot instalado.
-try:
-    import sqlglot
-except Exception:
-    import sys, subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "sqlglot>=19.0.0"])
-from sqlglot import parse_one, exp
-
-import json
+# projeto-vsql.py
+#
+# Linha de comando da linhagem de colunas entre CTEs. A lógica fica na biblioteca
+# cte_lineage_builder.py (importável, sem efeitos colaterais no import); aqui só
+# ficam o SQL de exemplo e o main.
+# Colab/local: instale antes o sqlglot (pip install "sqlglot>=19.0.0").
+
+import argparse
+import sys
 from pathlib import Path
 from textwrap import dedent
 
+from cte_lineage_builder import (
+    LINEAGE_FORMATS,
+    LineageBudget,
+    LineageTimeout,
+    build_lineage_cached,
+    expand_inputs,
+    focus_subgraph,
+    run_batch,
+    set_profiler,
+    stream_to_ndjson,
+    watch,
+    write_html,
+    write_lineage,
+)
+from lineage_cache import DEFAULT_MAX_BYTES, LineageCache
+from lineage_catalog import LineageCatalog
+from lineage_profile import Profiler
+
 # =========================
-# 2) Insira seu SQL aqui
+# 1) Insira seu SQL aqui
 # =========================
 SQL = dedent("""
 WITH CTE_SOURCE AS (
@@ -57,599 +72,164 @@ FROM CTE_FILTER;
 
 
 # =========================
-# 3) Utilitários de parsing
+# 2) Linha de comando
 # =========================
-def table_alias_of(tbl: exp.Table):
-    alias = None
-    a = tbl.args.get("alias")
-    if a and isinstance(a, exp.TableAlias):
-        id_ = a.this
-        if isinstance(id_, exp.Identifier):
-            alias = id_.name
-    return alias
-
-def extract_predecessors_and_aliases(sel: exp.Select, known_cte_names):
-    """Retorna:
-       - predecessors: set de CTEs usadas diretamente no FROM/JOIN
-       - alias_map: dict alias->cte_name (ou table_name)
-    """
-    predecessors = set()
-    alias_map = {}
-
-    for t in sel.find_all(exp.Table):
-        name = t.name  # nome base (CTE ou tabela)
-        alias = table_alias_of(t)
-        if name in known_cte_names:
-            predecessors.add(name)
-            if alias:
-                alias_map[alias] = name
-            else:
-                alias_map[name] = name
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Linhagem de colunas entre CTEs de scripts SQL.")
+    parser.add_argument("inputs", nargs="*", help="arquivos .sql, diretórios ou globs (sem argumentos: usa o SQL embutido)")
+    parser.add_argument("-o", "--out-dir", default=None, help="diretório de saída (lote: lineage_out; --watch: diretório atual)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="processos no pool (padrão: nº de núcleos)")
+    parser.add_argument("--html", action="store_true", help="gera também o HTML de cada arquivo no modo em lote")
+    parser.add_argument("--dialect", default=None, help="dialeto do sqlglot (ex.: snowflake, bigquery, tsql)")
+    parser.add_argument("--cache-dir", default=None, help="diretório do cache persistente de linhagem")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_BYTES / 2**20, help="tamanho máximo do cache em MB")
+    parser.add_argument("--catalog", metavar="ARQUIVO", default=None,
+                        help="no modo em lote, atualiza o catálogo SQLite de linhagem entre scripts (consultas: lineage_catalog.py)")
+    parser.add_argument("--format", choices=LINEAGE_FORMATS, default="json",
+                        help="formato da linhagem: json (lineage.json) ou cjson / cjson.gz (compacto, com tabela de nomes)")
+    parser.add_argument("--prune", action="store_true",
+                        help="só resolve o que chega à query final: descarta CTEs e colunas mortas e lista as CTEs mortas")
+    parser.add_argument("--focus", metavar="CTE[.COL]", action="append", default=None,
+                        help="o HTML mostra só a vizinhança desta CTE ou coluna (repita para vários alvos)")
+    parser.add_argument("--hops", type=int, default=1, help="com --focus, nº de saltos acima e abaixo dos alvos (padrão: 1)")
+    parser.add_argument("--timeout", type=float, default=None, metavar="SEG",
+                        help="prazo por query: o que falta é pulado e a linhagem sai parcial; após 2× o prazo a análise é cancelada")
+    parser.add_argument("--max-leaves", type=int, default=None, metavar="N",
+                        help="tamanho máximo de um conjunto de folhas (maiores são cortados; linhagem parcial)")
+    parser.add_argument("--max-fallback-edges", type=int, default=None, metavar="N",
+                        help="máximo de arestas de fallback (coluna ambígua ou não resolvida) por query; as demais são descartadas")
+    parser.add_argument("--watch", action="store_true", help="observa um único arquivo .sql e reanalisa só as CTEs alteradas")
+    parser.add_argument("--ndjson", metavar="SAIDA", default=None,
+                        help="lê um arquivo com vários statements em streaming e grava um registro NDJSON por statement ('-' = stdout)")
+    parser.add_argument("--profile", action="store_true",
+                        help="mede cada fase (parse, resolução, JSON, HTML...), imprime uma tabela e grava as estatísticas em JSON")
+    parser.add_argument("--cprofile", action="store_true", help="com --profile, captura também o cProfile (dump .prof)")
+    args = parser.parse_args(argv)
+    cache_max_bytes = int(args.cache_max_mb * 2**20)
+    if args.cprofile:
+        args.profile = True
+    if args.profile and args.watch:
+        parser.error("--profile não se aplica ao modo --watch")
+    if args.watch and (args.prune or args.focus):
+        parser.error("--prune e --focus não se aplicam ao modo --watch")
+    if args.hops < 0:
+        parser.error("--hops não pode ser negativo")
+    limits = {k: v for k, v in (("timeout", args.timeout), ("max_leaves", args.max_leaves),
+                                ("max_fallback_edges", args.max_fallback_edges)) if v is not None}
+    if any(v < 0 for v in limits.values()):
+        parser.error("--timeout, --max-leaves e --max-fallback-edges não podem ser negativos")
+    if args.watch and limits:
+        parser.error("--timeout, --max-leaves e --max-fallback-edges não se aplicam ao modo --watch")
+    limits = limits or None
+    profiler = Profiler(cprofile=args.cprofile) if args.profile else None
+
+    def finish_profile(path, stream=sys.stdout):
+        if profiler is None:
+            return
+        profiler.stop_cprofile()
+        set_profiler(None)
+        profiler.write(path)
+        print(profiler.format_table(), file=stream)
+        print(f"✅ {path} gerado.", file=stream)
+
+    if profiler is not None:
+        set_profiler(profiler)
+        profiler.start_cprofile()
+
+    if args.watch:
+        if len(args.inputs) != 1 or not Path(args.inputs[0]).is_file():
+            parser.error("--watch recebe exatamente um arquivo .sql")
+        watch(args.inputs[0], args.out_dir or ".", dialect=args.dialect)
+        return 0
+
+    if args.ndjson:
+        if len(args.inputs) != 1 or not Path(args.inputs[0]).is_file():
+            parser.error("--ndjson recebe exatamente um arquivo .sql")
+        if args.ndjson == "-":
+            stats = stream_to_ndjson(args.inputs[0], sys.stdout, dialect=args.dialect, prune=args.prune,
+                                     limits=limits)
         else:
-            # tabela física
-            if alias:
-                alias_map[alias] = name
-            else:
-                alias_map[name] = name
-    return predecessors, alias_map
-
-def select_projections(sel: exp.Select):
-    """Lista de expressões do SELECT (exp) na ordem."""
-    # Alguns dialetos podem usar sel.expressions, outros .args['expressions']
-    exps = list(sel.expressions)
-    return exps
-
-def output_name_of(expr: exp.Expression):
-    """Nome 'apresentável' da coluna de saída."""
-    if isinstance(expr, exp.Alias):
-        return expr.alias
-    # Column simples
-    if isinstance(expr, exp.Column):
-        return expr.name
-    # Func/Expr: retornar SQL legível
-    s = expr.sql()
-    # limpar quebras grandes
-    return s.replace("\n", " ").strip()
-
-def columns_referenced(expr: exp.Expression):
-    """Lista de exp.Column referenciadas dentro de uma expressão."""
-    return list(expr.find_all(exp.Column))
-
-def qual_of(col: exp.Column):
-    """Retorna (qualificador, nome_col). qualificador pode ser None."""
-    q = col.table
-    return q, col.name
-
-def pretty_sql(node: exp.Expression):
-    return node.sql(pretty=True)
-
-# =========================
-# 4) Construção da linhagem
-# =========================
-def build_lineage(sql: str):
-    ast = parse_one(sql)  # programa com várias CTEs + query final
-    ctes = list(ast.find_all(exp.CTE))
-    cte_order = [c.alias_or_name for c in ctes]
-    cte_map = {c.alias_or_name: c for c in ctes}
-
-    # Armazena para cada CTE:
-    # outputs[name] = [ { "name": out_name, "expr": expr, "immediate_deps": [(cte_or_table, out_col_name_or_base)], "leaves": set((cte, col)) } ]
-    outputs = {}
-    # Texto SQL da CTE:
-    cte_sql_text = {}
-
-    # Para expandir SELECT * quando origem é CTE
-    def expand_star_from_cte(src_cte):
-        return [o["name"] for o in outputs.get(src_cte, [])]
-
-    # Computa leaves recursivamente
-    def leaves_of_dependency(dep):
-        # dep = (source_name, source_output_name_or_base, is_from_cte_output)
-        s_name, s_col, is_cte_out = dep
-        if is_cte_out and s_name in outputs:
-            # encontrar o output na CTE de origem
-            for o in outputs[s_name]:
-                if o["name"] == s_col:
-                    return set(o["leaves"])
-        # base/física ou não mapeado a output da CTE → folha é o próprio par
-        return {(s_name, s_col)}
-
-    # 1) Percorre CTEs em ordem, derivando outputs e dependências imediatas
-    for cte_name in cte_order:
-        cte_node = cte_map[cte_name]
-        sel = cte_node.this  # Select dentro da CTE
-        if not isinstance(sel, exp.Select):
-            # Suporte básico: caso seja um Subquery mais elaborado
-            sel = next(cte_node.find_all(exp.Select), None)
-            if sel is None:
-                continue
-
-        cte_sql_text[cte_name] = pretty_sql(sel)
-
-        predecessors, alias_map = extract_predecessors_and_aliases(sel, set(cte_order))
-
-        outs = []
-        exprs = select_projections(sel)
-
-        # Heurística para expandir SELECT * quando única origem é CTE conhecida
-        only_cte_src = None
-        if len(predecessors) == 1:
-            only_cte_src = list(predecessors)[0]
-
-        for e in exprs:
-            # * (Star) → expandir da CTE única; se múltiplas origens ou tabela física, manter como "*"
-            if isinstance(e, exp.Star) or isinstance(e, exp.Column) and e.name == "*" :
-                if only_cte_src is not None:
-                    for nm in expand_star_from_cte(only_cte_src):
-                        outs.append({
-                            "name": nm,
-                            "expr": e,
-                            "immediate_deps": [(only_cte_src, nm, True)],
-                            "leaves": set(outputs[only_cte_src][[o["name"] for o in outputs[only_cte_src]].index(nm)]["leaves"]) if outputs.get(only_cte_src) else {(only_cte_src, nm)}
-                        })
-                else:
-                    outs.append({
-                        "name": "*",
-                        "expr": e,
-                        "immediate_deps": [],
-                        "leaves": set()
-                    })
-                continue
-
-            out_name = output_name_of(e)
-            # dentro da expressão, capturar colunas referenciadas
-            cols = columns_referenced(e if not isinstance(e, exp.Alias) else e.this)
-
-            deps = []
-            # Resolver cada coluna referenciada para (cte_or_table, out_col) com heurísticas
-            for c in cols:
-                qual, colname = qual_of(c)
-                candidate_sources = []
-
-                if qual:
-                    # qualificador pode ser alias → resolver no alias_map
-                    src = alias_map.get(qual, qual)
-                    candidate_sources = [src]
-                else:
-                    # sem qualificador: tentar desambiguar pelo(s) predecessor(es)
-                    # 1) se só há um predecessor, assumir
-                    if len(predecessors) == 1:
-                        candidate_sources = list(predecessors)
-                    else:
-                        # 2) tentar por nome de output existente ou por folhas
-                        candidate_sources = list(predecessors)  # checar adiante
-
-                resolved = False
-                for src in candidate_sources:
-                    if src in outputs:
-                        # src é CTE conhecida → tentar match direto pelo output
-                        names = [o["name"] for o in outputs[src]]
-                        if colname in names:
-                            deps.append((src, colname, True))
-                            resolved = True
-                            break
-                        # Heurística: procurar por folhas que contenham base colname
-                        hits = []
-                        for o in outputs[src]:
-                            leaf_names = {leaf_col for (_s, leaf_col) in o["leaves"]}
-                            if colname in leaf_names:
-                                hits.append(o["name"])
-                        if len(hits) == 1:
-                            deps.append((src, hits[0], True))
-                            resolved = True
-                            break
-                        elif len(hits) > 1:
-                            # ambíguo: conecta a todos
-                            for h in hits:
-                                deps.append((src, h, True))
-                            resolved = True
-                            break
-                    else:
-                        # src é tabela física
-                        deps.append((src, colname, False))
-                        resolved = True
-                        break
-
-                if not resolved:
-                    # fallback: se não conseguiu, conecta a todos predecessores como base
-                    for src in candidate_sources:
-                        deps.append((src, colname, src in outputs))
-
-            # computar folhas do output atual a partir das folhas dos deps
-            leaves = set()
-            for d in deps:
-                leaves |= leaves_of_dependency(d)
-
-            outs.append({
-                "name": out_name,
-                "expr": e,
-                "immediate_deps": deps,
-                "leaves": leaves
-            })
-
-        outputs[cte_name] = outs
-
-    # 2) Query final (fora das CTEs)
-    final_select = next(ast.find_all(exp.Select), None)
-    final_name = "FINAL_QUERY"
-    final_outs = []
-    final_sql = ""
-    if final_select:
-        final_sql = pretty_sql(final_select)
-        predecessors, alias_map = extract_predecessors_and_aliases(final_select, set(cte_order))
-        exprs = select_projections(final_select)
-        only_cte_src = list(predecessors)[0] if len(predecessors) == 1 else None
-        for e in exprs:
-            if isinstance(e, exp.Star) or isinstance(e, exp.Column) and e.name == "*" :
-                if only_cte_src is not None and only_cte_src in outputs:
-                    for nm in [o["name"] for o in outputs[only_cte_src]]:
-                        final_outs.append({
-                            "name": nm,
-                            "expr": e,
-                            "immediate_deps": [(only_cte_src, nm, True)],
-                            "leaves": set(outputs[only_cte_src][[o["name"] for o in outputs[only_cte_src]].index(nm)]["leaves"])
-                        })
-                else:
-                    final_outs.append({"name": "*", "expr": e, "immediate_deps": [], "leaves": set()})
-                continue
-
-            out_name = output_name_of(e)
-            cols = columns_referenced(e if not isinstance(e, exp.Alias) else e.this)
-            deps = []
-            for c in cols:
-                qual, colname = qual_of(c)
-                candidate_sources = []
-                if qual:
-                    src = alias_map.get(qual, qual)
-                    candidate_sources = [src]
-                else:
-                    candidate_sources = list(predecessors) if predecessors else []
-                resolved = False
-                for src in candidate_sources:
-                    if src in outputs:
-                        names = [o["name"] for o in outputs[src]]
-                        if colname in names:
-                            deps.append((src, colname, True)); resolved = True; break
-                        hits = []
-                        for o in outputs[src]:
-                            leaf_names = {leaf_col for (_s, leaf_col) in o["leaves"]}
-                            if colname in leaf_names:
-                                hits.append(o["name"])
-                        if len(hits) >= 1:
-                            for h in hits:
-                                deps.append((src, h, True))
-                            resolved = True; break
-                    else:
-                        deps.append((src, colname, False)); resolved = True; break
-                if not resolved and candidate_sources:
-                    for src in candidate_sources:
-                        deps.append((src, colname, src in outputs))
-            leaves = set()
-            for d in deps:
-                s = leaves_of_dependency(d)
-                leaves |= s
-            final_outs.append({"name": out_name, "expr": e, "immediate_deps": deps, "leaves": leaves})
-        outputs[final_name] = final_outs
-        cte_sql_text[final_name] = final_sql
-
-    # 3) JSON no formato solicitado + dados para o gráfico
-    cte_nodes = list(cte_order) + ([final_name] if final_outs else [])
-    edges_cte = []
-    for tgt in cte_order:
-        sel = cte_map[tgt].this
-        preds, _ = extract_predecessors_and_aliases(sel, set(cte_order))
-        for src in preds:
-            edges_cte.append((src, tgt))
-    if final_outs:
-        # ligar a última CTE usada no final
-        preds, _ = extract_predecessors_and_aliases(final_select, set(cte_order))
-        for src in preds:
-            edges_cte.append((src, final_name))
-
-    # colLinks: pares (src_cte, src_col_out) -> (tgt_cte, tgt_col_out) quando imediatos
-    col_links = []
-    for tgt_cte in cte_nodes:
-        if tgt_cte not in outputs: continue
-        for o in outputs[tgt_cte]:
-            for dep in o["immediate_deps"]:
-                src, src_col, is_cte_out = dep
-                if is_cte_out:
-                    col_links.append({
-                        "from": f"{src}.{src_col}",
-                        "to": f"{tgt_cte}.{o['name']}"
-                    })
-
-    # JSON principal (por CTE)
-    cte_json = []
-    for name in cte_nodes:
-        if name not in outputs: continue
-        cte_json.append({
-            "cte_name": name,
-            "cte_query": cte_sql_text.get(name, ""),
-            "cte_column": [
-                {
-                    "column_name": o["name"],
-                    "dependencies": [
-                        {"cte_name": s, "column_name": c}
-                        for (s, c, is_out) in o["immediate_deps"] if is_out
-                    ] + [
-                        # bases (tabela física): mantemos, mas sem aprofundar
-                        {"cte_name": s, "column_name": c}
-                        for (s, c, is_out) in o["immediate_deps"] if not is_out
-                    ]
-                }
-                for o in outputs[name]
-            ]
-        })
-
-    return {
-        "cte_nodes": cte_nodes,
-        "edges_cte": edges_cte,
-        "columns_by_cte": {name: [o["name"] for o in outputs.get(name, [])] for name in cte_nodes},
-        "col_links": col_links,
-        "cte_json": cte_json
-    }
-
-
-data = build_lineage(SQL)
-
-# 5) Salva JSON
-Path("lineage.json").write_text(json.dumps(data["cte_json"], indent=2, ensure_ascii=False), encoding="utf-8")
-print("✅ lineage.json gerado.")
-
-# 6) Gera HTML interativo (CTE como caixas; colunas desenhadas dentro; ligações coluna→coluna ao expandir)
-html = f"""<!doctype html>
-<html><head><meta charset="utf-8"/>
-<title>CTE Lineage Viewer</title>
-<style>
-  html,body {{ height:100%; margin:0; font-family: Inter, Arial, sans-serif; }}
-  #wrap {{ position:relative; height:100vh; }}
-  #cy {{ position:absolute; inset:0; }}
-  #overlay {{ position:absolute; inset:0; pointer-events:none; }}
-  #legend {{ position:absolute; right:12px; top:12px; background:#fff; border:1px solid #ddd; padding:8px 10px; border-radius:8px; font-size:12px; }}
-  .badge {{ display:inline-block; padding:2px 6px; border-radius:6px; margin-left:6px; font-size:11px; }}
-</style>
-</head>
-<body>
-<div id="wrap">
-  <div id="cy"></div>
-  <canvas id="overlay"></canvas>
-  <div id="legend">
-    Clique numa CTE para expandir/colapsar.<br/>
-    <span class="badge" style="background:#0074D9;color:#fff;">CTE</span>
-    <span class="badge" style="background:#2ECC40;color:#fff;">Coluna</span>
-  </div>
-</div>
-
-<script src="https://cdnjs.cloudflare.com/ajax/libs/cytoscape/3.26.0/cytoscape.min.js"></script>
-<script>
-const DATA = {json.dumps(data, ensure_ascii=False)};
-
-// nós CTE
-const elements = [];
-for (const id of DATA.cte_nodes) {{
-  elements.push({{ data: {{ id, label: id, type: 'cte' }} }});
-}}
-// arestas CTE→CTE
-for (const [s,t] of DATA.edges_cte) {{
-  elements.push({{ data: {{ id: s+"->"+t, source: s, target: t, type: 'cte_edge' }} }});
-}}
-
-const cy = cytoscape({{
-  container: document.getElementById('cy'),
-  elements,
-  style: [
-    {{ selector: 'node[type="cte"]', style: {{
-      'label': 'data(label)',
-      'background-color': '#0074D9',
-      'color': '#fff',
-      'shape': 'round-rectangle',
-      'text-valign': 'top',
-      'text-halign': 'center',
-      'width': 240,
-      'height': 64,
-      'padding': '12px',
-      'font-size': 12
-    }} }},
-    {{ selector: 'edge[type="cte_edge"]', style: {{
-      'curve-style': 'taxi',
-      'taxi-direction': 'auto',
-      'line-color': '#B0B0B0',
-      'target-arrow-color': '#B0B0B0',
-      'target-arrow-shape': 'triangle',
-      'width': 1.8,
-      'opacity': 1.0
-    }} }}
-  ],
-  layout: {{ name: 'breadthfirst', directed: true, padding: 40, spacingFactor: 1.4 }},
-  wheelSensitivity: 0.2
-}});
-
-// Estado de expansão
-const expanded = Object.create(null);
-
-// Canvas overlay
-const canvas = document.getElementById('overlay');
-const ctx = canvas.getContext('2d');
-function resizeCanvas(){{
-  const bb = cy.container().getBoundingClientRect();
-  canvas.width = Math.max(1, bb.width);
-  canvas.height = Math.max(1, bb.height);
-}}
-resizeCanvas();
-window.addEventListener('resize', ()=>{{ resizeCanvas(); drawOverlay(); }});
-
-// Geometria das "tabelas"
-const ROW_H = 18;
-const HEADER_H = 22;
-const PADDING = 10;
-const COL_MARGIN_X = 6;
-
-// coordenadas auxiliares em pixel (rendered)
-function nodeBox(n){{
-  const pos = n.renderedPosition();
-  const w = n.renderedWidth();
-  const h = n.renderedHeight();
-  return {{
-    left: pos.x - w/2,
-    right: pos.x + w/2,
-    top: pos.y - h/2,
-    bottom: pos.y + h/2,
-    width: w,
-    height: h
-  }};
-}}
-
-function drawTable(n){{
-  const id = n.id();
-  const cols = DATA.columns_by_cte[id] || [];
-  // base node box
-  const box = nodeBox(n);
-  // altura expandida
-  const tableH = HEADER_H + cols.length * ROW_H + PADDING*2;
-  const expandTop = box.top; // “cresce” para baixo
-  const expandLeft = box.left;
-  const width = box.width;
-
-  // fundo
-  ctx.fillStyle = 'rgba(255,255,255,0.06)';
-  ctx.fillRect(expandLeft, expandTop, width, tableH);
-
-  // borda
-  ctx.strokeStyle = '#004a89';
-  ctx.lineWidth = 1;
-  ctx.strokeRect(expandLeft+0.5, expandTop+0.5, width-1, tableH-1);
-
-  // header
-  ctx.fillStyle = 'rgba(255,255,255,0.12)';
-  ctx.fillRect(expandLeft, expandTop, width, HEADER_H);
-  ctx.fillStyle = '#FFFFFF';
-  ctx.font = '12px Arial';
-  ctx.textBaseline = 'middle';
-  ctx.fillText(id, expandLeft + 8, expandTop + HEADER_H/2);
-
-  // linhas de colunas
-  ctx.font = '11px Arial';
-  ctx.textBaseline = 'middle';
-  cols.forEach((c, i) => {{
-    const y = expandTop + HEADER_H + PADDING + i*ROW_H + ROW_H/2;
-    // célula
-    ctx.fillStyle = '#2ECC40';
-    ctx.fillRect(expandLeft + COL_MARGIN_X, y-11, width - COL_MARGIN_X*2, 16);
-    ctx.fillStyle = '#FFFFFF';
-    const label = String(c).slice(0, 80);
-    ctx.fillText(label, expandLeft + COL_MARGIN_X + 6, y);
-  }});
-}}
-
-function colAnchor(n, colName, side){{ // side: 'left' | 'right'
-  const id = n.id();
-  const cols = DATA.columns_by_cte[id] || [];
-  const idx = cols.indexOf(colName);
-  if (idx < 0) return null;
-  const box = nodeBox(n);
-  const y = box.top + HEADER_H + PADDING + idx*ROW_H + ROW_H/2;
-  const x = side === 'right' ? box.right - 4 : box.left + 4;
-  return {{x, y}};
-}}
-
-function drawLinks(){{
-  // cte→cte opacidade
-  cy.edges('[type="cte_edge"]').forEach(e => {{
-    const s = e.source().id(), t = e.target().id();
-    const both = !!(expanded[s] && expanded[t]);
-    e.style('opacity', both ? 0.18 : 1.0);
-  }});
-
-  // coluna→coluna
-  ctx.lineWidth = 1.5;
-  DATA.col_links.forEach(link => {{
-    const [sCte, sCol] = link.from.split('.');
-    const [tCte, tCol] = link.to.split('.');
-    const sNode = cy.getElementById(sCte);
-    const tNode = cy.getElementById(tCte);
-    if (!sNode || !tNode || !sNode.renderedPosition || !tNode.renderedPosition) return;
-
-    const sExpanded = !!expanded[sCte];
-    const tExpanded = !!expanded[tCte];
-
-    if (sExpanded && tExpanded){{
-      const a1 = colAnchor(sNode, sCol, 'right');
-      const a2 = colAnchor(tNode, tCol, 'left');
-      if (!a1 || !a2) return;
-      ctx.strokeStyle = '#FFD166';
-      ctx.beginPath();
-      ctx.moveTo(a1.x, a1.y);
-      // curva suave
-      const midx = (a1.x + a2.x)/2;
-      ctx.bezierCurveTo(midx, a1.y, midx, a2.y, a2.x, a2.y);
-      ctx.stroke();
-    }} else if (sExpanded && !tExpanded){{
-      // coluna → caixa destino
-      const a1 = colAnchor(sNode, sCol, 'right');
-      if (!a1) return;
-      const tBox = nodeBox(tNode);
-      const a2 = {{ x: tBox.left + 4, y: tBox.top + tBox.height/2 }};
-      ctx.strokeStyle = '#B5E48C';
-      ctx.beginPath();
-      ctx.moveTo(a1.x, a1.y);
-      const midx = (a1.x + a2.x)/2;
-      ctx.bezierCurveTo(midx, a1.y, midx, a2.y, a2.x, a2.y);
-      ctx.stroke();
-    }} else if (!sExpanded && tExpanded){{
-      // caixa origem → coluna destino
-      const sBox = nodeBox(sNode);
-      const a1 = {{ x: sBox.right - 4, y: sBox.top + sBox.height/2 }};
-      const a2 = colAnchor(tNode, tCol, 'left');
-      if (!a2) return;
-      ctx.strokeStyle = '#B5E48C';
-      ctx.beginPath();
-      ctx.moveTo(a1.x, a1.y);
-      const midx = (a1.x + a2.x)/2;
-      ctx.bezierCurveTo(midx, a1.y, midx, a2.y, a2.x, a2.y);
-      ctx.stroke();
-    }} else {{
-      // ambas colapsadas → deixamos somente CTE→CTE padrão (já desenhado pelo Cytoscape)
-    }}
-  }});
-
-function drawOverlay(){{
-  const bb = cy.container().getBoundingClientRect();
-  ctx.clearRect(0,0,bb.width,bb.height);
-
-  // desenha tabelas expandidas
-  cy.nodes('[type="cte"]').forEach(n => {{
-    if (expanded[n.id()]) drawTable(n);
-  }});
-
-  // desenha links coluna→coluna (e ajusta opacidade das CTE→CTE)
-  drawLinks();
-}}
-
-// Redesenhar quando a cena muda
-["render","pan","zoom","dragfree","position"].forEach(ev => cy.on(ev, drawOverlay));
-cy.on('resize', ()=>{{ resizeCanvas(); drawOverlay(); }});
-
-// Toggle expand/collapse
-cy.on('tap', 'node[type="cte"]', evt => {{
-  const id = evt.target.id();
-  expanded[id] = !expanded[id];
-  drawOverlay();
-}});
-
-// Primeira pintura
-drawOverlay();
-</script>
-</body></html>
-"""
-
-Path("cte_lineage.html").write_text(html, encoding="utf-8")
-print("✅ cte_lineage.html gerado.")
-
-# Dicas de uso no Colab:
-try:
-    from IPython.display import IFrame, display
-    display(IFrame(src="cte_lineage.html", width="100%", height=600))
-    print("\nAbra também localmente se preferir: cte_lineage.html")
-except Exception:
-    pass
\ No newline at end of file
+            with open(args.ndjson, "w", encoding="utf-8") as out:
+                stats = stream_to_ndjson(args.inputs[0], out, dialect=args.dialect, prune=args.prune,
+                                         limits=limits)
+        print(f"✅ {stats['statements']} statements ({stats['errors']} com erro, {stats['partial']} parciais) em {stats['seconds']}s "
+              f"({stats['statements_per_second']} statements/s).", file=sys.stderr)
+        finish_profile("lineage.profile.json" if args.ndjson == "-" else Path(args.ndjson).with_suffix(".profile.json"),
+                       stream=sys.stderr)
+        return 1 if stats["errors"] else 0
+
+    if args.inputs:
+        args.out_dir = args.out_dir or "lineage_out"
+        files = expand_inputs(args.inputs)
+        if not files:
+            parser.error("nenhum arquivo .sql encontrado")
+        summary = run_batch(files, args.out_dir, workers=args.workers, html=args.html, dialect=args.dialect,
+                            cache_dir=args.cache_dir, cache_max_bytes=cache_max_bytes, in_process=args.profile,
+                            catalog_path=args.catalog, fmt=args.format, prune=args.prune, focus=args.focus,
+                            hops=args.hops, limits=limits)
+        print(f"✅ {summary['ok']}/{summary['files']} arquivos em {summary['seconds']}s "
+              f"({summary['files_per_second']} arquivos/s, {summary['workers']} processos).")
+        if args.cache_dir:
+            print(f"   cache: {summary['cache_hits']} acertos.")
+        if args.prune:
+            print(f"   {summary['dead_ctes']} CTEs mortas (lista por arquivo em summary.json).")
+        if limits:
+            lat = summary["latency"] or {}
+            print(f"   limites: {summary['partial']} parciais, {summary['timeouts']} cancelados, "
+                  f"{summary['truncated_leaf_sets']} conjuntos de folhas cortados, "
+                  f"{summary['dropped_fallback_edges']} arestas de fallback descartadas "
+                  f"(p50 {lat.get('p50')}s, p95 {lat.get('p95')}s, máx {lat.get('max')}s).")
+        if args.catalog:
+            catalog = LineageCatalog(args.catalog)
+            removed = catalog.prune_missing()
+            stats = catalog.stats()
+            catalog.close()
+            print(f"   catálogo: {summary['catalog_updates']} scripts atualizados, {len(removed)} removidos "
+                  f"({stats['scripts']} scripts, {stats['physical_columns']} colunas físicas).")
+        print(f"✅ {Path(args.out_dir) / 'summary.json'} gerado.")
+        finish_profile(Path(args.out_dir) / "profile.json")
+        return 1 if summary["errors"] else 0
+
+    cache = LineageCache(args.cache_dir, cache_max_bytes) if args.cache_dir else None
+    try:
+        data = build_lineage_cached(SQL, args.dialect, cache, prune=args.prune,
+                                    budget=LineageBudget(**limits) if limits else None)
+    except LineageTimeout as e:
+        print(f"❌ {e}")
+        return 1
+    if "partial" in data:
+        partial = data["partial"]
+        print(f"⚠️ linhagem parcial ({', '.join(partial['reasons'])}): {len(partial['skipped_ctes'])} CTEs puladas, "
+              f"{partial['truncated_leaf_sets']} conjuntos de folhas cortados, "
+              f"{partial['dropped_fallback_edges']} arestas de fallback descartadas.")
+    if args.prune:
+        dead = data["dead_ctes"]
+        print(f"✅ {len(dead)} CTEs mortas{': ' + ', '.join(dead) if dead else ''} "
+              f"({data['dead_columns']} colunas descartadas).")
+    view = data
+    if args.focus:
+        try:
+            view = focus_subgraph(data, args.focus, args.hops)
+        except ValueError as e:
+            parser.error(str(e))
+
+    lineage_path = "lineage." + args.format
+    write_lineage(data, lineage_path)
+    print(f"✅ {lineage_path} gerado.")
+
+    write_html(view, "cte_lineage.html", layout_cache=cache)
+    print("✅ cte_lineage.html gerado.")
+    finish_profile("lineage.profile.json")
+
+    # Dicas de uso no Colab:
+    try:
+        from IPython.display import IFrame, display
+        display(IFrame(src="cte_lineage.html", width="100%", height=600))
+        print("\nAbra também localmente se preferir: cte_lineage.html")
+    except Exception:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# test_lineage_memory.py
+#
+# Memória da resolução: os registros de saída (ColumnOutput) não seguram o AST do
+# sqlglot, e liberar o AST CTE a CTE (release_ast=True, o caminho do build_lineage)
+# baixa o pico medido com tracemalloc.
+#
+#   python -m pytest -q test_lineage_memory.py
+
+import gc
+import tracemalloc
+
+import pytest
+
+import cte_lineage_builder as vsql
+from bench_lineage import synthetic_sql
+
+SQL = synthetic_sql(40, 16, fan_in=3, complexity=2)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def warm_up():
+    # o 1º parse carrega módulos e caches do sqlglot, que não podem entrar na medição
+    vsql.lineage_from_ast(vsql.parse_one(synthetic_sql(10, 4)))
+
+
+def _no_ast(value):
+    """True se `value` (campo de um ColumnOutput) não contém nós do sqlglot."""
+    if isinstance(value, vsql.exp.Expression):
+        return False
+    if isinstance(value, (list, tuple, frozenset)):
+        return all(_no_ast(v) for v in value)
+    return value is None or isinstance(value, (str, bool, vsql.ColumnOutput))
+
+
+def test_column_outputs_hold_no_ast(monkeypatch):
+    resolvers = []
+
+    class RecordingResolver(vsql.LineageResolver):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            resolvers.append(self)
+
+    monkeypatch.setattr(vsql, "LineageResolver", RecordingResolver)
+    vsql.lineage_from_ast(vsql.parse_one(SQL), release_ast=True)
+
+    assert not hasattr(vsql.ColumnOutput("c", "h", [], []), "__dict__")
+    assert "expr" not in vsql.ColumnOutput.__slots__
+    outputs = [o for outs in resolvers[0].outputs.values() for o in outs]
+    assert outputs
+    for o in outputs:
+        for slot in vsql.ColumnOutput.__slots__:
+            assert _no_ast(getattr(o, slot)), (o.name, slot)
+
+
+def _peak(release_ast):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        ast = vsql.parse_one(SQL)
+        vsql.lineage_from_ast(ast, release_ast=release_ast)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_release_lowers_peak_memory():
+    kept = _peak(release_ast=False)
+    released = _peak(release_ast=True)
+    assert released < 0.8 * kept, f"pico {released / 1e6:.1f} MB liberando x {kept / 1e6:.1f} MB sem liberar"
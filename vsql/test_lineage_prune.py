@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# test_lineage_prune.py
+#
+# Poda de CTEs e colunas mortas (build_lineage(prune=True)).
+#
+#   python -m pytest -q test_lineage_prune.py
+
+from pathlib import Path
+
+from cte_lineage_builder import FINAL_SCOPE, build_lineage
+
+HERE = Path(__file__).resolve().parent
+
+
+def test_prune_teste_sql():
+    """No script de exemplo, duas CTEs não chegam à query final e 4 colunas não alimentam nenhuma saída."""
+    data = build_lineage((HERE / "TESTE.sql").read_text(encoding="utf-8"), prune=True)
+    assert data["dead_ctes"] == ["CTE_SOURCE_3", "CTE_JOIN_2"]
+    assert data["dead_columns"] == 4
+    assert not set(data["dead_ctes"]) & set(data["cte_nodes"])
+
+
+def test_prune_keeps_every_union_branch():
+    """Numa query final com UNION, as colunas lidas por qualquer ramo continuam vivas."""
+    sql = ("WITH a AS (SELECT x, y FROM t), b AS (SELECT p, q FROM u) "
+           "SELECT x FROM a UNION ALL SELECT q FROM b")
+    data = build_lineage(sql, prune=True)
+    assert data["dead_ctes"] == []
+    assert data["columns_by_cte"] == {"a": ["x"], "b": ["q"], FINAL_SCOPE: ["x"]}
+    assert data["dead_columns"] == 2
+    assert {"from": "b.q", "to": f"{FINAL_SCOPE}.x"} in data["col_links"]
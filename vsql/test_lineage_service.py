@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# test_lineage_service.py
+#
+# Serviço local (lineage_service.py) numa porta efêmera, exercitado pelo
+# LineageClient: análise normal, agrupamento de requisições idênticas
+# simultâneas, acerto do LRU e corpo que não é UTF-8 (400).
+#
+#   python -m pytest -q test_lineage_service.py
+
+import asyncio
+import http.client
+import threading
+
+import pytest
+
+from bench_lineage import synthetic_sql
+from cte_lineage_builder import FINAL_SCOPE
+from lineage_service import LineageClient, serve
+
+
+@pytest.fixture(scope="module")
+def port():
+    loop = asyncio.new_event_loop()
+    bound = []
+    started = threading.Event()
+
+    def ready(p):
+        bound.append(p)
+        started.set()
+
+    task = loop.create_task(serve(port=0, workers=1, ready=ready))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.close()
+            started.set()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert started.wait(60) and bound, "o serviço não subiu"
+    yield bound[0]
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(60)
+
+
+@pytest.fixture
+def client(port):
+    c = LineageClient(port=port)
+    yield c
+    c.close()
+
+
+def test_build(client):
+    status, data = client.lineage("WITH a AS (SELECT x FROM t) SELECT x FROM a")
+    assert status == 200
+    assert [c["cte_name"] for c in data] == ["a", FINAL_SCOPE]
+    assert data[1]["cte_column"][0]["dependencies"] == [{"cte_name": "a", "column_name": "x"}]
+    assert client.health()["status"] == "ok"
+
+
+def test_invalid_sql_is_422(client):
+    status, data = client.lineage("WITH a AS (SELEC")
+    assert status == 422
+    assert "error" in data
+
+
+def test_concurrent_identical_requests_are_coalesced(port, client):
+    # grande o bastante para a análise ainda estar em andamento quando as outras chegam
+    sql = synthetic_sql(150, 16) + "\n-- agrupamento"
+    before = client.metrics()
+    n = 4
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def request(i):
+        c = LineageClient(port=port)
+        try:
+            barrier.wait()
+            results[i] = c.lineage(sql)
+        finally:
+            c.close()
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(120)
+    after = client.metrics()
+
+    assert all(r is not None and r[0] == 200 for r in results)
+    assert all(r[1] == results[0][1] for r in results)
+    assert after["analyses"] - before["analyses"] == 1
+    assert after["coalesced"] - before["coalesced"] >= 1
+    assert (after["coalesced"] - before["coalesced"]) + (after["cache_hits"] - before["cache_hits"]) == n - 1
+
+
+def test_repeated_request_hits_lru(client):
+    sql = "WITH b AS (SELECT y FROM u) SELECT y FROM b -- lru"
+    first = client.lineage(sql)
+    before = client.metrics()
+    second = client.lineage(sql)
+    after = client.metrics()
+    assert first[0] == second[0] == 200
+    assert first[1] == second[1]
+    assert after["cache_hits"] - before["cache_hits"] == 1
+    assert after["analyses"] == before["analyses"]
+
+
+def test_non_utf8_body_is_400(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        conn.request("POST", "/lineage", body="SELECT 'ç' FROM t".encode("latin-1"),
+                     headers={"Content-Type": "text/plain"})
+        resp = conn.getresponse()
+        body = resp.read().decode("utf-8")
+    finally:
+        conn.close()
+    assert resp.status == 400
+    assert "UTF-8" in body